@@ -1,30 +1,56 @@
 import os
-import shutil
+import bisect
+import json
+import sys
 import time
-from datetime import datetime
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import customtkinter as ctk
 from tkinter import messagebox, filedialog
 from tkinter import ttk
 
+import inventario_core
+from inventario_core import (
+    HEADERS, BloqueoOcupado, HistorialMovimientos, InventarioModel, backup_store, datos_grafico, exportar,
+    format_numbers, get_backend, list_backups, metricas, parse_lote, safe_float, safe_int,
+)
+
 # ============== CONFIGURACIÓN ==============
+# Archivos, modo de guardado y demás parámetros de los datos: ver inventario_core.py
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
 
-ARCHIVO_EXCEL = "Inventario2.0.xlsx"
+INTERVALO_DISCO_MS = 5000  # cada cuánto se revisa si el archivo cambió en disco
+INTERVALO_GUARDADO_MS = 200  # cada cuánto la interfaz lee el estado del guardado
+REINTENTO_BLOQUEO_MS = 250  # cada cuánto se reintenta si otro proceso tiene el bloqueo
+OBJETIVO_INICIO_S = 2.0  # arranque en frío esperado, en segundos (ver medir_inicio)
+
+# Los avisos de carga y guardado del núcleo se muestran en cuadros de diálogo
+def avisar_ventana(nivel, titulo, mensaje):
+    getattr(messagebox, "show" + nivel)(titulo, mensaje)
+
+inventario_core.avisar = avisar_ventana
 
-HEADERS = [
-    "Producto", "Categoría", "Proveedor",
-    "Stock Inicial", "Entradas", "Salidas",
-    "Stock Final", "Stock Mínimo", "Precio Unitario",
-    "Valor Total", "Fecha de Movimiento",
-    "Usuario Responsable", "Observaciones"
-]
+def reintentar(widget, accion, error, limite=None):
+    """Vuelve a correr accion(limite) con after() mientras otro proceso tenga el bloqueo.
 
-MOV_HEADERS = ["Fecha", "Producto", "Tipo", "Cantidad", "Usuario", 
-               "Observaciones", "Stock Antes", "Stock Después"]
+    El modelo de la ventana no espera el bloqueo (espera_bloqueo = 0) para no
+    congelar Tk: la acción falla con BloqueoOcupado antes de cambiar nada y
+    se reintenta hasta ESPERA_BLOQUEO segundos; después se avisa.
+    """
+    limite = limite or time.monotonic() + inventario_core.ESPERA_BLOQUEO
+    if time.monotonic() >= limite:
+        messagebox.showwarning("Inventario ocupado", str(error))
+        return
+    widget.after(REINTENTO_BLOQUEO_MS, lambda: accion(limite))
+
+# Texto del indicador de guardado (ver InventarioModel.save_status)
+ESTADOS_GUARDADO = {
+    "sin guardar": "● Sin guardar",
+    "guardando": "⏳ Guardando...",
+    "guardado": "✔ Guardado",
+    "error": "⚠ Error al guardar",
+}
 
 # Colores personalizados
 COLORS = {
@@ -39,129 +65,11 @@ COLORS = {
     "danger": "#4F6B72"       # Rojo peligro
 }
 
-# ============== UTILIDADES ==============
-def safe_int(x, default=0):
-    try:
-        if pd.isna(x):
-            return default
-        return int(float(str(x).replace(',', '.')))
-    except Exception:
-        return default
-
-def safe_float(x, default=0.0):
-    try:
-        if pd.isna(x):
-            return default
-        return float(str(x).replace(',', '.'))
-    except Exception:
-        return default
-
-def backup_file(path=ARCHIVO_EXCEL):
-    if os.path.exists(path):
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        bak = f"{os.path.splitext(path)[0]}_bak_{timestamp}.xlsx"
-        try:
-            shutil.copy2(path, bak)
-            return True
-        except Exception:
-            return False
-    return False
-
-def list_backups():
-    base = os.path.splitext(ARCHIVO_EXCEL)[0]
-    files = [f for f in os.listdir('.') if f.startswith(base + "_bak_") and f.endswith('.xlsx')]
-    files.sort(reverse=True)
-    return files
-
-def load_data():
-    if os.path.exists(ARCHIVO_EXCEL):
-        try:
-            xls = pd.ExcelFile(ARCHIVO_EXCEL, engine="openpyxl")
-            df_inv = pd.read_excel(xls, sheet_name='Inventario2.0', engine='openpyxl') if 'Inventario2.0' in xls.sheet_names else pd.DataFrame(columns=HEADERS)
-            df_mov = pd.read_excel(xls, sheet_name='Movimientos', engine='openpyxl') if 'Movimientos' in xls.sheet_names else pd.DataFrame(columns=MOV_HEADERS)
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al leer {ARCHIVO_EXCEL}: {e}")
-            df_inv = pd.DataFrame(columns=HEADERS)
-            df_mov = pd.DataFrame(columns=MOV_HEADERS)
-    else:
-        df_inv = pd.DataFrame(columns=HEADERS)
-        df_mov = pd.DataFrame(columns=MOV_HEADERS)
-        save_data(df_inv, df_mov)
-
-    # Asegurar columnas
-    for c in HEADERS:
-        if c not in df_inv.columns:
-            df_inv[c] = pd.NA
-    for c in MOV_HEADERS:
-        if c not in df_mov.columns:
-            df_mov[c] = pd.NA
-
-    # Normalizar tipos
-    for col in ['Stock Inicial', 'Entradas', 'Salidas', 'Stock Final']:
-        try:
-            df_inv[col] = pd.to_numeric(df_inv[col], errors='coerce').fillna(0).astype(int)
-        except Exception:
-            df_inv[col] = 0
-    
-    try:
-        df_inv['Stock Mínimo'] = pd.to_numeric(df_inv['Stock Mínimo'], errors='coerce')
-        df_inv['Precio Unitario'] = pd.to_numeric(df_inv['Precio Unitario'], errors='coerce').fillna(0.0).astype(float)
-        df_inv['Valor Total'] = pd.to_numeric(df_inv['Valor Total'], errors='coerce').fillna(0.0).astype(float)
-    except Exception:
-        pass
-
-    try:
-        df_mov['Fecha'] = pd.to_datetime(df_mov['Fecha'], errors='coerce')
-    except Exception:
-        pass
-
-    return df_inv, df_mov
-
-def save_data(df_inv, df_mov, path=ARCHIVO_EXCEL):
-    try:
-        backup_file(path)
-        with pd.ExcelWriter(path, engine='openpyxl') as writer:
-            df_inv.to_excel(writer, sheet_name='Inventario2.0', index=False)
-            df_mov.to_excel(writer, sheet_name='Movimientos', index=False)
-        return True
-    except Exception as e:
-        messagebox.showerror("Error", f"Error al guardar: {e}")
-        return False
-
-def find_product(df_inv, name, partial=True):
-    name_norm = str(name).strip().lower()
-    if name_norm == "":
-        return []
-    exact = df_inv[df_inv['Producto'].astype(str).str.strip().str.lower() == name_norm]
-    if not exact.empty:
-        return list(exact.index)
-    if partial:
-        matches = df_inv[df_inv['Producto'].astype(str).fillna('').str.strip().str.lower().str.contains(name_norm)]
-        return list(matches.index)
-    return []
-
-def log_movement(df_mov, producto, tipo, cantidad, usuario, observaciones, stock_antes, stock_despues):
-    fecha = pd.Timestamp.now()
-    new = {
-        'Fecha': fecha,
-        'Producto': producto,
-        'Tipo': tipo,
-        'Cantidad': cantidad,
-        'Usuario': usuario,
-        'Observaciones': observaciones,
-        'Stock Antes': stock_antes,
-        'Stock Después': stock_despues
-    }
-    df_mov = pd.concat([df_mov, pd.DataFrame([new])], ignore_index=True)
-    return df_mov
-
 # ============== VENTANAS DE DIÁLOGO ==============
 class AgregarProductoDialog(ctk.CTkToplevel):
-    def __init__(self, parent, df_inv, df_mov, callback):
+    def __init__(self, parent, model):
         super().__init__(parent)
-        self.df_inv = df_inv
-        self.df_mov = df_mov
-        self.callback = callback
+        self.model = model
         self.result = None
         
         self.title("🌸 Agregar Producto")
@@ -230,13 +138,13 @@ class AgregarProductoDialog(ctk.CTkToplevel):
                                   width=150)
         cancel_btn.pack(side="left", padx=5)
     
-    def guardar(self):
+    def guardar(self, limite=None):
         producto = self.entries["Producto"].get().strip()
         if not producto:
             messagebox.showwarning("Atención", "El campo 'Producto' es obligatorio")
             return
         
-        if find_product(self.df_inv, producto, partial=False):
+        if self.model.find_product(producto, partial=False):
             messagebox.showwarning("Error", "El producto ya existe")
             return
         
@@ -252,32 +160,26 @@ class AgregarProductoDialog(ctk.CTkToplevel):
             usuario = self.entries["Usuario Responsable"].get().strip() or pd.NA
             observaciones = self.entries["Observaciones"].get().strip() or pd.NA
             
-            self.df_inv.loc[len(self.df_inv)] = [
-                producto, categoria, proveedor,
-                stock_inicial, 0, 0, stock_inicial,
-                stock_minimo, precio_unitario,
-                stock_inicial * precio_unitario,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                usuario, observaciones
-            ]
-            
-            save_data(self.df_inv, self.df_mov)
-            self.callback()
+            self.model.add_product(producto, categoria, proveedor, stock_inicial,
+                                   stock_minimo, precio_unitario, usuario, observaciones)
             messagebox.showinfo("Éxito", f"🌟 Producto '{producto}' agregado correctamente")
             self.destroy()
             
+        except BloqueoOcupado as e:
+            reintentar(self, self.guardar, e, limite)
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo agregar el producto:\n{e}")
 
 class EditarProductoDialog(ctk.CTkToplevel):
-    def __init__(self, parent, df_inv, df_mov, idx, callback):
+    def __init__(self, parent, model, idx):
         super().__init__(parent)
-        self.df_inv = df_inv
-        self.df_mov = df_mov
+        self.model = model
         self.idx = idx
-        self.callback = callback
+        # Si otro usuario cambia el producto mientras el diálogo está abierto
+        # el modelo lo detecta con esta versión
+        self.version = model.product_version(idx)
         
-        prod = df_inv.loc[idx]
+        prod = model.df_inv.loc[idx]
         self.title(f"✏️ Editar: {prod['Producto']}")
         self.geometry("500x500")
         self.resizable(False, False)
@@ -337,46 +239,46 @@ class EditarProductoDialog(ctk.CTkToplevel):
                                   width=150)
         cancel_btn.pack(side="left", padx=5)
     
-    def guardar(self):
+    def guardar(self, limite=None):
         try:
             categoria = self.entries["Categoría"].get().strip() or pd.NA
             proveedor = self.entries["Proveedor"].get().strip() or pd.NA
             usuario = self.entries["Usuario Responsable"].get().strip() or pd.NA
             observaciones = self.entries["Observaciones"].get().strip() or pd.NA
             
+            fields = {}
             if self.entries["Precio Unitario"].get().strip():
-                nuevo_precio = safe_float(self.entries["Precio Unitario"].get())
-                self.df_inv.at[self.idx, "Precio Unitario"] = nuevo_precio
-                self.df_inv.at[self.idx, "Valor Total"] = self.df_inv.at[self.idx, "Stock Final"] * nuevo_precio
+                fields["Precio Unitario"] = safe_float(self.entries["Precio Unitario"].get())
             
             if self.entries["Stock Mínimo"].get().strip():
-                self.df_inv.at[self.idx, "Stock Mínimo"] = int(self.entries["Stock Mínimo"].get())
+                fields["Stock Mínimo"] = int(self.entries["Stock Mínimo"].get())
             else:
-                self.df_inv.at[self.idx, "Stock Mínimo"] = pd.NA
+                fields["Stock Mínimo"] = pd.NA
             
-            self.df_inv.at[self.idx, "Categoría"] = categoria
-            self.df_inv.at[self.idx, "Proveedor"] = proveedor
-            self.df_inv.at[self.idx, "Usuario Responsable"] = usuario
-            self.df_inv.at[self.idx, "Observaciones"] = observaciones
-            self.df_inv.at[self.idx, "Fecha de Movimiento"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            fields["Categoría"] = categoria
+            fields["Proveedor"] = proveedor
+            fields["Usuario Responsable"] = usuario
+            fields["Observaciones"] = observaciones
             
-            save_data(self.df_inv, self.df_mov)
-            self.callback()
+            self.model.update_product(self.idx, fields, self.version)
             messagebox.showinfo("Éxito", "📝 Producto actualizado correctamente")
             self.destroy()
             
+        except BloqueoOcupado as e:
+            reintentar(self, self.guardar, e, limite)
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo actualizar:\n{e}")
 
 class MovimientoDialog(ctk.CTkToplevel):
-    def __init__(self, parent, df_inv, df_mov, idx, callback):
+    def __init__(self, parent, model, idx):
         super().__init__(parent)
-        self.df_inv = df_inv
-        self.df_mov = df_mov
+        self.model = model
         self.idx = idx
-        self.callback = callback
+        # Si otro usuario cambia el producto mientras el diálogo está abierto
+        # el modelo lo detecta con esta versión
+        self.version = model.product_version(idx)
         
-        prod = df_inv.loc[idx]
+        prod = model.df_inv.loc[idx]
         self.title(f"📦 Movimiento: {prod['Producto']}")
         self.geometry("450x400")
         self.resizable(False, False)
@@ -455,51 +357,446 @@ class MovimientoDialog(ctk.CTkToplevel):
                                   width=150)
         cancel_btn.pack(side="left", padx=5)
     
-    def guardar(self):
+    def guardar(self, limite=None):
         try:
             tipo = self.tipo_var.get()
             cantidad = safe_int(self.cantidad_entry.get(), 0)
+            usuario = self.usuario_entry.get().strip() or pd.NA
+            obs = self.obs_entry.get().strip() or pd.NA
             
-            if cantidad <= 0:
-                messagebox.showwarning("Atención", "La cantidad debe ser mayor a 0")
+            try:
+                self.model.record_movement(self.idx, tipo, cantidad, usuario, obs, self.version)
+            except BloqueoOcupado as e:
+                reintentar(self, self.guardar, e, limite)
+                return
+            except ValueError as e:
+                messagebox.showwarning("Error", str(e))
                 return
             
-            usuario = self.usuario_entry.get().strip() or pd.NA
-            obs = self.obs_entry.get().strip() or pd.NA
+            messagebox.showinfo("Éxito", f"✅ {tipo} registrada correctamente")
+            self.destroy()
             
-            stock_antes = safe_int(self.df_inv.loc[self.idx, 'Stock Final'])
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo registrar el movimiento:\n{e}")
+
+class LoteMovimientoDialog(ctk.CTkToplevel):
+    """Registra muchos movimientos de una vez (p. ej. la recepción de un pedido)."""
+    
+    def __init__(self, parent, model):
+        super().__init__(parent)
+        self.model = model
+        
+        self.title("📥 Movimientos en Lote")
+        self.geometry("600x600")
+        
+        self.transient(parent)
+        self.grab_set()
+        self.configure(fg_color=COLORS["bg"])
+        
+        self.create_widgets()
+    
+    def create_widgets(self):
+        main_frame = ctk.CTkFrame(self, fg_color="transparent")
+        main_frame.pack(fill="both", expand=True, padx=20, pady=20)
+        
+        title = ctk.CTkLabel(main_frame, text="Movimientos en Lote", 
+                            font=ctk.CTkFont(size=18, weight="bold"),
+                            text_color=COLORS["primary"])
+        title.pack(pady=(0, 10))
+        
+        help_label = ctk.CTkLabel(main_frame,
+                                  text="Una línea por movimiento: producto; tipo; cantidad\n"
+                                       "o producto; cantidad (usa el tipo por defecto). "
+                                       "Se puede pegar desde Excel.",
+                                  font=ctk.CTkFont(size=12))
+        help_label.pack(pady=(0, 10))
+        
+        # Tipo por defecto
+        tipo_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        tipo_frame.pack(fill="x", pady=5)
+        
+        ctk.CTkLabel(tipo_frame, text="Tipo por defecto:", width=130, anchor="w").pack(side="left")
+        self.tipo_var = ctk.StringVar(value="Entrada")
+        tipo_menu = ctk.CTkOptionMenu(tipo_frame, variable=self.tipo_var,
+                                     values=["Entrada", "Salida"],
+                                     fg_color=COLORS["primary"],
+                                     button_color=COLORS["accent"],
+                                     button_hover_color=COLORS["hover"])
+        tipo_menu.pack(side="left", fill="x", expand=True)
+        
+        # Líneas
+        self.lines_text = ctk.CTkTextbox(main_frame, height=250)
+        self.lines_text.pack(fill="both", expand=True, pady=10)
+        
+        # Usuario
+        user_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        user_frame.pack(fill="x", pady=5)
+        
+        ctk.CTkLabel(user_frame, text="Usuario:", width=130, anchor="w").pack(side="left")
+        self.usuario_entry = ctk.CTkEntry(user_frame)
+        self.usuario_entry.pack(side="left", fill="x", expand=True)
+        
+        # Observaciones
+        obs_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        obs_frame.pack(fill="x", pady=5)
+        
+        ctk.CTkLabel(obs_frame, text="Observaciones:", width=130, anchor="w").pack(side="left")
+        self.obs_entry = ctk.CTkEntry(obs_frame)
+        self.obs_entry.pack(side="left", fill="x", expand=True)
+        
+        # Botones
+        btn_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        btn_frame.pack(pady=15)
+        
+        save_btn = ctk.CTkButton(btn_frame, text="💾 Guardar Lote",
+                                command=self.guardar,
+                                fg_color=COLORS["primary"],
+                                hover_color=COLORS["hover"],
+                                width=150)
+        save_btn.pack(side="left", padx=5)
+        
+        cancel_btn = ctk.CTkButton(btn_frame, text="✖ Cancelar",
+                                  command=self.destroy,
+                                  fg_color=COLORS["secondary"],
+                                  hover_color=COLORS["hover"],
+                                  width=150)
+        cancel_btn.pack(side="left", padx=5)
+    
+    def mostrar_errores(self, errores):
+        texto = "\n".join(errores[:15])
+        if len(errores) > 15:
+            texto += f"\n... y {len(errores) - 15} más"
+        messagebox.showwarning("Errores en el lote", f"No se registró ningún movimiento:\n\n{texto}")
+    
+    def guardar(self, limite=None):
+        try:
+            entries, errores = parse_lote(self.lines_text.get("1.0", "end"), self.tipo_var.get())
+            if not entries and not errores:
+                messagebox.showwarning("Atención", "Ingrese al menos un movimiento")
+                return
             
-            if tipo == "Entrada":
-                self.df_inv.loc[self.idx, 'Entradas'] += cantidad
-                self.df_inv.loc[self.idx, 'Stock Final'] += cantidad
-            else:  # Salida
-                if stock_antes < cantidad:
-                    messagebox.showwarning("Error", "Stock insuficiente")
-                    return
-                self.df_inv.loc[self.idx, 'Salidas'] += cantidad
-                self.df_inv.loc[self.idx, 'Stock Final'] -= cantidad
+            lines, faltantes = self.model.resolve_movements(entries)
+            errores += faltantes
             
-            self.df_inv.loc[self.idx, 'Valor Total'] = (
-                self.df_inv.loc[self.idx, 'Stock Final'] * 
-                safe_float(self.df_inv.loc[self.idx, 'Precio Unitario'])
-            )
-            self.df_inv.loc[self.idx, 'Fecha de Movimiento'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if not errores:
+                errores = self.model.validate_movements(lines)
+            if errores:
+                self.mostrar_errores(errores)
+                return
             
-            self.df_mov = log_movement(
-                self.df_mov,
-                self.df_inv.loc[self.idx, 'Producto'],
-                tipo, cantidad, usuario, obs,
-                stock_antes,
-                self.df_inv.loc[self.idx, 'Stock Final']
-            )
+            usuario = self.usuario_entry.get().strip() or pd.NA
+            obs = self.obs_entry.get().strip() or pd.NA
+            self.model.record_movements(lines, usuario, obs)
             
-            save_data(self.df_inv, self.df_mov)
-            self.callback()
-            messagebox.showinfo("Éxito", f"✅ {tipo} registrada correctamente")
+            messagebox.showinfo("Éxito", f"✅ {len(lines)} movimientos registrados correctamente")
             self.destroy()
             
+        except BloqueoOcupado as e:
+            reintentar(self, self.guardar, e, limite)
         except Exception as e:
-            messagebox.showerror("Error", f"No se pudo registrar el movimiento:\n{e}")
+            messagebox.showerror("Error", f"No se pudo registrar el lote:\n{e}")
+
+# ============== TABLAS ==============
+class TreeSync:
+    """Sincroniza un ttk.Treeview con filas identificadas por ids estables.
+
+    Recuerda los valores mostrados por cada iid y solo inserta, actualiza o
+    borra los ítems que realmente cambiaron, en lugar de vaciar la tabla.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self._values = {}
+
+    def sync(self, rows):
+        """Deja la tabla con exactamente `rows` (lista ordenada de (iid, values))."""
+        wanted = dict(rows)
+        stale = [iid for iid in self._values if iid not in wanted]
+        if stale:
+            self.tree.delete(*stale)
+            for iid in stale:
+                del self._values[iid]
+        
+        for pos, (iid, values) in enumerate(rows):
+            old = self._values.get(iid)
+            if old is None:
+                self.tree.insert("", pos, iid=iid, values=values)
+            elif old != values:
+                self.tree.item(iid, values=values)
+            self._values[iid] = values
+
+    def upsert(self, iid, values, index="end"):
+        old = self._values.get(iid)
+        if old is None:
+            self.tree.insert("", index, iid=iid, values=values)
+        elif old != values:
+            self.tree.item(iid, values=values)
+        self._values[iid] = values
+
+    def remove(self, iid):
+        if self._values.pop(iid, None) is not None:
+            self.tree.delete(iid)
+
+class VirtualTreeview:
+    """Tabla virtual: solo crea ítems para la ventana visible más un margen.
+
+    `keys` son los índices del DataFrame ya ordenados y filtrados sobre el
+    conjunto completo; los valores de cada fila se piden a `values_for(key)`
+    recién cuando la fila entra en la ventana. La barra de desplazamiento
+    representa el total de filas, no los ítems creados.
+    """
+    BUFFER = 10
+
+    def __init__(self, tree, scrollbar, values_for):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.values_for = values_for
+        self.sync = TreeSync(tree)
+        self.keys = np.array([], dtype=np.int64)
+        self.offset = 0
+        self.visible = int(tree.cget("height"))
+        
+        scrollbar.configure(command=self.yview)
+        tree.bind("<Configure>", self._on_resize)
+        tree.bind("<MouseWheel>", self._on_wheel)
+        tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        tree.bind("<Button-5>", lambda e: self.scroll(3))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set_keys(self, keys):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.offset = 0
+        self.render()
+
+    def insert_keys(self, keys, index=0):
+        if index == "end":
+            index = len(self.keys)
+        self.keys = np.insert(self.keys, index, np.asarray(keys, dtype=np.int64))
+        self.render()
+
+    def render(self):
+        total = len(self.keys)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        window = self.keys[self.offset:self.offset + self.visible + self.BUFFER]
+        self.sync.sync([(str(k), self.values_for(k)) for k in window])
+        self.tree.yview_moveto(0)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll(self, rows):
+        self.offset += rows
+        self.render()
+        return "break"
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.keys))
+            self.render()
+        elif args[0] == "scroll":
+            rows = int(args[1])
+            if args[2] == "pages":
+                rows *= self.visible
+            self.scroll(rows)
+
+    def _on_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_resize(self, event):
+        rowheight = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        # Descontar una fila para el encabezado
+        visible = max(1, event.height // rowheight - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()
+
+# ============== GRÁFICOS ==============
+class ChartManager:
+    """Gráficos de la pestaña Análisis sobre una sola Figure y un solo canvas.
+
+    Cada gráfico tiene sus propios Axes dentro de la figura, creados la
+    primera vez que se muestra; cambiar de gráfico solo cambia cuál está
+    visible. Los datos de cada gráfico (datos_grafico) se cachean por InventarioModel.version
+    y sus opciones (período y filtro de los del historial): sin cambios no se
+    recalculan ni se redibujan, y si cambian las barras y líneas se
+    actualizan en el lugar cuando su cantidad no varió.
+    """
+
+    def __init__(self, master, model):
+        # matplotlib se importa recién aquí (al abrir Análisis). Se usa Figure
+        # y no pyplot: pyplot guarda cada figura creada hasta que se cierra.
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        self.model = model
+        self.figure = Figure(figsize=(10, 6))
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.widget = self.canvas.get_tk_widget()
+        self.axes = {}      # gráfico -> Axes
+        self.artists = {}   # gráfico -> artistas dibujados
+        self.drawn = {}     # gráfico -> datos con los que se dibujó
+        self.cache = {}     # gráfico -> ((versión, opciones), datos)
+        self.margins = {}   # gráfico -> márgenes calculados por tight_layout
+        self.actual = None
+
+    def data(self, nombre, **opciones):
+        """Datos agregados del gráfico, recalculados solo si cambió el modelo."""
+        clave = (self.model.version, tuple(sorted(opciones.items())))
+        anterior = self.cache.get(nombre)
+        if anterior is not None and anterior[0] == clave:
+            return anterior[1]
+        with metricas.tramo(f"grafico.{nombre}.datos") as t:
+            datos = datos_grafico(self.model, nombre, **opciones)
+            t.filas = len(datos)
+        if anterior is not None and anterior[0][1] == clave[1] and anterior[1].equals(datos):
+            datos = anterior[1]  # mismo objeto: no hace falta redibujar
+        self.cache[nombre] = (clave, datos)
+        return datos
+
+    def show(self, nombre, **opciones):
+        """Muestra el gráfico `nombre`; devuelve False si no hay datos."""
+        datos = self.data(nombre, **opciones)
+        if datos.empty:
+            return False
+        if self.drawn.get(nombre) is not datos:
+            ax = self.axes.get(nombre)
+            if ax is None:
+                ax = self.axes[nombre] = self.figure.add_subplot(111, label=nombre)
+            with metricas.tramo(f"grafico.{nombre}.dibujo") as t:
+                self.artists[nombre] = getattr(self, "_dibujar_" + nombre)(ax, datos, self.artists.get(nombre))
+                t.filas = len(datos)
+            self.drawn[nombre] = datos
+            self.margins.pop(nombre, None)
+        elif nombre == self.actual:
+            return True
+        for n, ax in self.axes.items():
+            ax.set_visible(n == nombre)
+        self.actual = nombre
+        # tight_layout mide los textos; se calcula una vez por dibujo y al
+        # volver al gráfico solo se reaplican sus márgenes
+        if nombre in self.margins:
+            self.figure.subplots_adjust(**self.margins[nombre])
+        else:
+            self.figure.tight_layout()
+            sp = self.figure.subplotpars
+            self.margins[nombre] = dict(left=sp.left, right=sp.right, top=sp.top, bottom=sp.bottom)
+        self.widget.pack(fill="both", expand=True)
+        self.canvas.draw_idle()
+        return True
+
+    # --- dibujo: actualizan los artistas si la cantidad coincide, si no rehacen el Axes ---
+    @staticmethod
+    def _reusable(artistas, n):
+        return artistas is not None and all(len(grupo) == n for grupo in artistas)
+
+    @staticmethod
+    def _rescale(ax):
+        ax.relim()
+        ax.autoscale_view()
+
+    def _dibujar_stock(self, ax, datos, artistas):
+        x = range(len(datos))
+        if self._reusable(artistas, len(datos)):
+            for barra, valor in zip(artistas[0], datos):
+                barra.set_height(valor)
+            self._rescale(ax)
+        else:
+            ax.clear()
+            artistas = [ax.bar(x, datos, color=COLORS["primary"], alpha=0.7)]
+            ax.set_xlabel("Producto", fontsize=12, fontweight='bold')
+            ax.set_ylabel("Stock Final", fontsize=12, fontweight='bold')
+            ax.set_title("📊 Stock por Producto (Top 20)", fontsize=14, fontweight='bold')
+            ax.set_xticks(x)
+            ax.grid(axis='y', alpha=0.3)
+        ax.set_xticklabels(datos.index, rotation=45, ha='right')
+        return artistas
+
+    def _dibujar_valor(self, ax, datos, artistas):
+        y = range(len(datos))
+        if self._reusable(artistas, len(datos)):
+            for barra, valor in zip(artistas[0], datos):
+                barra.set_width(valor)
+            self._rescale(ax)
+        else:
+            ax.clear()
+            artistas = [ax.barh(y, datos, color=COLORS["accent"], alpha=0.7)]
+            ax.set_yticks(y)
+            ax.set_xlabel("Valor Total ($)", fontsize=12, fontweight='bold')
+            ax.set_title("💰 Valor Total por Producto (Top 20)", fontsize=14, fontweight='bold')
+            ax.grid(axis='x', alpha=0.3)
+        ax.set_yticklabels(datos.index)
+        return artistas
+
+    def _dibujar_categoria(self, ax, datos, artistas):
+        # Las porciones de una torta no se pueden actualizar: se rehace
+        ax.clear()
+        colors = ['#FF1493', '#FFB6D5', '#FF69B4', '#FF85C1', '#FFC0CB']
+        ax.pie(datos.values, labels=datos.index, autopct='%1.1f%%',
+               colors=colors, startangle=90)
+        ax.set_title("🏷️ Stock por Categoría", fontsize=14, fontweight='bold')
+        return None
+
+    def _dibujar_stock_bajo(self, ax, datos, artistas):
+        x = range(len(datos))
+        width = 0.35
+        if self._reusable(artistas, len(datos)):
+            for grupo, col in zip(artistas, ('Stock Final', 'Stock Mínimo')):
+                for barra, valor in zip(grupo, datos[col]):
+                    barra.set_height(valor)
+            self._rescale(ax)
+        else:
+            ax.clear()
+            artistas = [
+                ax.bar([i - width/2 for i in x], datos['Stock Final'], width,
+                       label='Stock Actual', color=COLORS["danger"], alpha=0.7),
+                ax.bar([i + width/2 for i in x], datos['Stock Mínimo'], width,
+                       label='Stock Mínimo', color=COLORS["warning"], alpha=0.7),
+            ]
+            ax.set_xlabel("Producto", fontsize=12, fontweight='bold')
+            ax.set_ylabel("Cantidad", fontsize=12, fontweight='bold')
+            ax.set_title("⚠️ Productos con Stock Bajo", fontsize=14, fontweight='bold')
+            ax.set_xticks(x)
+            ax.legend()
+            ax.grid(axis='y', alpha=0.3)
+        ax.set_xticklabels(datos.index, rotation=45, ha='right')
+        return artistas
+
+    def _dibujar_flujo(self, ax, datos, artistas):
+        # Las líneas admiten otra cantidad de puntos: siempre se actualizan
+        if artistas is not None:
+            for linea, col in zip(artistas, datos.columns):
+                linea.set_data(datos.index, datos[col])
+            self._rescale(ax)
+        else:
+            artistas = [
+                ax.plot(datos.index, datos['Entradas'], label='Entradas', color=COLORS["success"],
+                        marker='o', markersize=3)[0],
+                ax.plot(datos.index, datos['Salidas'], label='Salidas', color=COLORS["danger"],
+                        linestyle='--', marker='o', markersize=3)[0],
+            ]
+            ax.set_xlabel("Período", fontsize=12, fontweight='bold')
+            ax.set_ylabel("Unidades", fontsize=12, fontweight='bold')
+            ax.tick_params(axis='x', rotation=45)
+            ax.legend()
+            ax.grid(alpha=0.3)
+        ax.set_title(datos.attrs["titulo"], fontsize=14, fontweight='bold')
+        return artistas
+
+    def _dibujar_evolucion(self, ax, datos, artistas):
+        if artistas is not None:
+            artistas[0].set_data(datos.index, datos.values)
+            self._rescale(ax)
+        else:
+            artistas = ax.plot(datos.index, datos.values, color=COLORS["primary"], drawstyle='steps-post',
+                               marker='o', markersize=3)
+            ax.set_xlabel("Período", fontsize=12, fontweight='bold')
+            ax.set_ylabel("Stock", fontsize=12, fontweight='bold')
+            ax.tick_params(axis='x', rotation=45)
+            ax.grid(alpha=0.3)
+        ax.set_title(datos.attrs["titulo"], fontsize=14, fontweight='bold')
+        return artistas
 
 # ============== APLICACIÓN PRINCIPAL ==============
 class InventarioApp(ctk.CTk):
@@ -510,13 +807,61 @@ class InventarioApp(ctk.CTk):
         self.geometry("1400x800")
         self.minsize(1000, 600)
         
-        self.df_inv, self.df_mov = load_data()
+        self.model = InventarioModel()
+        # Nunca esperar el bloqueo en el hilo de Tk: ver reintentar
+        self.model.espera_bloqueo = 0
+        self.model.subscribe(self.on_model_change)
+        self.avisar_guardado = False
+        # Se crean al abrir su pestaña por primera vez (ver on_tab_change)
+        self.mov_table = None
+        self.backup_list = None
+        self.backups_al_dia = False
         
         self.configure(fg_color=COLORS["bg"])
         
         self.create_widgets()
         self.refresh_all()
         
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(INTERVALO_DISCO_MS, self.check_disk)
+        self.after(INTERVALO_GUARDADO_MS, self.check_save)
+    
+    @property
+    def df_inv(self):
+        return self.model.df_inv
+    
+    @property
+    def df_mov(self):
+        return self.model.df_mov
+        
+    def on_close(self):
+        # Al cerrar sí se espera a otro proceso para exportar lo pendiente
+        self.model.espera_bloqueo = None
+        try:
+            self.model.close()
+        except Exception as e:
+            messagebox.showerror("Error", f"Error al guardar: {e}")
+        self.destroy()
+    
+    def check_disk(self):
+        # Releer solo si otro proceso modificó el archivo
+        self.model.reload_if_changed()
+        self.after(INTERVALO_DISCO_MS, self.check_disk)
+    
+    def check_save(self):
+        # Los avisos del hilo de guardado se atienden aquí, en el hilo de Tk
+        for evento, detalle in self.model.save_events():
+            if evento == "error":
+                messagebox.showerror("Error", f"Error al guardar: {detalle}")
+            elif evento == "guardado":
+                self.refresh_backups()
+                if self.avisar_guardado:
+                    self.avisar_guardado = False
+                    messagebox.showinfo("Éxito", "✅ Datos guardados correctamente")
+        estado = self.model.save_status()
+        self.save_label.configure(text=ESTADOS_GUARDADO[estado])
+        self.after(INTERVALO_GUARDADO_MS, self.check_save)
+        
     def create_widgets(self):
         # Título principal
         header = ctk.CTkFrame(self, height=80, fg_color=COLORS["primary"])
@@ -529,10 +874,16 @@ class InventarioApp(ctk.CTk):
                                    text_color="white")
         title_label.pack(expand=True)
         
+        self.save_label = ctk.CTkLabel(header, text=ESTADOS_GUARDADO["guardado"],
+                                       font=ctk.CTkFont(size=12),
+                                       text_color="white")
+        self.save_label.place(relx=0.98, rely=0.5, anchor="e")
+        
         # Tabview
         self.tabview = ctk.CTkTabview(self, fg_color="white", 
                                       segmented_button_fg_color=COLORS["secondary"],
-                                      segmented_button_selected_color=COLORS["primary"])
+                                      segmented_button_selected_color=COLORS["primary"],
+                                      command=self.on_tab_change)
         self.tabview.pack(fill="both", expand=True, padx=10, pady=10)
         
         # Crear pestañas
@@ -541,10 +892,25 @@ class InventarioApp(ctk.CTk):
         self.tab_analisis = self.tabview.add("📊 Análisis")
         self.tab_config = self.tabview.add("⚙️ Configuración")
         
+        # Solo Gestión se arma antes de mostrar la ventana; las demás
+        # pestañas, la primera vez que se seleccionan
         self.setup_tab_gestion()
-        self.setup_tab_movimientos()
-        self.setup_tab_analisis()
-        self.setup_tab_config()
+        self.tabs_pendientes = {
+            self.tab_movimientos: self.setup_tab_movimientos,
+            self.tab_analisis: self.setup_tab_analisis,
+            self.tab_config: self.setup_tab_config,
+        }
+    
+    def current_tab(self):
+        return self.tabview.tab(self.tabview.get())
+    
+    def on_tab_change(self):
+        tab = self.current_tab()
+        setup = self.tabs_pendientes.pop(tab, None)
+        if setup:
+            setup()
+        if tab is self.tab_config and not self.backups_al_dia:
+            self.refresh_backups()
         
     def setup_tab_gestion(self):
         # Frame superior con búsqueda
@@ -589,6 +955,8 @@ class InventarioApp(ctk.CTk):
             ("➕ Agregar Producto", self.agregar_producto, COLORS["success"]),
             ("✏️ Editar Producto", self.editar_producto, COLORS["primary"]),
             ("📦 Movimiento", self.movimiento_stock, COLORS["accent"]),
+            ("📥 Movimientos en Lote", self.movimiento_lote, COLORS["accent"]),
+            ("📂 Importar CSV/Excel", self.importar_archivo, COLORS["accent"]),
             ("🗑️ Eliminar Producto", self.eliminar_producto, COLORS["danger"]),
             ("⚠️ Alertas Stock", self.alertas_stock, COLORS["warning"]),
             ("💾 Guardar", self.guardar_datos, COLORS["primary"]),
@@ -624,6 +992,7 @@ class InventarioApp(ctk.CTk):
                 'Stock Mínimo', 'Precio Unitario', 'Valor Total']
         
         self.tree_inv = ttk.Treeview(tree_container, columns=cols, show='headings', height=20)
+        self.inv_sync = TreeSync(self.tree_inv)
         
         # Configurar columnas
         col_widths = {
@@ -668,7 +1037,7 @@ class InventarioApp(ctk.CTk):
         # Búsqueda
         self.search_mov_var = ctk.StringVar()
         search_entry = ctk.CTkEntry(top_frame, textvariable=self.search_mov_var,
-                                   placeholder_text="Buscar en movimientos...",
+                                   placeholder_text="Buscar... (ej: usuario:ana tipo:salida)",
                                    width=300)
         search_entry.pack(side="left", padx=10)
         
@@ -719,6 +1088,7 @@ class InventarioApp(ctk.CTk):
                 'Observaciones', 'Stock Antes', 'Stock Después']
         
         self.tree_mov = ttk.Treeview(tree_container, columns=cols, show='headings', height=20)
+        self.mov_query = ""
         
         col_widths = {
             'Fecha': 150,
@@ -735,9 +1105,12 @@ class InventarioApp(ctk.CTk):
             self.tree_mov.heading(col, text=col)
             self.tree_mov.column(col, width=col_widths.get(col, 100), anchor="center")
         
-        vsb = ttk.Scrollbar(tree_container, orient="vertical", command=self.tree_mov.yview)
+        # La barra vertical la maneja la tabla virtual
+        vsb = ttk.Scrollbar(tree_container, orient="vertical")
         hsb = ttk.Scrollbar(tree_container, orient="horizontal", command=self.tree_mov.xview)
-        self.tree_mov.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        self.tree_mov.configure(xscrollcommand=hsb.set)
+        self.mov_table = VirtualTreeview(self.tree_mov, vsb,
+                                         lambda idx: self.movimiento_values(self.model.movimientos.row(idx)))
         
         self.tree_mov.grid(row=0, column=0, sticky="nsew")
         vsb.grid(row=0, column=1, sticky="ns")
@@ -745,6 +1118,8 @@ class InventarioApp(ctk.CTk):
         
         tree_container.grid_rowconfigure(0, weight=1)
         tree_container.grid_columnconfigure(0, weight=1)
+        
+        self.refresh_movimientos()
     
     def setup_tab_analisis(self):
         # Frame superior
@@ -790,16 +1165,45 @@ class InventarioApp(ctk.CTk):
                                 height=40)
         btn_bajo.pack(pady=10, padx=10, fill="x")
         
+        # Series de tiempo del historial: período y producto o categoría
+        hist_label = ctk.CTkLabel(control_panel, text="Historial de Movimientos",
+                                  font=ctk.CTkFont(size=13, weight="bold"),
+                                  text_color=COLORS["primary"])
+        hist_label.pack(pady=(20, 5), padx=10)
+        
+        self.periodo_var = ctk.StringVar(value=HistorialMovimientos.FRECUENCIAS["D"])
+        periodo_menu = ctk.CTkOptionMenu(control_panel, variable=self.periodo_var,
+                                         values=list(HistorialMovimientos.FRECUENCIAS.values()),
+                                         fg_color=COLORS["primary"])
+        periodo_menu.pack(pady=5, padx=10, fill="x")
+        
+        self.serie_entry = ctk.CTkEntry(control_panel, placeholder_text="Producto o categoría (vacío = todo)")
+        self.serie_entry.pack(pady=5, padx=10, fill="x")
+        
+        btn_flujo = ctk.CTkButton(control_panel, text="📈 Entradas vs Salidas",
+                                 command=self.grafico_flujo,
+                                 fg_color=COLORS["primary"],
+                                 height=40)
+        btn_flujo.pack(pady=10, padx=10, fill="x")
+        
+        btn_evolucion = ctk.CTkButton(control_panel, text="📦 Evolución del Stock",
+                                      command=self.grafico_evolucion,
+                                      fg_color=COLORS["accent"],
+                                      height=40)
+        btn_evolucion.pack(pady=10, padx=10, fill="x")
+        
         # Frame para gráficos
         self.graph_frame = ctk.CTkFrame(content_frame)
         self.graph_frame.pack(side="right", fill="both", expand=True)
         
-        # Mensaje inicial
+        # Mensaje inicial (el canvas de los gráficos lo tapa al mostrarse)
         welcome_label = ctk.CTkLabel(self.graph_frame, 
                                      text="Seleccione un tipo de gráfico",
                                      font=ctk.CTkFont(size=20),
                                      text_color=COLORS["primary"])
         welcome_label.place(relx=0.5, rely=0.5, anchor="center")
+        
+        self.charts = ChartManager(self.graph_frame, self.model)
     
     def setup_tab_config(self):
         # Frame principal
@@ -816,7 +1220,7 @@ class InventarioApp(ctk.CTk):
         info_frame = ctk.CTkFrame(main_frame)
         info_frame.pack(fill="x", pady=10)
         
-        file_label = ctk.CTkLabel(info_frame, text=f"📁 Archivo: {os.path.abspath(ARCHIVO_EXCEL)}",
+        file_label = ctk.CTkLabel(info_frame, text=f"📁 Archivo: {os.path.abspath(get_backend().path)}",
                                  font=ctk.CTkFont(size=12))
         file_label.pack(pady=10, padx=10)
         
@@ -845,6 +1249,10 @@ class InventarioApp(ctk.CTk):
                                   font=ctk.CTkFont(size=14, weight="bold"))
         folder_btn.pack(side="left", padx=10, fill="x", expand=True)
         
+        # Diagnóstico: solo con las métricas activas (INVENTARIO_METRICAS)
+        if metricas.activa:
+            self.setup_diagnostico(main_frame)
+        
         # Lista de backups
         backup_label = ctk.CTkLabel(main_frame, text="Backups Disponibles:",
                                    font=ctk.CTkFont(size=14, weight="bold"))
@@ -866,7 +1274,31 @@ class InventarioApp(ctk.CTk):
         delete_btn.pack(pady=10, padx=10, fill="x")
         
         self.backup_vars = []
-        self.refresh_backups()
+    
+    def setup_diagnostico(self, parent):
+        diag_frame = ctk.CTkFrame(parent)
+        diag_frame.pack(fill="x", pady=10)
+        
+        top = ctk.CTkFrame(diag_frame, fg_color="transparent")
+        top.pack(fill="x", padx=10, pady=(10, 5))
+        
+        ctk.CTkLabel(top, text="🔬 Diagnóstico (tiempos por operación)",
+                    font=ctk.CTkFont(size=14, weight="bold")).pack(side="left")
+        
+        for texto_btn, comando in (("📤 Exportar JSON", self.exportar_diagnostico),
+                                   ("↺ Reiniciar", self.reiniciar_diagnostico),
+                                   ("🔄 Actualizar", self.refresh_diagnostico)):
+            ctk.CTkButton(top, text=texto_btn, command=comando,
+                         fg_color=COLORS["secondary"], width=130).pack(side="right", padx=5)
+        
+        cols = ['Operación', 'Llamadas', 'Total (ms)', 'Promedio (ms)', 'Máximo (ms)', 'Filas', 'Bytes']
+        self.diag_tree = ttk.Treeview(diag_frame, columns=cols, show='headings', height=8)
+        for col in cols:
+            self.diag_tree.heading(col, text=col)
+            self.diag_tree.column(col, width=220 if col == 'Operación' else 110,
+                                  anchor="w" if col == 'Operación' else "e")
+        self.diag_tree.pack(fill="x", padx=10, pady=(0, 10))
+        self.refresh_diagnostico()
     
     # ============== MÉTODOS DE GESTIÓN ==============
     def get_selected_index(self):
@@ -880,21 +1312,52 @@ class InventarioApp(ctk.CTk):
             return None
     
     def agregar_producto(self):
-        AgregarProductoDialog(self, self.df_inv, self.df_mov, self.refresh_all)
+        AgregarProductoDialog(self, self.model)
     
     def editar_producto(self):
         idx = self.get_selected_index()
         if idx is None:
             messagebox.showwarning("Atención", "Seleccione un producto de la tabla")
             return
-        EditarProductoDialog(self, self.df_inv, self.df_mov, idx, self.refresh_all)
+        EditarProductoDialog(self, self.model, idx)
     
     def movimiento_stock(self):
         idx = self.get_selected_index()
         if idx is None:
             messagebox.showwarning("Atención", "Seleccione un producto de la tabla")
             return
-        MovimientoDialog(self, self.df_inv, self.df_mov, idx, self.refresh_all)
+        MovimientoDialog(self, self.model, idx)
+    
+    def movimiento_lote(self):
+        LoteMovimientoDialog(self, self.model)
+    
+    def importar_archivo(self):
+        path = filedialog.askopenfilename(
+            title="Importar productos o movimientos",
+            filetypes=[("CSV o Excel", "*.csv *.xlsx"), ("All files", "*.*")]
+        )
+        if path:
+            self.importar(path)
+    
+    def importar(self, path, limite=None):
+        try:
+            res = self.model.import_file(path)
+        except BloqueoOcupado as e:
+            reintentar(self, lambda l: self.importar(path, l), e, limite)
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo importar:\n{e}")
+            return
+        
+        mensaje = f"📂 {res.aceptadas} {res.tipo} importados"
+        if res.rechazadas:
+            reporte = os.path.splitext(path)[0] + "_rechazos.csv"
+            try:
+                res.write_rejects(reporte)
+                mensaje += f"\n⚠️ {res.rechazadas} filas rechazadas, detalle en:\n{reporte}"
+            except Exception as e:
+                mensaje += f"\n⚠️ {res.rechazadas} filas rechazadas (no se pudo escribir el reporte: {e})"
+        messagebox.showinfo("Importación", mensaje)
     
     def eliminar_producto(self):
         idx = self.get_selected_index()
@@ -904,29 +1367,38 @@ class InventarioApp(ctk.CTk):
         
         prod_name = self.df_inv.at[idx, 'Producto']
         if messagebox.askyesno("Confirmar", f"¿Eliminar '{prod_name}'?"):
-            self.df_inv.drop(index=idx, inplace=True)
-            self.df_inv.reset_index(drop=True, inplace=True)
-            save_data(self.df_inv, self.df_mov)
-            self.refresh_all()
-            messagebox.showinfo("Eliminado", "🗑️ Producto eliminado correctamente")
+            self.eliminar(idx, prod_name)
     
-    def alertas_stock(self):
-        if 'Stock Mínimo' not in self.df_inv.columns:
-            messagebox.showinfo("Alertas", "No hay productos con stock mínimo definido")
+    def eliminar(self, idx, prod_name, limite=None):
+        if idx not in self.df_inv.index or self.df_inv.at[idx, 'Producto'] != prod_name:
+            # Se recargó mientras se reintentaba: el producto puede tener otro id
+            encontrados = self.model.find_product(prod_name, partial=False)
+            if not encontrados:
+                messagebox.showwarning("Atención", f"'{prod_name}' ya no existe")
+                return
+            idx = encontrados[0]
+        try:
+            self.model.delete_product(idx)
+        except BloqueoOcupado as e:
+            reintentar(self, lambda l: self.eliminar(idx, prod_name, l), e, limite)
             return
-        
-        df = self.df_inv.copy()
-        df['Stock Mínimo'] = pd.to_numeric(df['Stock Mínimo'], errors='coerce')
-        df['Stock Final'] = pd.to_numeric(df['Stock Final'], errors='coerce').fillna(0)
-        df_mins = df[df['Stock Mínimo'].notna()]
-        
-        if df_mins.empty:
+        except ValueError as e:  # Conflicto: otro usuario lo eliminó o renombró
+            messagebox.showwarning("Error", str(e))
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo eliminar el producto:\n{e}")
+            return
+        messagebox.showinfo("Eliminado", "🗑️ Producto eliminado correctamente")
+    
+    def alertas_stock(self):
+        resumen = self.model.resumen
+        if not resumen.con_minimo:
             messagebox.showinfo("Alertas", "No hay productos con stock mínimo definido")
             return
         
-        bajos = df_mins[df_mins['Stock Final'] <= df_mins['Stock Mínimo']]
+        bajos = resumen.stock_bajo()
         
-        if bajos.empty:
+        if not bajos:
             messagebox.showinfo("Alertas", "✨ Todos los productos tienen stock suficiente")
             return
         
@@ -944,11 +1416,11 @@ class InventarioApp(ctk.CTk):
         scroll_frame = ctk.CTkScrollableFrame(alert_win)
         scroll_frame.pack(fill="both", expand=True, padx=20, pady=(0, 20))
         
-        for _, row in bajos.iterrows():
+        for _, producto, stock, minimo in bajos:
             alert_frame = ctk.CTkFrame(scroll_frame, fg_color=COLORS["warning"])
             alert_frame.pack(fill="x", pady=5, padx=5)
             
-            text = f"🌸 {row['Producto']}: Stock: {int(row['Stock Final'])} | Mínimo: {int(row['Stock Mínimo'])}"
+            text = f"🌸 {producto}: Stock: {int(stock)} | Mínimo: {int(minimo)}"
             label = ctk.CTkLabel(alert_frame, text=text, font=ctk.CTkFont(size=12))
             label.pack(pady=10, padx=10)
         
@@ -1002,103 +1474,115 @@ class InventarioApp(ctk.CTk):
     
     # ============== MÉTODOS DE ACTUALIZACIÓN ==============
     def refresh_all(self):
-        self.df_inv, self.df_mov = load_data()
         self.refresh_inventario()
         self.refresh_movimientos()
     
+    def on_model_change(self, cambios):
+        if cambios.productos is None:
+            self.refresh_inventario()
+        elif cambios.productos:
+            self.actualizar_productos(cambios.productos)
+        
+        if cambios.movimientos is None:
+            self.refresh_movimientos()
+        elif cambios.movimientos:
+            self.agregar_movimientos(cambios.movimientos)
+    
+    @metricas.medir()
     def refresh_inventario(self):
-        self.tree_inv.delete(*self.tree_inv.get_children())
+        self.inv_display = self.producto_display(self.df_inv)
         self.filtrar_inventario()
     
-    def format_number(self, value):
-        """Formatea números: sin decimales si es entero, con decimales si no"""
-        try:
-            num = float(value)
-            if num == int(num):  # Es un número entero
-                return f"{int(num):,}".replace(",", ".")
-            else:  # Tiene decimales
-                return f"{num:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        except:
-            return str(value)
+    def producto_display(self, df):
+        """Valores de tree_inv para todas las filas de df, formateados por columna."""
+        stock = pd.to_numeric(df['Stock Final'], errors='coerce').fillna(0).astype(int)
+        minimo = pd.to_numeric(df['Stock Mínimo'], errors='coerce')
+        minimo = minimo.round().astype('Int64').astype(object).where(minimo.notna(), '')
+        values = zip(
+            df['Producto'], df['Categoría'], df['Proveedor'],
+            stock, minimo,
+            format_numbers(df['Precio Unitario']),
+            format_numbers(df['Valor Total'])
+        )
+        return pd.Series(list(values), index=df.index, dtype=object)
     
+    @metricas.medir()
     def filtrar_inventario(self):
-        query = self.search_var.get().strip().lower()
-        self.tree_inv.delete(*self.tree_inv.get_children())
-        
-        for idx, row in self.df_inv.iterrows():
-            prod = str(row.get('Producto', '')).lower()
-            cat = str(row.get('Categoría', '')).lower()
-            prov = str(row.get('Proveedor', '')).lower()
-            
-            if query == "" or query in prod or query in cat or query in prov:
-                precio = row.get('Precio Unitario', 0)
-                valor_total = row.get('Valor Total', 0)
-                
-                values = [
-                    row.get('Producto', ''),
-                    row.get('Categoría', ''),
-                    row.get('Proveedor', ''),
-                    int(row.get('Stock Final', 0)) if pd.notna(row.get('Stock Final')) else 0,
-                    int(row.get('Stock Mínimo', 0)) if pd.notna(row.get('Stock Mínimo')) else '',
-                    self.format_number(precio),
-                    self.format_number(valor_total)
-                ]
-                self.tree_inv.insert("", "end", iid=str(idx), values=values)
+        keys = self.model.filter_products(self.search_var.get())
+        display = self.inv_display.loc[keys]
+        self.inv_sync.sync(list(zip(keys.astype(str), display)))
+    
+    @metricas.medir(filas=lambda r, self, indices: len(indices))
+    def actualizar_productos(self, indices):
+        """Refresca solo las filas de tree_inv de los productos indicados."""
+        if len(indices) > 50:
+            # Con muchos cambios (p. ej. una importación) conviene rehacer la tabla
+            self.refresh_inventario()
+            return
+        query = self.search_var.get()
+        vivos = [i for i in indices if i in self.df_inv.index]
+        self.inv_display = self.inv_display.drop(index=[i for i in indices if i not in vivos], errors='ignore')
+        for idx, values in self.producto_display(self.df_inv.loc[vivos]).items():
+            self.inv_display.loc[idx] = values
+        
+        for idx in sorted(indices):
+            iid = str(idx)
+            if idx in vivos and self.model.product_matches(idx, query):
+                # Mantener el orden por id: posición = ids visibles menores
+                visibles = [int(c) for c in self.tree_inv.get_children()]
+                pos = bisect.bisect_left(visibles, idx)
+                self.inv_sync.upsert(iid, self.inv_display.loc[idx], pos)
+            else:
+                self.inv_sync.remove(iid)
+    
+    def movimiento_values(self, row):
+        fecha = row.get('Fecha', '')
+        if pd.notna(fecha):
+            try:
+                fecha = pd.to_datetime(fecha).strftime("%Y-%m-%d %H:%M:%S")
+            except:
+                pass
+        
+        return (
+            fecha,
+            row.get('Producto', ''),
+            row.get('Tipo', ''),
+            row.get('Cantidad', ''),
+            row.get('Usuario', ''),
+            row.get('Observaciones', ''),
+            row.get('Stock Antes', ''),
+            row.get('Stock Después', '')
+        )
     
+    @metricas.medir()
     def refresh_movimientos(self):
-        self.tree_mov.delete(*self.tree_mov.get_children())
-        
-        dfm = self.df_mov.copy()
+        if self.mov_table is None:
+            return  # se llena al abrir la pestaña
+        self.mov_query = ""
         try:
-            dfm = dfm.sort_values('Fecha', ascending=False)
+            keys = self.df_mov.sort_values('Fecha', ascending=False, kind='stable').index
         except:
-            pass
-        
-        for _, row in dfm.iterrows():
-            fecha = row.get('Fecha', '')
-            if pd.notna(fecha):
-                try:
-                    fecha = pd.to_datetime(fecha).strftime("%Y-%m-%d %H:%M:%S")
-                except:
-                    pass
-            
-            values = [
-                fecha,
-                row.get('Producto', ''),
-                row.get('Tipo', ''),
-                row.get('Cantidad', ''),
-                row.get('Usuario', ''),
-                row.get('Observaciones', ''),
-                row.get('Stock Antes', ''),
-                row.get('Stock Después', '')
-            ]
-            self.tree_mov.insert("", "end", values=values)
+            keys = self.df_mov.index
+        self.mov_table.set_keys(keys)
     
+    @metricas.medir()
     def buscar_movimientos(self):
-        query = self.search_mov_var.get().strip().lower()
-        self.tree_mov.delete(*self.tree_mov.get_children())
-        
-        for _, row in self.df_mov.iterrows():
-            vals = [str(v).lower() for v in row.values]
-            if any(query in v for v in vals):
-                fecha = row.get('Fecha', '')
-                if pd.notna(fecha):
-                    try:
-                        fecha = pd.to_datetime(fecha).strftime("%Y-%m-%d %H:%M:%S")
-                    except:
-                        pass
-                
-                values = [
-                    fecha,
-                    row.get('Producto', ''),
-                    row.get('Tipo', ''),
-                    row.get('Cantidad', ''),
-                    row.get('Usuario', ''),
-                    row.get('Observaciones', ''),
-                    row.get('Stock Antes', ''),
-                    row.get('Stock Después', '')
-                ]
-                self.tree_mov.insert("", "end", values=values)
+        query = self.search_mov_var.get().strip()
+        self.mov_query = query
+        self.mov_table.set_keys(self.model.search_movements(query))
+    
+    @metricas.medir(filas=lambda r, self, indices: len(indices))
+    def agregar_movimientos(self, indices):
+        """Agrega a la tabla de movimientos solo los movimientos nuevos."""
+        if self.mov_table is None:
+            return
+        if self.mov_query:
+            # Los resultados de búsqueda siguen el orden del historial
+            coinciden = self.model.search_movements(self.mov_query)
+            self.mov_table.insert_keys(coinciden[coinciden.isin(indices)], "end")
+        else:
+            # El más reciente queda arriba
+            self.mov_table.insert_keys(indices[::-1], 0)
     
     def limpiar_busqueda_mov(self):
         self.search_mov_var.set("")
@@ -1111,133 +1595,49 @@ class InventarioApp(ctk.CTk):
         )
         if path:
             try:
-                self.df_mov.to_csv(path, index=False, encoding='utf-8-sig')
+                exportar(self.model, "movimientos", path)
                 messagebox.showinfo("Éxito", f"📤 Movimientos exportados a:\n{path}")
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo exportar:\n{e}")
     
     # ============== MÉTODOS DE GRÁFICOS ==============
-    def clear_graph_frame(self):
-        for widget in self.graph_frame.winfo_children():
-            widget.destroy()
+    def mostrar_grafico(self, nombre, sin_datos, **opciones):
+        if not self.charts.show(nombre, **opciones):
+            messagebox.showinfo("Gráfico", sin_datos)
     
     def grafico_stock(self):
-        self.clear_graph_frame()
-        
-        df_plot = self.df_inv[self.df_inv['Producto'].astype(str).str.strip() != ''].copy()
-        if df_plot.empty:
-            messagebox.showinfo("Gráfico", "No hay productos para graficar")
-            return
-        
-        df_plot = df_plot.sort_values('Stock Final', ascending=False).head(20)
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
-        bars = ax.bar(range(len(df_plot)), df_plot['Stock Final'], 
-                     color=COLORS["primary"], alpha=0.7)
-        ax.set_xlabel("Producto", fontsize=12, fontweight='bold')
-        ax.set_ylabel("Stock Final", fontsize=12, fontweight='bold')
-        ax.set_title("📊 Stock por Producto (Top 20)", fontsize=14, fontweight='bold')
-        ax.set_xticks(range(len(df_plot)))
-        ax.set_xticklabels(df_plot['Producto'], rotation=45, ha='right')
-        ax.grid(axis='y', alpha=0.3)
-        
-        plt.tight_layout()
-        
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.mostrar_grafico("stock", "No hay productos para graficar")
     
     def grafico_valor(self):
-        self.clear_graph_frame()
-        
-        df_plot = self.df_inv[self.df_inv['Valor Total'] > 0].copy()
-        if df_plot.empty:
-            messagebox.showinfo("Gráfico", "No hay datos de valor total")
-            return
-        
-        df_plot = df_plot.sort_values('Valor Total', ascending=False).head(20)
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
-        bars = ax.barh(range(len(df_plot)), df_plot['Valor Total'],
-                      color=COLORS["accent"], alpha=0.7)
-        ax.set_yticks(range(len(df_plot)))
-        ax.set_yticklabels(df_plot['Producto'])
-        ax.set_xlabel("Valor Total ($)", fontsize=12, fontweight='bold')
-        ax.set_title("💰 Valor Total por Producto (Top 20)", fontsize=14, fontweight='bold')
-        ax.grid(axis='x', alpha=0.3)
-        
-        plt.tight_layout()
-        
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.mostrar_grafico("valor", "No hay datos de valor total")
     
     def grafico_categoria(self):
-        self.clear_graph_frame()
-        
-        df_cat = self.df_inv.groupby('Categoría')['Stock Final'].sum()
-        
-        if df_cat.empty:
-            messagebox.showinfo("Gráfico", "No hay categorías para graficar")
-            return
-        
-        fig, ax = plt.subplots(figsize=(8, 8))
-        colors = ['#FF1493', '#FFB6D5', '#FF69B4', '#FF85C1', '#FFC0CB']
-        ax.pie(df_cat.values, labels=df_cat.index, autopct='%1.1f%%',
-              colors=colors, startangle=90)
-        ax.set_title("🏷️ Stock por Categoría", fontsize=14, fontweight='bold')
-        
-        plt.tight_layout()
-        
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.mostrar_grafico("categoria", "No hay categorías para graficar")
     
     def grafico_stock_bajo(self):
-        self.clear_graph_frame()
-        
-        df = self.df_inv.copy()
-        df['Stock Mínimo'] = pd.to_numeric(df['Stock Mínimo'], errors='coerce')
-        df['Stock Final'] = pd.to_numeric(df['Stock Final'], errors='coerce').fillna(0)
-        df_mins = df[df['Stock Mínimo'].notna()]
-        bajos = df_mins[df_mins['Stock Final'] <= df_mins['Stock Mínimo']]
-        
-        if bajos.empty:
-            messagebox.showinfo("Gráfico", "✨ No hay productos con stock bajo")
-            return
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
-        x = range(len(bajos))
-        width = 0.35
-        
-        ax.bar([i - width/2 for i in x], bajos['Stock Final'], width,
-              label='Stock Actual', color=COLORS["danger"], alpha=0.7)
-        ax.bar([i + width/2 for i in x], bajos['Stock Mínimo'], width,
-              label='Stock Mínimo', color=COLORS["warning"], alpha=0.7)
-        
-        ax.set_xlabel("Producto", fontsize=12, fontweight='bold')
-        ax.set_ylabel("Cantidad", fontsize=12, fontweight='bold')
-        ax.set_title("⚠️ Productos con Stock Bajo", fontsize=14, fontweight='bold')
-        ax.set_xticks(x)
-        ax.set_xticklabels(bajos['Producto'], rotation=45, ha='right')
-        ax.legend()
-        ax.grid(axis='y', alpha=0.3)
-        
-        plt.tight_layout()
-        
-        canvas = FigureCanvasTkAgg(fig, master=self.graph_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.mostrar_grafico("stock_bajo", "✨ No hay productos con stock bajo")
+    
+    def opciones_historial(self):
+        frecuencias = {v: k for k, v in HistorialMovimientos.FRECUENCIAS.items()}
+        return dict(frecuencia=frecuencias[self.periodo_var.get()], filtro=self.serie_entry.get())
+    
+    def grafico_flujo(self):
+        self.mostrar_grafico("flujo", "No hay movimientos para graficar", **self.opciones_historial())
+    
+    def grafico_evolucion(self):
+        self.mostrar_grafico("evolucion", "No hay movimientos con stock registrado", **self.opciones_historial())
     
     # ============== MÉTODOS DE CONFIGURACIÓN ==============
-    def guardar_datos(self, show_msg=False):
-        if save_data(self.df_inv, self.df_mov):
-            if show_msg:
-                messagebox.showinfo("Éxito", "✅ Datos guardados correctamente")
-            self.refresh_backups()
+    def guardar_datos(self, show_msg=False, limite=None):
+        # El aviso llega por check_save cuando termine la escritura
+        self.avisar_guardado = show_msg
+        try:
+            self.model.save()
+        except BloqueoOcupado as e:
+            reintentar(self, lambda l: self.guardar_datos(show_msg, l), e, limite)
     
     def crear_backup_manual(self):
-        if backup_file():
+        if get_backend().backup():
             messagebox.showinfo("Backup", "📦 Backup creado correctamente")
             self.refresh_backups()
         else:
@@ -1254,7 +1654,40 @@ class InventarioApp(ctk.CTk):
         except:
             messagebox.showinfo("Carpeta", f"Ruta: {folder}")
     
+    def refresh_diagnostico(self):
+        resumen = metricas.resumen()
+        self.diag_tree.delete(*self.diag_tree.get_children())
+        for nombre, op in resumen["operaciones"].items():
+            self.diag_tree.insert("", "end", values=(
+                nombre, op["llamadas"],
+                f"{op['total_s'] * 1000:,.1f}", f"{op['promedio_ms']:,.2f}", f"{op['max_s'] * 1000:,.1f}",
+                f"{op['filas']:,}", f"{op['bytes']:,}"))
+        # Los contadores sueltos (recargas, fusiones...) solo tienen cantidad
+        for nombre, n in resumen["contadores"].items():
+            self.diag_tree.insert("", "end", values=(nombre, n, "", "", "", "", ""))
+    
+    def reiniciar_diagnostico(self):
+        metricas.reiniciar()
+        self.refresh_diagnostico()
+    
+    def exportar_diagnostico(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+        )
+        if path:
+            try:
+                metricas.dump(path)
+                messagebox.showinfo("Éxito", f"🔬 Diagnóstico exportado a:\n{path}")
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo exportar:\n{e}")
+    
     def refresh_backups(self):
+        # La lista solo se arma con la pestaña a la vista; si no, al abrirla
+        self.backups_al_dia = False
+        if self.backup_list is None or self.current_tab() is not self.tab_config:
+            return
+        self.backups_al_dia = True
         for widget in self.backup_list.winfo_children():
             widget.destroy()
         
@@ -1287,7 +1720,7 @@ class InventarioApp(ctk.CTk):
         if messagebox.askyesno("Confirmar", f"¿Eliminar {len(selected)} backup(s)?"):
             for filename in selected:
                 try:
-                    os.remove(filename)
+                    backup_store().remove(filename)
                 except Exception as e:
                     messagebox.showerror("Error", f"No se pudo eliminar {filename}:\n{e}")
             
@@ -1295,6 +1728,40 @@ class InventarioApp(ctk.CTk):
             self.refresh_backups()
 
 # ============== EJECUCIÓN ==============
-if __name__ == "__main__":
+def medir_inicio(repeticiones=5):
+    """Benchmark de arranque en frío: cada corrida es un proceso nuevo que
+    importa el módulo, abre la ventana hasta el primer dibujo y se cierra.
+    Imprime cada corrida y la mediana; devuelve False si la mediana supera
+    OBJETIVO_INICIO_S."""
+    import subprocess
+    totales = []
+    for n in range(1, repeticiones + 1):
+        t0 = time.perf_counter()
+        salida = subprocess.run([sys.executable, os.path.abspath(__file__), "--inicio-una-vez"],
+                                capture_output=True, text=True, check=True)
+        total = time.perf_counter() - t0
+        fases = json.loads(salida.stdout.strip().splitlines()[-1])
+        totales.append(total)
+        print(f"Corrida {n}: total {total:.2f} s | importación {total - fases['ventana'] - fases['dibujo']:.2f} s"
+              f" | ventana {fases['ventana']:.2f} s | primer dibujo {fases['dibujo']:.2f} s")
+    mediana = sorted(totales)[len(totales) // 2]
+    print(f"Mediana: {mediana:.2f} s (objetivo {OBJETIVO_INICIO_S:.2f} s)")
+    return mediana <= OBJETIVO_INICIO_S
+
+def inicio_una_vez():
+    t0 = time.perf_counter()
     app = InventarioApp()
-    app.mainloop()
\ No newline at end of file
+    t1 = time.perf_counter()
+    app.update()
+    t2 = time.perf_counter()
+    print(json.dumps({"ventana": t1 - t0, "dibujo": t2 - t1}))
+    app.on_close()
+
+if __name__ == "__main__":
+    if "--medir-inicio" in sys.argv:
+        sys.exit(0 if medir_inicio() else 1)
+    elif "--inicio-una-vez" in sys.argv:
+        inicio_una_vez()
+    else:
+        app = InventarioApp()
+        app.mainloop()
\ No newline at end of file
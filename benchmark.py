@@ -0,0 +1,337 @@
+"""Benchmark del núcleo del inventario sin interfaz gráfica.
+
+Genera un inventario sintético (productos y un historial de movimientos
+coherente con su stock), lo guarda con el modo de guardado elegido en una
+carpeta temporal y mide la carga, el guardado, las búsquedas, el registro
+de movimientos y los datos de cada gráfico. Los resultados quedan en un
+JSON para comparar corridas entre versiones:
+
+    python benchmark.py --escala chica
+    python benchmark.py --productos 100000 --movimientos 5000000 --modo sqlite
+    python benchmark.py --escala mediana --comparar benchmark_anterior.json
+"""
+import os
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import inventario_core as core
+
+# ============== CONFIGURACIÓN ==============
+# productos, movimientos
+ESCALAS = {
+    "chica": (1_000, 10_000),
+    "mediana": (10_000, 500_000),
+    "grande": (100_000, 5_000_000),
+}
+FILAS_HOJA = 1_048_575  # filas de datos que entran en una hoja de Excel
+REPETICIONES = 3
+BUSQUEDAS = 1_000        # búsquedas de find_product por corrida
+MOVIMIENTOS_NUEVOS = 1_000  # llamadas a log_movement por corrida
+
+CATEGORIAS = 25
+PROVEEDORES = 60
+USUARIOS = ["ana", "luis", "marta", "pedro", "sofia", "bodega", "compras", "ventas"]
+
+# ============== DATOS SINTÉTICOS ==============
+def generar_productos(n, rng):
+    """Inventario de `n` productos con stock inicial y sin movimientos."""
+    stock = rng.integers(50, 1_000, n)
+    precio = np.round(rng.uniform(0.5, 500.0, n), 2)
+    minimo = pd.array(rng.integers(0, 60, n), dtype="Int64")
+    minimo[rng.random(n) < 0.2] = pd.NA
+    categorias = np.array([f"Categoría {i}" for i in range(CATEGORIAS)], dtype=object)
+    proveedores = np.array([f"Proveedor {i}" for i in range(PROVEEDORES)], dtype=object)
+    return pd.DataFrame({
+        "Producto": [f"Producto {i:06d}" for i in range(n)],
+        "Categoría": categorias[rng.integers(0, CATEGORIAS, n)],
+        "Proveedor": proveedores[rng.integers(0, PROVEEDORES, n)],
+        "Stock Inicial": stock,
+        "Entradas": 0,
+        "Salidas": 0,
+        "Stock Final": stock,
+        "Stock Mínimo": minimo,
+        "Precio Unitario": precio,
+        "Valor Total": stock * precio,
+        "Fecha de Movimiento": "2024-01-01 00:00:00",
+        "Usuario Responsable": pd.NA,
+        "Observaciones": pd.NA,
+        "Versión": 1,
+    }, columns=core.HEADERS)
+
+def generar_movimientos(df_inv, n, rng, dias=730):
+    """Historial de `n` movimientos sobre df_inv, en orden de fecha.
+
+    Los productos se eligen con sesgo (unos pocos concentran la mayoría de
+    los movimientos, como en un inventario real). Stock Antes/Después se
+    encadenan por producto y df_inv queda con las Entradas, Salidas, Stock
+    Final, Valor Total y Versión que resultan.
+    """
+    productos = len(df_inv)
+    prod = np.minimum((rng.pareto(1.2, n) * productos / 20).astype(np.int64), productos - 1)
+    prod = rng.permutation(productos)[prod]
+    entrada = rng.random(n) < 0.55
+    cantidad = np.where(entrada, rng.integers(1, 21, n), rng.integers(1, 11, n))
+    delta = np.where(entrada, cantidad, -cantidad)
+    segundos = np.sort(rng.integers(0, dias * 86_400, n))
+    fecha = np.datetime64("2024-01-01T08:00:00") + segundos.astype("timedelta64[s]")
+
+    inicial = df_inv["Stock Inicial"].to_numpy(dtype=np.int64)
+    acumulado = pd.Series(delta).groupby(prod).cumsum().to_numpy()
+    despues = inicial[prod] + acumulado
+    observaciones = np.full(n, None, dtype=object)
+    con_obs = rng.random(n) < 0.1
+    observaciones[con_obs] = [f"pedido {k}" for k in rng.integers(1, 5_000, con_obs.sum())]
+    df_mov = pd.DataFrame({
+        "Fecha": fecha,
+        "Producto": df_inv["Producto"].to_numpy(dtype=object)[prod],
+        "Tipo": np.where(entrada, "Entrada", "Salida").astype(object),
+        "Cantidad": cantidad,
+        "Usuario": np.array(USUARIOS, dtype=object)[rng.integers(0, len(USUARIOS), n)],
+        "Observaciones": observaciones,
+        "Stock Antes": despues - delta,
+        "Stock Después": despues,
+    }, columns=core.MOV_HEADERS)
+
+    entradas = np.bincount(prod, weights=np.where(entrada, cantidad, 0), minlength=productos).astype(np.int64)
+    salidas = np.bincount(prod, weights=np.where(entrada, 0, cantidad), minlength=productos).astype(np.int64)
+    final = inicial + entradas - salidas
+    df_inv["Entradas"] = entradas
+    df_inv["Salidas"] = salidas
+    df_inv["Stock Final"] = final
+    df_inv["Valor Total"] = final * df_inv["Precio Unitario"].to_numpy()
+    df_inv["Versión"] = 1 + np.bincount(prod, minlength=productos)
+    return df_mov
+
+def generar(productos, movimientos, semilla=0):
+    """(df_inv, df_mov) sintéticos y reproducibles para la misma semilla."""
+    rng = np.random.default_rng(semilla)
+    df_inv = generar_productos(productos, rng)
+    df_mov = generar_movimientos(df_inv, movimientos, rng)
+    return df_inv, df_mov
+
+# ============== MEDICIÓN ==============
+def cronometrar(funcion, repeticiones=REPETICIONES, preparar=None, operaciones=1):
+    """Corre `funcion` varias veces; `preparar` (si hay) va antes de cada
+    corrida y fuera del tiempo. Con `operaciones` > 1 se informa además el
+    tiempo por operación."""
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+    tiempos.sort()
+    resultado = {"mediana_s": tiempos[len(tiempos) // 2], "min_s": tiempos[0],
+                 "max_s": tiempos[-1], "repeticiones": repeticiones}
+    if operaciones > 1:
+        resultado["operaciones"] = operaciones
+        resultado["por_operacion_us"] = resultado["mediana_s"] / operaciones * 1e6
+    return resultado
+
+class Benchmark:
+    """Una corrida: datos generados en una carpeta temporal y resultados por nombre."""
+
+    def __init__(self, productos, movimientos, modo, repeticiones=REPETICIONES, semilla=0):
+        if modo != "sqlite" and movimientos > FILAS_HOJA:
+            raise ValueError(f"{movimientos:,} movimientos no entran en una hoja de Excel "
+                             f"(máximo {FILAS_HOJA:,}); use --modo sqlite")
+        self.productos = productos
+        self.movimientos = movimientos
+        self.modo = modo
+        self.repeticiones = repeticiones
+        self.semilla = semilla
+        self.resultados = {}
+
+    def medir(self, nombre, funcion, **opciones):
+        opciones.setdefault("repeticiones", self.repeticiones)
+        resultado = cronometrar(funcion, **opciones)
+        self.resultados[nombre] = resultado
+        por_op = f" ({resultado['por_operacion_us']:.1f} µs/op)" if "por_operacion_us" in resultado else ""
+        print(f"  {nombre:<40} {resultado['mediana_s'] * 1000:>10.1f} ms{por_op}", flush=True)
+
+    def correr(self):
+        carpeta = tempfile.mkdtemp(prefix="inventario_bench_")
+        anterior = os.getcwd()
+        os.chdir(carpeta)
+        core.MODO_GUARDADO = self.modo
+        core._backend = None
+        try:
+            self._datos()
+            self._almacenamiento()
+            model = core.InventarioModel()
+            self._busquedas(model)
+            self._graficos(model)
+            self._registro(model)
+            model.close()
+        finally:
+            os.chdir(anterior)
+            core._backend = None
+            core._stores.clear()
+            core._bloqueos.clear()
+            shutil.rmtree(carpeta, ignore_errors=True)
+        return self.informe()
+
+    # --- etapas ---
+    def _datos(self):
+        print(f"Generando {self.productos:,} productos y {self.movimientos:,} movimientos...", flush=True)
+        datos = {}
+
+        def generar_datos():
+            datos["inv"], datos["mov"] = generar(self.productos, self.movimientos, self.semilla)
+        self.medir("generar", generar_datos, repeticiones=1)
+        self.df_inv, self.df_mov = core.normalize_frames(datos["inv"], datos["mov"])
+
+    def _almacenamiento(self):
+        print(f"Almacenamiento ({self.modo}):", flush=True)
+        self.medir("save_data", lambda: core.save_data(self.df_inv, self.df_mov))
+        self.medir("load_data", core.load_data)
+        backend = core.get_backend()
+        cache = getattr(backend, "cache", None)
+        if cache:
+            def sin_cache():
+                if os.path.exists(cache):
+                    os.remove(cache)
+            self.medir("load_data.sin_cache", core.load_data, preparar=sin_cache)
+        model = core.InventarioModel()
+        self.medir("modelo.load", model.load)
+        model.close(exportar=False)
+
+    def _busquedas(self, model):
+        print("Búsquedas:", flush=True)
+        rng = np.random.default_rng(self.semilla + 1)
+        nombres = model.df_inv["Producto"].to_numpy(dtype=object)
+        muestra = nombres[rng.integers(0, len(nombres), BUSQUEDAS)]
+        self.medir("find_product.exacto",
+                   lambda: [model.find_product(n, partial=False) for n in muestra],
+                   operaciones=BUSQUEDAS)
+        prefijos = [n[:-2] for n in muestra]
+        self.medir("find_product.parcial",
+                   lambda: [model.find_product(p) for p in prefijos],
+                   operaciones=BUSQUEDAS)
+        for consulta in ("producto 0001", "categoría 7", "proveedor 1", "no existe"):
+            self.medir(f"filter_products[{consulta}]", lambda c=consulta: model.filter_products(c))
+        for consulta in (nombres[0], "usuario:ana", "tipo:salida usuario:bodega", "obs:pedido", "fecha:2025-03"):
+            self.medir(f"search_movements[{consulta}]", lambda c=consulta: model.search_movements(c))
+
+    def _graficos(self, model):
+        print("Gráficos:", flush=True)
+        for nombre in ("stock", "valor", "categoria", "stock_bajo"):
+            self.medir(f"grafico.{nombre}", lambda n=nombre: core.datos_grafico(model, n))
+
+        def historial_nuevo():
+            model.historial = core.HistorialMovimientos(model.movimientos)
+        for nombre in ("flujo", "evolucion"):
+            # La primera consulta procesa todo el historial; las demás son incrementales
+            self.medir(f"grafico.{nombre}.primera",
+                       lambda n=nombre: core.datos_grafico(model, n), preparar=historial_nuevo)
+            for frecuencia in ("D", "W", "M"):
+                self.medir(f"grafico.{nombre}[{frecuencia}]",
+                           lambda n=nombre, f=frecuencia: core.datos_grafico(model, n, frecuencia=f))
+            self.medir(f"grafico.{nombre}[M, filtro]",
+                       lambda n=nombre: core.datos_grafico(model, n, frecuencia="M", filtro="categoría 3"))
+
+    def _registro(self, model):
+        print("Registro de movimientos:", flush=True)
+        nombres = model.df_inv["Producto"].to_numpy(dtype=object)
+        # Sobre un historial aparte del mismo tamaño: el del modelo no debe
+        # quedar con movimientos que no están en df_inv
+        log = {}
+
+        def historial_aparte():
+            log["mov"] = core.MovimientoLog(model.df_mov)
+
+        def registrar():
+            for k in range(MOVIMIENTOS_NUEVOS):
+                core.log_movement(log["mov"], nombres[k % len(nombres)], "Entrada", 1,
+                                  "bench", pd.NA, 10, 11)
+        self.medir("log_movement", registrar, preparar=historial_aparte, operaciones=MOVIMIENTOS_NUEVOS)
+        indices = model.df_inv.index[:200]
+        self.medir("record_movement",
+                   lambda: [model.record_movement(idx, "Entrada", 1) for idx in indices],
+                   operaciones=len(indices))
+
+    def informe(self):
+        return {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "entorno": {
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "numpy": np.__version__,
+                "plataforma": platform.platform(),
+            },
+            "parametros": {
+                "productos": self.productos,
+                "movimientos": self.movimientos,
+                "modo": self.modo,
+                "repeticiones": self.repeticiones,
+                "semilla": self.semilla,
+            },
+            "resultados": self.resultados,
+        }
+
+# ============== COMPARACIÓN ==============
+def comparar(base, actual):
+    """Imprime cada medición de `actual` contra la misma de `base` (informes JSON)."""
+    if base["parametros"] != actual["parametros"]:
+        print(f"Aviso: parámetros distintos ({base['parametros']} vs {actual['parametros']})")
+    print(f"{'medición':<40} {'base ms':>10} {'actual ms':>10} {'cambio':>8}")
+    for nombre, resultado in actual["resultados"].items():
+        previo = base["resultados"].get(nombre)
+        if previo is None:
+            continue
+        antes, ahora = previo["mediana_s"] * 1000, resultado["mediana_s"] * 1000
+        cambio = f"{(ahora / antes - 1) * 100:+.0f}%" if antes > 0 else ""
+        print(f"{nombre:<40} {antes:>10.1f} {ahora:>10.1f} {cambio:>8}")
+
+# ============== EJECUCIÓN ==============
+def _parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py",
+        description="Mide carga, guardado, búsquedas, movimientos y gráficos sobre "
+                    "un inventario sintético; guarda los resultados en JSON.")
+    parser.add_argument("--escala", choices=ESCALAS, default="chica",
+                        help="tamaño predefinido (" + ", ".join(
+                            f"{k}: {p:,} productos / {m:,} movimientos" for k, (p, m) in ESCALAS.items()) + ")")
+    parser.add_argument("--productos", type=int, help="cantidad de productos (reemplaza la escala)")
+    parser.add_argument("--movimientos", type=int, help="cantidad de movimientos (reemplaza la escala)")
+    parser.add_argument("--modo", choices=core.BACKENDS, default=core.MODO_GUARDADO,
+                        help="modo de guardado a medir")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="archivo JSON de resultados "
+                                         "(por defecto benchmark_<modo>_<productos>x<movimientos>_<fecha>.json)")
+    parser.add_argument("--comparar", metavar="JSON", help="informe anterior para comparar")
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    productos, movimientos = ESCALAS[args.escala]
+    productos = args.productos or productos
+    movimientos = args.movimientos if args.movimientos is not None else movimientos
+    try:
+        bench = Benchmark(productos, movimientos, args.modo, args.repeticiones, args.semilla)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    informe = bench.correr()
+    salida = args.salida or (f"benchmark_{args.modo}_{productos}x{movimientos}_"
+                             f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"Resultados en {salida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(json.load(f), informe)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3620 @@
+"""Núcleo del inventario sin interfaz gráfica: datos, almacenamiento, modelo,
+reportes y línea de comandos.
+
+No importa customtkinter ni matplotlib, así que sirve para scripts y tareas
+programadas (ver main). La ventana de Inventario.py se arma sobre este módulo.
+"""
+import os
+import atexit
+import bisect
+import functools
+import pickle
+import gzip
+import hashlib
+import itertools
+import json
+import queue
+import shlex
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from operator import itemgetter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ============== CONFIGURACIÓN ==============
+ARCHIVO_EXCEL = "Inventario2.0.xlsx"
+ARCHIVO_JOURNAL = os.path.splitext(ARCHIVO_EXCEL)[0] + ".journal"
+ARCHIVO_SQLITE = os.path.splitext(ARCHIVO_EXCEL)[0] + ".db"
+
+# Modo de guardado:
+#   "excel"   -> reescribe el libro completo en cada cambio
+#   "journal" -> agrega cada operación al diario y exporta el libro periódicamente
+#   "sqlite"  -> tablas de productos y movimientos en ARCHIVO_SQLITE; cada
+#                cambio es un UPDATE/INSERT de una fila en una transacción
+MODO_GUARDADO = "journal"
+EXPORTAR_CADA = 500  # operaciones en el diario antes de exportar el libro
+
+# Retención de respaldos (ver BackupStore): los últimos RETENER_ULTIMOS,
+# uno por hora durante RETENER_HORAS y uno por día durante RETENER_DIAS
+RETENER_ULTIMOS = 20
+RETENER_HORAS = 24
+RETENER_DIAS = 30
+IMPORTAR_BLOQUE = 50_000  # filas leídas por bloque al importar un CSV/xlsx
+ESPERA_BLOQUEO = 30  # segundos que se espera a otro proceso que está escribiendo
+
+# Métricas de tiempos (ver Metricas): INVENTARIO_METRICAS=1 las activa;
+# si es una ruta .json, además se vuelcan ahí al terminar el proceso
+METRICAS = os.environ.get("INVENTARIO_METRICAS", "")
+
+# Modo servidor (python inventario_core.py servir): API HTTP/JSON local
+HOST_API = "127.0.0.1"
+PUERTO_API = 8765
+
+HEADERS = [
+    "Producto", "Categoría", "Proveedor",
+    "Stock Inicial", "Entradas", "Salidas",
+    "Stock Final", "Stock Mínimo", "Precio Unitario",
+    "Valor Total", "Fecha de Movimiento",
+    "Usuario Responsable", "Observaciones", "Versión"
+]
+
+MOV_HEADERS = ["Fecha", "Producto", "Tipo", "Cantidad", "Usuario", 
+               "Observaciones", "Stock Antes", "Stock Después"]
+
+# Tipos en memoria (ver apply_schema): los textos que se repiten son
+# categorías (un código entero por fila más la tabla de valores distintos),
+# las cantidades son enteros que admiten vacío y la fecha es datetime64.
+# Lo que no figura queda como texto.
+INV_SCHEMA = {
+    "Categoría": "category", "Proveedor": "category",
+    "Stock Inicial": "Int64", "Entradas": "Int64", "Salidas": "Int64",
+    "Stock Final": "Int64", "Stock Mínimo": "Int64",
+    "Precio Unitario": "float64", "Valor Total": "float64",
+    "Usuario Responsable": "category", "Versión": "Int64",
+}
+MOV_SCHEMA = {
+    "Fecha": "datetime64", "Producto": "category", "Tipo": "category",
+    "Cantidad": "Int64", "Usuario": "category",
+    "Stock Antes": "Int64", "Stock Después": "Int64",
+}
+
+# ============== MÉTRICAS ==============
+class _Tramo:
+    """Medición en curso de Metricas.tramo(); se le anotan filas y bytes."""
+    __slots__ = ("metricas", "nombre", "filas", "bytes", "t0")
+
+    def __init__(self, metricas, nombre):
+        self.metricas = metricas
+        self.nombre = nombre
+        self.filas = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metricas.registrar(self.nombre, time.perf_counter() - self.t0, self.filas, self.bytes)
+
+class _TramoInactivo:
+    """Lo que devuelve tramo() con las métricas apagadas: no mide nada."""
+    filas = bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, nombre, valor):
+        pass
+
+_TRAMO_INACTIVO = _TramoInactivo()
+
+class Metricas:
+    """Tiempos y contadores por operación, para medir dónde se va el tiempo.
+
+    Cada operación acumula llamadas, tiempo total, máximo y último, filas
+    procesadas y bytes escritos; los contadores sueltos (recargas, fusiones,
+    esperas del bloqueo...) van aparte. Apagada (lo normal, ver METRICAS)
+    cada punto medido cuesta una comparación. resumen() y dump() dan el
+    estado como dict o como JSON para comparar corridas.
+    """
+
+    def __init__(self, activa=False):
+        self.activa = activa
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.desde = datetime.now()
+            self.operaciones = {}
+            self.contadores = {}
+
+    def registrar(self, nombre, segundos, filas=0, bytes=0):
+        if not self.activa:
+            return
+        with self._lock:
+            op = self.operaciones.get(nombre)
+            if op is None:
+                op = self.operaciones[nombre] = {"llamadas": 0, "total_s": 0.0, "max_s": 0.0,
+                                                 "ultima_s": 0.0, "filas": 0, "bytes": 0}
+            op["llamadas"] += 1
+            op["total_s"] += segundos
+            op["max_s"] = max(op["max_s"], segundos)
+            op["ultima_s"] = segundos
+            op["filas"] += filas or 0
+            op["bytes"] += bytes or 0
+
+    def contar(self, nombre, n=1):
+        if self.activa:
+            with self._lock:
+                self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def tramo(self, nombre):
+        """Context manager que mide un bloque: `with metricas.tramo("x") as t: ... t.filas = n`."""
+        return _Tramo(self, nombre) if self.activa else _TRAMO_INACTIVO
+
+    def medir(self, nombre=None, filas=None, bytes=None):
+        """Decorador que mide cada llamada de la función.
+
+        `filas` y `bytes` son funciones opcionales (resultado, *args) que
+        devuelven lo que se anota además del tiempo.
+        """
+        def decorador(funcion):
+            etiqueta = nombre or funcion.__name__
+
+            @functools.wraps(funcion)
+            def medida(*args, **kwargs):
+                if not self.activa:
+                    return funcion(*args, **kwargs)
+                t0 = time.perf_counter()
+                resultado = funcion(*args, **kwargs)
+                self.registrar(etiqueta, time.perf_counter() - t0,
+                               filas(resultado, *args) if filas else 0,
+                               bytes(resultado, *args) if bytes else 0)
+                return resultado
+            return medida
+        return decorador
+
+    def resumen(self):
+        """{"desde", "operaciones": {nombre: estadísticas}, "contadores"}; las
+        operaciones van de mayor a menor tiempo total."""
+        with self._lock:
+            operaciones = {
+                nombre: {**op, "promedio_ms": op["total_s"] * 1000 / op["llamadas"]}
+                for nombre, op in sorted(self.operaciones.items(), key=lambda kv: -kv[1]["total_s"])
+            }
+            return {"desde": self.desde.isoformat(timespec="seconds"),
+                    "modo_guardado": MODO_GUARDADO,
+                    "operaciones": operaciones,
+                    "contadores": dict(self.contadores)}
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.resumen(), f, ensure_ascii=False, indent=2)
+
+def _tamano(*paths):
+    """Bytes de los archivos que existan (p. ej. lo que dejó un guardado)."""
+    return sum(os.path.getsize(p) for p in paths if p and os.path.exists(p))
+
+metricas = Metricas(activa=METRICAS not in ("", "0"))
+if METRICAS.lower().endswith(".json"):
+    atexit.register(metricas.dump, METRICAS)
+
+# ============== UTILIDADES ==============
+def safe_int(x, default=0):
+    try:
+        if pd.isna(x):
+            return default
+        return int(float(str(x).replace(',', '.')))
+    except Exception:
+        return default
+
+def safe_float(x, default=0.0):
+    try:
+        if pd.isna(x):
+            return default
+        return float(str(x).replace(',', '.'))
+    except Exception:
+        return default
+
+TIPOS_MOVIMIENTO = {"entrada": "Entrada", "e": "Entrada", "salida": "Salida", "s": "Salida"}
+
+def texto(x):
+    """Texto sin espacios de una celda; vacío si la celda está vacía."""
+    if x is None or (np.ndim(x) == 0 and pd.isna(x)):
+        return ""
+    return str(x).strip()
+
+def texto_col(series):
+    """Como texto, para una columna completa (una vez por valor distinto)."""
+    codes, valores = pd.factorize(series)
+    # El código -1 (celda vacía) cae en el "" final
+    limpios = np.array([texto(v) for v in valores] + [""], dtype=object)
+    return pd.Series(limpios[codes], index=series.index, dtype=object)
+
+def _convert(series, tipo):
+    if tipo == "category":
+        valores = series.astype(object)
+        valores = valores.where(valores.notna() & (valores != ""))
+        return valores.astype("category")
+    if tipo == "datetime64":
+        # Microsegundos, como log_movement y el diario
+        return pd.to_datetime(series, errors='coerce').astype("datetime64[us]")
+    numeros = pd.to_numeric(series, errors='coerce')
+    if tipo == "Int64":
+        return numeros.round().astype("Int64")
+    return numeros.astype(tipo)
+
+def _has_type(series, tipo):
+    dtype = series.dtype
+    if tipo == "category":
+        return isinstance(dtype, pd.CategoricalDtype)
+    if tipo == "datetime64":
+        return dtype.kind == "M"
+    return dtype == tipo
+
+def apply_schema(df, schema):
+    """Convierte las columnas de df a los tipos de `schema` (INV_SCHEMA o
+    MOV_SCHEMA). Las que ya tienen el tipo correcto no se tocan."""
+    for col, tipo in schema.items():
+        if col in df.columns and not _has_type(df[col], tipo):
+            df[col] = _convert(df[col], tipo)
+    return df
+
+def append_rows(df, nuevas, schema):
+    """Concatena filas nuevas a df conservando los tipos del esquema.
+
+    pd.concat (y df.loc[nuevo] = ...) pasan a object las categorías que no
+    coinciden, así que primero se unen las categorías de ambos lados.
+    """
+    nuevas = apply_schema(nuevas, schema)
+    if not len(df):
+        return nuevas
+    df = apply_schema(df, schema)
+    for col, tipo in schema.items():
+        if tipo == "category" and col in nuevas.columns:
+            union = df[col].cat.categories.union(nuevas[col].cat.categories)
+            if len(union) != len(df[col].cat.categories):
+                df[col] = df[col].cat.set_categories(union)
+            nuevas[col] = nuevas[col].cat.set_categories(union)
+    return pd.concat([df, nuevas])
+
+def set_value(df, idx, col, value):
+    """df.at[idx, col] = value, agregando la categoría si hace falta."""
+    serie = df[col]
+    if (isinstance(serie.dtype, pd.CategoricalDtype) and not pd.isna(value)
+            and value not in serie.cat.categories):
+        df[col] = serie.cat.add_categories([value])
+    df.at[idx, col] = value
+
+def parse_lote(text, default_tipo="Entrada"):
+    """Interpreta un lote de movimientos, una línea por movimiento:
+    "producto; tipo; cantidad" o "producto; cantidad" (separados por ; o tabulación).
+
+    Devuelve ([(producto, tipo, cantidad), ...], [errores]); las líneas
+    vacías se ignoran y no cuentan en la numeración.
+    """
+    lines, errores = [], []
+    n = 0
+    for raw in text.splitlines():
+        if not raw.strip():
+            continue
+        n += 1
+        campos = [c.strip() for c in raw.replace("\t", ";").split(";")]
+        if len(campos) == 2:
+            producto, tipo, cantidad = campos[0], default_tipo, campos[1]
+        elif len(campos) == 3:
+            producto, tipo, cantidad = campos
+            tipo = TIPOS_MOVIMIENTO.get(tipo.lower(), tipo)
+        else:
+            errores.append(f"Línea {n}: formato inválido '{raw.strip()}'")
+            continue
+        lines.append((producto, tipo, safe_int(cantidad, 0)))
+    return lines, errores
+
+def format_numbers(values):
+    """Formatea una columna de números: sin decimales si es entero, con decimales si no"""
+    values = pd.Series(values)
+    nums = pd.to_numeric(values, errors='coerce').astype(float).to_numpy()
+    finitos = np.isfinite(nums)
+    enteros = finitos & (nums == np.round(nums))
+    decimales = finitos & ~enteros
+    out = np.empty(len(values), dtype=object)
+    out[~finitos] = [str(v) for v in values.to_numpy(dtype=object)[~finitos]]
+    out[enteros] = [f"{int(v):,}".replace(",", ".") for v in nums[enteros]]
+    out[decimales] = [f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+                      for v in nums[decimales]]
+    return pd.Series(out, index=values.index)
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def commit_file(tmp, path):
+    """Lleva `tmp` a disco y lo renombra sobre `path`.
+
+    El rename es atómico: tras un corte se ve el archivo anterior o el
+    nuevo completo, nunca uno a medio escribir.
+    """
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if os.name == "posix":
+        # Que el rename también quede escrito
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def backup_path(path, etiqueta="bak"):
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    base, ext = os.path.splitext(path)
+    dest = f"{base}_{etiqueta}_{timestamp}{ext}"
+    n = 1
+    while os.path.exists(dest):
+        # Más de un respaldo en el mismo segundo
+        dest = f"{base}_{etiqueta}_{timestamp}_{n}{ext}"
+        n += 1
+    return dest
+
+class BackupStore:
+    """Respaldos de un archivo, deduplicados y comprimidos.
+
+    Cada respaldo es una entrada de catalogo.json que apunta a un objeto
+    comprimido con gzip y nombrado por el SHA-256 de su contenido: dos
+    respaldos iguales comparten objeto y uno idéntico al último no se vuelve
+    a guardar. Listar lee solo el catálogo. Una entrada puede llevar además
+    un diario (las operaciones que llevan de ese respaldo al siguiente
+    estado exportado, ver JournalBackend). La retención se aplica al
+    agregar: los últimos RETENER_ULTIMOS, uno por hora durante
+    RETENER_HORAS y uno por día durante RETENER_DIAS; los manuales no se
+    borran.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        base, self.ext = os.path.splitext(path)
+        self.base = base
+        self.dir = base + "_respaldos"
+        self.objetos = os.path.join(self.dir, "objetos")
+        self.catalogo_path = os.path.join(self.dir, "catalogo.json")
+        self._lock = threading.RLock()
+        self._entradas = None
+
+    # ---- catálogo ----
+    @property
+    def entradas(self):
+        """Entradas del catálogo, de la más antigua a la más nueva."""
+        if self._entradas is None:
+            if os.path.exists(self.catalogo_path):
+                with open(self.catalogo_path, encoding="utf-8") as f:
+                    self._entradas = json.load(f)
+            else:
+                self._entradas = []
+                self._migrate()
+        return self._entradas
+
+    def _write_catalog(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.catalogo_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entradas, f, ensure_ascii=False, indent=1)
+        commit_file(tmp, self.catalogo_path)
+
+    def _migrate(self):
+        """Pasa al almacén los respaldos sueltos de versiones anteriores (<base>_bak_*)."""
+        carpeta = os.path.dirname(self.base) or "."
+        prefijo = os.path.basename(self.base) + "_bak_"
+        viejos = sorted(f for f in os.listdir(carpeta) if f.startswith(prefijo) and f.endswith(self.ext))
+        for nombre in viejos:
+            archivo = os.path.join(carpeta, nombre)
+            diario = os.path.splitext(archivo)[0] + os.path.splitext(ARCHIVO_JOURNAL)[1]
+            fecha = datetime.fromtimestamp(os.path.getmtime(archivo))
+            entrada = self._new_entry(archivo, fecha, manual=False)
+            entrada["nombre"] = nombre
+            if os.path.exists(diario):
+                with open(diario, "rb") as f:
+                    entrada["diario"] = self._put_bytes(f.read())
+            self._entradas.append(entrada)
+        if viejos:
+            self._write_catalog()
+            for nombre in viejos:
+                archivo = os.path.join(carpeta, nombre)
+                for f in (archivo, os.path.splitext(archivo)[0] + os.path.splitext(ARCHIVO_JOURNAL)[1]):
+                    if os.path.exists(f):
+                        os.remove(f)
+
+    def find(self, nombre):
+        for entrada in self.entradas:
+            if entrada["nombre"] == nombre:
+                return entrada
+        raise KeyError(nombre)
+
+    def list(self):
+        """Nombres de los respaldos, del más nuevo al más antiguo."""
+        with self._lock:
+            return [e["nombre"] for e in reversed(self.entradas)]
+
+    # ---- objetos ----
+    def _object(self, digest):
+        return os.path.join(self.objetos, digest + ".gz")
+
+    def _put_file(self, path, digest):
+        destino = self._object(digest)
+        if not os.path.exists(destino):
+            os.makedirs(self.objetos, exist_ok=True)
+            with open(path, "rb") as src, gzip.open(destino + ".tmp", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            commit_file(destino + ".tmp", destino)
+
+    def _put_bytes(self, data):
+        if not data:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        destino = self._object(digest)
+        if not os.path.exists(destino):
+            os.makedirs(self.objetos, exist_ok=True)
+            with gzip.open(destino + ".tmp", "wb", compresslevel=6) as f:
+                f.write(data)
+            commit_file(destino + ".tmp", destino)
+        return digest
+
+    def _get_bytes(self, digest):
+        if not digest:
+            return b""
+        with gzip.open(self._object(digest), "rb") as f:
+            return f.read()
+
+    def _new_entry(self, path, fecha, manual):
+        digest = file_hash(path)
+        self._put_file(path, digest)
+        return {"nombre": None, "fecha": fecha.isoformat(timespec="seconds"), "hash": digest,
+                "tamano": os.path.getsize(path), "diario": None, "manual": manual}
+
+    # ---- operaciones ----
+    def add(self, path, manual=False):
+        """Respalda `path`; devuelve el nombre de la entrada.
+
+        Si el contenido es idéntico al último respaldo no se crea otra
+        entrada y se devuelve la existente.
+        """
+        with self._lock:
+            digest = file_hash(path)
+            if self.entradas and self.entradas[-1]["hash"] == digest:
+                if manual:
+                    self.entradas[-1]["manual"] = True
+                    self._write_catalog()
+                return self.entradas[-1]["nombre"]
+            ahora = datetime.now()
+            entrada = self._new_entry(path, ahora, manual)
+            nombres = {e["nombre"] for e in self.entradas}
+            nombre = f"{os.path.basename(self.base)}_bak_{ahora:%Y%m%d_%H%M%S}{self.ext}"
+            n = 1
+            while nombre in nombres:
+                # Más de un respaldo en el mismo segundo
+                nombre = f"{os.path.basename(self.base)}_bak_{ahora:%Y%m%d_%H%M%S}_{n}{self.ext}"
+                n += 1
+            entrada["nombre"] = nombre
+            self.entradas.append(entrada)
+            self.prune(ahora)
+            self._write_catalog()
+            return nombre
+
+    def restore(self, nombre, dest):
+        """Escribe el contenido del respaldo en `dest` (de forma atómica)."""
+        with self._lock:
+            digest = self.find(nombre)["hash"]
+        with gzip.open(self._object(digest), "rb") as src, open(dest + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        commit_file(dest + ".tmp", dest)
+
+    def journal(self, nombre):
+        with self._lock:
+            return self._get_bytes(self.find(nombre)["diario"])
+
+    def add_journal(self, nombre, data):
+        """Agrega operaciones al diario del respaldo `nombre`."""
+        if not data:
+            return
+        with self._lock:
+            entrada = self.find(nombre)
+            entrada["diario"] = self._put_bytes(self._get_bytes(entrada["diario"]) + data)
+            self._write_catalog()
+            self._gc()
+
+    def clear_journals(self, nombres):
+        with self._lock:
+            for nombre in nombres:
+                self.find(nombre)["diario"] = None
+            self._write_catalog()
+            self._gc()
+
+    def remove(self, nombre):
+        """Elimina un respaldo; su diario pasa al respaldo anterior para no cortar la cadena."""
+        with self._lock:
+            self._drop([self.find(nombre)])
+            self._write_catalog()
+            self._gc()
+
+    def _drop(self, borrar):
+        ids = {id(e) for e in borrar}
+        anterior = None
+        quedan = []
+        for entrada in self.entradas:
+            if id(entrada) not in ids:
+                anterior = entrada
+                quedan.append(entrada)
+            elif anterior is not None and entrada["diario"]:
+                anterior["diario"] = self._put_bytes(
+                    self._get_bytes(anterior["diario"]) + self._get_bytes(entrada["diario"]))
+        self._entradas = quedan
+
+    def prune(self, ahora=None):
+        """Aplica la política de retención (no escribe el catálogo)."""
+        ahora = ahora or datetime.now()
+        recientes = {id(e) for e in self.entradas[-RETENER_ULTIMOS:]}
+        vistos = set()
+        borrar = []
+        for entrada in reversed(self.entradas):
+            fecha = datetime.fromisoformat(entrada["fecha"])
+            edad = ahora - fecha
+            if entrada["manual"] or id(entrada) in recientes:
+                continue
+            if edad.total_seconds() < RETENER_HORAS * 3600:
+                periodo = ("h", fecha.strftime("%Y%m%d%H"))
+            elif edad.days < RETENER_DIAS:
+                periodo = ("d", fecha.strftime("%Y%m%d"))
+            else:
+                periodo = None
+            # Se conserva el más nuevo de cada hora/día
+            if periodo is None or periodo in vistos:
+                borrar.append(entrada)
+            else:
+                vistos.add(periodo)
+        if borrar:
+            self._drop(borrar)
+            self._gc()
+
+    def _gc(self):
+        """Borra los objetos que ya no usa ninguna entrada."""
+        if not os.path.isdir(self.objetos):
+            return
+        usados = {d for e in self.entradas for d in (e["hash"], e["diario"]) if d}
+        for f in os.listdir(self.objetos):
+            if f.endswith(".gz") and f[:-3] not in usados:
+                os.remove(os.path.join(self.objetos, f))
+
+_stores = {}
+
+def backup_store(path=None):
+    path = path or get_backend().path
+    if path not in _stores:
+        _stores[path] = BackupStore(path)
+    return _stores[path]
+
+def backup_file(path=None, manual=False):
+    """Respalda `path` en su BackupStore; devuelve el nombre del respaldo o None."""
+    path = path or get_backend().path
+    if os.path.exists(path):
+        try:
+            with metricas.tramo("backup_file") as t:
+                t.bytes = os.path.getsize(path)
+                return backup_store(path).add(path, manual)
+        except Exception:
+            return None
+    return None
+
+def list_backups(path=None):
+    return backup_store(path).list()
+
+def find_product(df_inv, name, partial=True):
+    name_norm = str(name).strip().lower()
+    if name_norm == "":
+        return []
+    exact = df_inv[df_inv['Producto'].astype(str).str.strip().str.lower() == name_norm]
+    if not exact.empty:
+        return list(exact.index)
+    if partial:
+        matches = df_inv[df_inv['Producto'].astype(str).fillna('').str.strip().str.lower().str.contains(name_norm)]
+        return list(matches.index)
+    return []
+
+def read_chunks(path, chunksize=IMPORTAR_BLOQUE):
+    """Lee un CSV o xlsx por bloques de `chunksize` filas, sin cargarlo entero.
+
+    Los encabezados se normalizan a los nombres de HEADERS/MOV_HEADERS sin
+    importar mayúsculas ni espacios. Las celdas se devuelven tal cual (texto
+    en los CSV); validarlas es tarea de quien importa.
+    """
+    conocidas = {c.lower(): c for c in HEADERS + MOV_HEADERS}
+
+    def columnas(header):
+        return [conocidas.get(texto(h).lower(), texto(h)) for h in header]
+
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = columnas(next(rows, ()))
+            while True:
+                bloque = list(itertools.islice(rows, chunksize))
+                if not bloque:
+                    break
+                yield pd.DataFrame(bloque, columns=header, dtype=object)
+        finally:
+            wb.close()
+        return
+
+    with open(path, encoding="utf-8-sig") as f:
+        primera = f.readline()
+    if not primera.strip():
+        return
+    sep = max([",", ";", "\t"], key=primera.count)
+    reader = pd.read_csv(path, sep=sep, dtype=str, keep_default_na=False,
+                         encoding="utf-8-sig", chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            chunk.columns = columnas(chunk.columns)
+            yield chunk
+
+class MovimientoLog:
+    """Historial de movimientos en arreglos por columna que crecen por duplicación.
+
+    Agregar un movimiento es O(1) amortizado (no copia el historial); el
+    DataFrame se arma recién cuando alguien pide `frame` y queda cacheado
+    hasta el próximo agregado. Los índices son posiciones estables.
+
+    Las columnas categóricas (Producto, Tipo, Usuario) se guardan como
+    códigos int32 sobre la tabla de valores distintos, así que cada
+    movimiento referencia a su producto por un entero y no repite el nombre;
+    las enteras con vacíos (Int64) llevan su máscara aparte.
+    """
+    CAPACIDAD_MINIMA = 1024
+
+    def __init__(self, df_mov):
+        self.columns = list(df_mov.columns)
+        self._size = len(df_mov)
+        capacidad = max(self.CAPACIDAD_MINIMA, self._size + self._size // 4)
+        self._data = {}
+        self._cats = {}    # columna -> ([valores], {valor: código})
+        self._dtypes = {}  # columna -> CategoricalDtype vigente
+        self._masks = {}   # columna -> máscara de vacíos
+        for c in self.columns:
+            serie = df_mov[c]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                valores = list(serie.cat.categories)
+                self._cats[c] = (valores, {v: i for i, v in enumerate(valores)})
+                values = serie.cat.codes.to_numpy().astype(np.int32)
+            elif isinstance(serie.dtype, pd.Int64Dtype):
+                values = serie.to_numpy(dtype=np.int64, na_value=0)
+                self._masks[c] = self._buffer(serie.isna().to_numpy(), capacidad)
+            else:
+                values = self._to_array(serie)
+            self._data[c] = self._buffer(values, capacidad)
+        self._frame = df_mov.reset_index(drop=True)
+
+    def _buffer(self, values, capacidad):
+        arr = np.empty(capacidad, dtype=values.dtype)
+        arr[:self._size] = values
+        return arr
+
+    @staticmethod
+    def _to_array(series):
+        dtype = series.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in "iufbM":
+            return series.to_numpy()
+        return series.to_numpy(dtype=object)
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        for buffers in (self._data, self._masks):
+            for c, arr in buffers.items():
+                nuevo = np.empty(len(arr) * 2, dtype=arr.dtype)
+                nuevo[:self._size] = arr[:self._size]
+                buffers[c] = nuevo
+
+    def _code(self, c, value):
+        valores, codigos = self._cats[c]
+        code = codigos.get(value)
+        if code is None:
+            code = codigos[value] = len(valores)
+            valores.append(value)
+            self._dtypes.pop(c, None)
+        return code
+
+    def _plain(self, c, dtype=object):
+        """Pasa la columna c a un arreglo común (sin códigos ni máscara)."""
+        n = self._size
+        arr = self._data[c]
+        plano = np.empty(len(arr), dtype=dtype)
+        if c in self._cats:
+            valores, _ = self._cats.pop(c)
+            self._dtypes.pop(c, None)
+            # El código -1 (vacío) cae en el NaN final
+            plano[:n] = np.array(valores + [np.nan], dtype=object)[arr[:n]]
+        else:
+            plano[:n] = arr[:n]
+            if c in self._masks:
+                plano[:n][self._masks.pop(c)[:n]] = np.nan
+        self._data[c] = plano
+
+    def _set(self, c, pos, value):
+        arr = self._data[c]
+        vacio = np.ndim(value) == 0 and pd.isna(value)
+        if c in self._cats:
+            arr[pos] = -1 if vacio else self._code(c, value)
+            return
+        if c in self._masks:
+            if vacio or float(value).is_integer():
+                arr[pos] = 0 if vacio else value
+                self._masks[c][pos] = vacio
+                return
+            # Un decimal en una columna entera la pasa a float
+            self._plain(c, float)
+            arr = self._data[c]
+        if arr.dtype.kind == "M":
+            value = np.datetime64("NaT") if vacio else pd.Timestamp(value).to_datetime64()
+        elif arr.dtype.kind in "iub" and (vacio or not float(value).is_integer()):
+            # Un vacío o un decimal en una columna entera la pasa a float
+            arr = self._data[c] = arr.astype(float)
+        if vacio and arr.dtype.kind == "f":
+            value = np.nan
+        arr[pos] = value
+
+    def append(self, row):
+        """Agrega una fila (dict) y devuelve su índice."""
+        if self._size == len(next(iter(self._data.values()))):
+            self._grow()
+        for c in self.columns:
+            try:
+                self._set(c, self._size, row.get(c, pd.NA))
+            except (TypeError, ValueError):
+                # Valor no numérico en una columna numérica
+                self._plain(c)
+                self._data[c][self._size] = row.get(c, pd.NA)
+        self._size += 1
+        self._frame = None
+        return self._size - 1
+
+    def extend(self, df):
+        """Agrega todas las filas de un DataFrame de una vez; devuelve sus índices."""
+        n, k = self._size, len(df)
+        while n + k > len(next(iter(self._data.values()))):
+            self._grow()
+        for c in self.columns:
+            if c in self._cats:
+                if c in df:
+                    codes, uniques = pd.factorize(df[c])
+                    mapa = np.array([self._code(c, v) for v in uniques] + [-1], dtype=np.int32)
+                    self._data[c][n:n + k] = mapa[codes]
+                else:
+                    self._data[c][n:n + k] = -1
+                continue
+            if c in self._masks:
+                if c not in df or pd.api.types.is_integer_dtype(df[c].dtype):
+                    serie = df[c] if c in df else pd.Series(pd.NA, index=range(k), dtype="Int64")
+                    self._data[c][n:n + k] = serie.to_numpy(dtype=np.int64, na_value=0)
+                    self._masks[c][n:n + k] = serie.isna().to_numpy()
+                    continue
+                self._plain(c, float if pd.api.types.is_float_dtype(df[c].dtype) else object)
+            values = self._to_array(df[c]) if c in df else np.full(k, np.nan, dtype=object)
+            arr = self._data[c]
+            if values.dtype != arr.dtype:
+                if arr.dtype.kind in "iufb" and values.dtype.kind in "iufb":
+                    tipo = np.result_type(arr.dtype, values.dtype)
+                elif arr.dtype.kind == "M" and values.dtype.kind == "M":
+                    tipo = np.result_type(arr.dtype, values.dtype)  # la unidad más fina
+                else:
+                    tipo = object
+                if tipo != arr.dtype:
+                    arr = self._data[c] = arr.astype(tipo)
+            arr[n:n + k] = values
+        self._size += k
+        self._frame = None
+        return range(n, n + k)
+
+    def renombrar(self, c, viejo, nuevo):
+        """Cambia el valor `viejo` por `nuevo` en todas las filas de la columna c."""
+        n = self._size
+        arr = self._data[c]
+        if c in self._cats:
+            valores, codigos = self._cats[c]
+            code = codigos.get(viejo)
+            if code is None:
+                return
+            if nuevo in codigos:
+                # El nombre nuevo ya tenía filas (p. ej. de un producto eliminado)
+                arr[:n][arr[:n] == code] = codigos[nuevo]
+            else:
+                valores[code] = nuevo
+                codigos[nuevo] = codigos.pop(viejo)
+                self._dtypes.pop(c, None)
+        else:
+            arr[:n][arr[:n] == viejo] = nuevo
+        self._frame = None
+
+    def _value(self, c, idx):
+        value = self._data[c][idx]
+        if c in self._cats:
+            return self._cats[c][0][value] if value >= 0 else np.nan
+        if c in self._masks and self._masks[c][idx]:
+            return np.nan
+        return value
+
+    def row(self, idx):
+        return {c: self._value(c, idx) for c in self.columns}
+
+    def column(self, c, desde=0):
+        """Serie de la columna c desde la fila `desde`, sin armar el DataFrame."""
+        return self._series(c, slice(desde, self._size))
+
+    def _series(self, c, sel):
+        arr = self._data[c][sel]
+        if c in self._cats:
+            if c not in self._dtypes:
+                self._dtypes[c] = pd.CategoricalDtype(self._cats[c][0])
+            return pd.Series(pd.Categorical.from_codes(arr, dtype=self._dtypes[c]))
+        if c in self._masks:
+            return pd.Series(pd.arrays.IntegerArray(arr, self._masks[c][sel]))
+        return pd.Series(arr, dtype=arr.dtype)
+
+    def take(self, indices):
+        """DataFrame solo con las filas indicadas, sin armar el historial completo."""
+        indices = np.asarray(indices, dtype=np.int64)
+        return pd.DataFrame({c: self._series(c, indices) for c in self.columns}).set_axis(indices)
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            n = self._size
+            self._frame = pd.DataFrame({c: self._series(c, slice(0, n)) for c in self.columns})
+        return self._frame
+
+def log_movement(movimientos, producto, tipo, cantidad, usuario, observaciones, stock_antes, stock_despues):
+    """Agrega un movimiento al MovimientoLog y devuelve su índice."""
+    fecha = pd.Timestamp.now()
+    new = {
+        'Fecha': fecha,
+        'Producto': producto,
+        'Tipo': tipo,
+        'Cantidad': cantidad,
+        'Usuario': usuario,
+        'Observaciones': observaciones,
+        'Stock Antes': stock_antes,
+        'Stock Después': stock_despues
+    }
+    return movimientos.append(new)
+
+def product_key(name):
+    return str(name).strip().lower()
+
+def renombrar_movimientos(df_mov, viejo, nuevo):
+    """df_mov con los movimientos de `viejo` pasados al producto `nuevo`."""
+    producto = df_mov['Producto']
+    if isinstance(producto.dtype, pd.CategoricalDtype):
+        if viejo not in producto.cat.categories:
+            return df_mov
+        if nuevo not in producto.cat.categories:
+            return df_mov.assign(Producto=producto.cat.rename_categories({viejo: nuevo}))
+        producto = producto.astype(object)
+    if not (producto == viejo).any():
+        return df_mov
+    return df_mov.assign(Producto=producto.mask(producto == viejo, nuevo))
+
+def _json_value(value):
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat(timespec='microseconds')
+    if hasattr(value, "item"):  # escalares de numpy
+        return value.item()
+    return value
+
+def record_row(row, columns):
+    """Convierte una fila (Series o dict) en un dict serializable a JSON."""
+    return {c: _json_value(row.get(c)) for c in columns}
+
+def frame_records(df, columns):
+    """Como record_row, pero para todas las filas de un DataFrame (por columnas)."""
+    cols = []
+    for c in columns:
+        s = df[c]
+        vacios = s.isna().to_numpy()
+        if pd.api.types.is_datetime64_any_dtype(s):
+            values = np.datetime_as_string(s.to_numpy(dtype='datetime64[us]'), unit='us').astype(object)
+        else:
+            values = s.to_numpy(dtype=object, copy=True)
+        values[vacios] = None
+        cols.append(values)
+    return [dict(zip(columns, row)) for row in zip(*cols)]
+
+# ============== ALMACENAMIENTO ==============
+# load_data/save_data delegan en un backend intercambiable elegido por
+# MODO_GUARDADO. Los cambios puntuales se describen como operaciones:
+#   producto   -> {"row": fila completa}           alta o edición (por nombre)
+#                 + "anterior": nombre previo        si la edición lo renombró
+#   eliminar   -> {"producto": nombre}
+#   movimiento -> {"row": fila del producto, "mov": fila de Movimientos}
+#   lote       -> {"ops": [operación, ...]}        varias operaciones atómicas
+#   importar   -> {"rows": [filas], "movs": [filas de Movimientos]}
+#
+# Varios procesos pueden compartir los archivos (p. ej. en una carpeta de
+# red): toda escritura se hace con el BloqueoArchivo del backend tomado y
+# sobre el estado vigente en disco (ver InventarioModel.transaccion). Cada
+# fila lleva además una Versión que sube con cada cambio del producto; una
+# operación calculada sobre una versión vieja se fusiona con la vigente en
+# lugar de pisarla (ver fusionar_fila).
+class Conflicto(ValueError):
+    """Otro proceso tiene el inventario bloqueado o cambió el producto."""
+
+class BloqueoOcupado(Conflicto):
+    """Otro proceso no soltó el bloqueo a tiempo; se puede reintentar."""
+
+class BloqueoArchivo:
+    """Bloqueo exclusivo entre procesos sobre <base>.lock.
+
+    Se cuenta por proceso, no por hilo: se puede tomar varias veces y el
+    archivo se suelta con la última liberación. Así una transacción del
+    modelo y el guardado en segundo plano que deja pendiente lo comparten;
+    el otro proceso espera (hasta ESPERA_BLOQUEO segundos) a que termine
+    todo. Al soltarlo se anota la firma de los archivos y al volver a
+    tomarlo se compara: si cambió, otro proceso escribió en el medio y
+    `ajenos` sube (el modelo recarga al verlo).
+    """
+
+    def __init__(self, path, firma):
+        self.path = os.path.splitext(path)[0] + ".lock"
+        self.firma = firma
+        self.ajenos = 0
+        self._nivel = 0
+        self._ultima = None
+        self._archivo = None
+        self._lock = threading.Lock()
+
+    def _intentar(self):
+        fd = self._archivo.fileno()
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            self._archivo.seek(0)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def _soltar(self):
+        fd = self._archivo.fileno()
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            self._archivo.seek(0)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def acquire(self, espera=None):
+        """Toma el bloqueo; Conflicto si otro proceso no lo suelta en `espera` segundos."""
+        espera = ESPERA_BLOQUEO if espera is None else espera
+        with self._lock:
+            if self._nivel == 0:
+                if self._archivo is None:
+                    self._archivo = open(self.path, "a+b")
+                inicio = time.monotonic()
+                limite = inicio + espera
+                while True:
+                    try:
+                        self._intentar()
+                        break
+                    except OSError:
+                        if time.monotonic() >= limite:
+                            metricas.contar("bloqueo.ocupado")
+                            raise BloqueoOcupado("Otro usuario está guardando el inventario; "
+                                                 "intente de nuevo en unos segundos") from None
+                        time.sleep(0.05)
+                if time.monotonic() - inicio >= 0.05:  # hubo que esperar a otro proceso
+                    metricas.registrar("bloqueo.espera", time.monotonic() - inicio)
+                if self._ultima is not None and self.firma() != self._ultima:
+                    self.ajenos += 1
+            self._nivel += 1
+
+    def release(self):
+        with self._lock:
+            self._nivel -= 1
+            if self._nivel == 0:
+                self._ultima = self.firma()
+                self._soltar()
+
+    def tomado(self):
+        return self._nivel > 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+_bloqueos = {}
+
+def bloqueo_archivo(path, firma):
+    """Un solo BloqueoArchivo por archivo en todo el proceso (ver BloqueoArchivo)."""
+    clave = os.path.splitext(os.path.abspath(path))[0]
+    if clave not in _bloqueos:
+        _bloqueos[clave] = BloqueoArchivo(path, firma)
+    _bloqueos[clave].firma = firma
+    return _bloqueos[clave]
+
+def version_vieja(actual, row):
+    """True si `row` se calculó sobre una versión de `actual` que ya no es la vigente.
+
+    Las filas sin Versión (diarios anteriores) no se comparan.
+    """
+    version = row.get("Versión")
+    if actual is None or version is None or pd.isna(version):
+        return False
+    return safe_int(version) <= safe_int(actual.get("Versión"))
+
+def fusionar_fila(actual, row, mov=None):
+    """Reaplica sobre la fila vigente `actual` una operación calculada sobre otra vieja.
+
+    Un movimiento se vuelve a sumar al stock vigente (y se corrigen el Stock
+    Antes/Después de `mov`); una edición conserva sus campos pero con el
+    stock vigente, que solo cambia con movimientos. Devuelve la fila nueva.
+    """
+    metricas.contar("fusiones")
+    if mov is None:
+        fila = dict(row)
+        for col in ("Entradas", "Salidas", "Stock Final"):
+            fila[col] = actual.get(col)
+    else:
+        fila = dict(actual)
+        cantidad = safe_int(mov.get("Cantidad"))
+        antes = safe_int(actual.get("Stock Final"))
+        if mov.get("Tipo") == "Entrada":
+            fila["Entradas"] = safe_int(actual.get("Entradas")) + cantidad
+            despues = antes + cantidad
+        else:
+            fila["Salidas"] = safe_int(actual.get("Salidas")) + cantidad
+            despues = antes - cantidad
+        fila["Stock Final"] = despues
+        fila["Fecha de Movimiento"] = row.get("Fecha de Movimiento")
+        mov["Stock Antes"], mov["Stock Después"] = antes, despues
+    fila["Valor Total"] = safe_int(fila["Stock Final"]) * safe_float(fila.get("Precio Unitario"))
+    fila["Versión"] = safe_int(actual.get("Versión")) + 1
+    return fila
+
+class StorageBackend:
+    """Interfaz común de almacenamiento."""
+    path = None
+    en_segundo_plano = True  # save() puede correr en el hilo de SaveWorker
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def files(self):
+        return [self.path]
+
+    @property
+    def bloqueo(self):
+        return bloqueo_archivo(self.path, self.stamp)
+
+    def stamp(self):
+        """Firma barata (mtime, tamaño) de los archivos para detectar cambios en disco."""
+        firma = []
+        for f in self.files():
+            try:
+                st = os.stat(f)
+                firma.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                firma.append(None)
+        return tuple(firma)
+
+    def load(self):
+        """Devuelve (df_inv, df_mov) tal como están almacenados."""
+        raise NotImplementedError
+
+    def save(self, df_inv, df_mov, marca=None):
+        """Escribe el estado completo.
+
+        `marca` es la de marca() al tomar la foto del estado: lo que se
+        persistió después (p. ej. en el diario) no está en la foto.
+        """
+        raise NotImplementedError
+
+    def marca(self):
+        return None
+
+    def apply(self, op, **data):
+        """Persiste una operación. Devuelve True si además hace falta
+        escribir el estado completo (por defecto, siempre)."""
+        return True
+
+    def backup(self):
+        return backup_file(self.path, manual=True)
+
+    def valid(self, path):
+        """True si `path` se puede leer como este almacenamiento."""
+        raise NotImplementedError
+
+    def recover(self):
+        """Reemplaza el archivo principal dañado por el respaldo válido más reciente.
+
+        El dañado se conserva como <base>_danado_<fecha><ext>. Devuelve el
+        respaldo usado, o None si ninguno se pudo leer.
+        """
+        store = backup_store(self.path)
+        base, ext = os.path.splitext(self.path)
+        tmp = f"{base}.tmp{ext}"
+        for copia in store.list():
+            store.restore(copia, tmp)
+            if self.valid(tmp):
+                os.replace(self.path, backup_path(self.path, "danado"))
+                os.replace(tmp, self.path)
+                return copia
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+    def close(self, df_inv, df_mov):
+        pass
+
+class ExcelBackend(StorageBackend):
+    """Libro de Excel completo, reescrito en cada guardado.
+
+    Junto al libro se guarda una caché (<base>.cache) con los DataFrames ya
+    tipados, válida mientras el libro tenga la misma fecha de modificación y
+    tamaño, o el mismo hash: así la carga no depende de openpyxl salvo que el
+    libro se haya editado por fuera. Al guardar la clave es solo la fecha y
+    el tamaño del libro recién escrito (hashearlo sería volver a leerlo
+    entero); el hash se anota cuando la caché se arma leyendo el libro.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, path=ARCHIVO_EXCEL):
+        self.path = path
+        self.cache = os.path.splitext(path)[0] + ".cache"
+
+    @staticmethod
+    def read(path):
+        xls = pd.ExcelFile(path, engine="openpyxl")
+        df_inv = pd.read_excel(xls, sheet_name='Inventario2.0', engine='openpyxl') if 'Inventario2.0' in xls.sheet_names else pd.DataFrame(columns=HEADERS)
+        df_mov = pd.read_excel(xls, sheet_name='Movimientos', engine='openpyxl') if 'Movimientos' in xls.sheet_names else pd.DataFrame(columns=MOV_HEADERS)
+        return df_inv, df_mov
+
+    def load(self):
+        if not self.exists():
+            return pd.DataFrame(columns=HEADERS), pd.DataFrame(columns=MOV_HEADERS)
+        cached = self.read_cache()
+        if cached is not None:
+            return cached
+        df_inv, df_mov = normalize_frames(*self.read(self.path))
+        self.write_cache(df_inv, df_mov, con_hash=True)
+        return df_inv, df_mov
+
+    def _cache_key(self, con_hash):
+        st = os.stat(self.path)
+        return {"version": self.CACHE_VERSION, "mtime_ns": st.st_mtime_ns,
+                "size": st.st_size, "hash": file_hash(self.path) if con_hash else None}
+
+    def read_cache(self):
+        """(df_inv, df_mov) de la caché si corresponde al libro actual, si no None."""
+        try:
+            with open(self.cache, "rb") as f:
+                clave = pickle.load(f)
+                st = os.stat(self.path)
+                if clave.get("version") != self.CACHE_VERSION or clave["size"] != st.st_size:
+                    return None
+                # Misma fecha y tamaño: vale sin leer el libro; si no, decide el hash
+                if clave["mtime_ns"] != st.st_mtime_ns and (
+                        clave["hash"] is None or clave["hash"] != file_hash(self.path)):
+                    return None
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def write_cache(self, df_inv, df_mov, con_hash=False):
+        # La clave va primero para poder validarla sin cargar los datos
+        try:
+            with open(self.cache + ".tmp", "wb") as f:
+                pickle.dump(self._cache_key(con_hash), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump((df_inv, df_mov), f, protocol=pickle.HIGHEST_PROTOCOL)
+            commit_file(self.cache + ".tmp", self.cache)
+        except Exception:
+            # La caché es opcional: sin ella se lee el libro
+            if os.path.exists(self.cache + ".tmp"):
+                os.remove(self.cache + ".tmp")
+
+    def valid(self, path):
+        try:
+            self.read(path)
+            return True
+        except Exception:
+            return False
+
+    def save(self, df_inv, df_mov, marca=None):
+        copia = backup_file(self.path)
+        # Escribir aparte y reemplazar: nunca queda un libro a medio escribir
+        base, ext = os.path.splitext(self.path)
+        tmp = f"{base}.tmp{ext}"
+        with pd.ExcelWriter(tmp, engine='openpyxl') as writer:
+            df_inv.to_excel(writer, sheet_name='Inventario2.0', index=False)
+            df_mov.to_excel(writer, sheet_name='Movimientos', index=False)
+        commit_file(tmp, self.path)
+        self.write_cache(*normalize_frames(df_inv.reset_index(drop=True), df_mov.reset_index(drop=True)))
+        return copia
+
+class JournalBackend(ExcelBackend):
+    """Libro de Excel como exportación periódica más un diario de operaciones.
+
+    Cada operación se agrega como una línea JSON al diario (con fsync), de
+    modo que registrar un movimiento no obliga a reescribir el libro. La
+    carga reconstruye el estado desde la última exportación más el diario.
+    Al exportar, las operaciones que salen del diario quedan junto al
+    respaldo del libro anterior (mismo nombre, extensión del diario), para
+    poder rehacer el estado si el libro se daña.
+    """
+
+    def __init__(self, path=ARCHIVO_EXCEL, journal=ARCHIVO_JOURNAL, exportar_cada=EXPORTAR_CADA):
+        super().__init__(path)
+        self.journal = journal
+        self.exportar_cada = exportar_cada
+        self.pendientes = 0
+        # Bytes quitados del diario por este proceso: las marcas se cuentan
+        # desde ahí, así una marca tomada antes de un recorte sigue valiendo
+        self._recortado = 0
+        # append (hilo de la UI) y clear_journal (hilo de guardado) no se pisan
+        self._lock = threading.Lock()
+
+    def files(self):
+        return [self.path, self.journal]
+
+    def load(self):
+        df_inv, df_mov = super().load()
+        records = self.read_journal()
+        self.pendientes = len(records)
+        return self.replay(df_inv, df_mov, records)
+
+    def save(self, df_inv, df_mov, marca=None):
+        copia = super().save(df_inv, df_mov)
+        self.clear_journal(marca, copia)
+        return copia
+
+    def recover(self):
+        """Recupera el libro del respaldo válido más reciente y antepone al
+        diario las operaciones exportadas desde ese respaldo.
+
+        Los diarios de respaldo que se unieron se eliminan: sus operaciones
+        pasan a estar en el diario actual (y, al exportar, junto al respaldo
+        nuevo), así no se aplican dos veces en otra recuperación.
+        """
+        copia = super().recover()
+        if copia:
+            store = backup_store(self.path)
+            backups = store.list()
+            usados = list(reversed(backups[:backups.index(copia) + 1]))
+            contenido = b"".join(store.journal(b) for b in usados)
+            if os.path.exists(self.journal):
+                with open(self.journal, "rb") as f:
+                    contenido += f.read()
+            with open(self.journal + ".tmp", "wb") as f:
+                f.write(contenido)
+            commit_file(self.journal + ".tmp", self.journal)
+            store.clear_journals(usados)
+        return copia
+
+    def marca(self):
+        """Posición actual del diario: lo que está antes ya entra en la foto."""
+        with self._lock:
+            return self._recortado + (os.path.getsize(self.journal) if os.path.exists(self.journal) else 0)
+
+    def apply(self, op, **data):
+        self.append(op, **data)
+        return self.pendientes >= self.exportar_cada
+
+    def close(self, df_inv, df_mov):
+        # Exportar el libro si quedaron operaciones en el diario (sin datos
+        # solo se libera: el diario queda para el próximo que abra)
+        if df_inv is not None and self.pendientes:
+            self.save(df_inv, df_mov)
+
+    def append(self, op, **data):
+        record = {"op": op, "ts": datetime.now().isoformat(), **data}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, metricas.tramo("diario.append") as t:
+            with open(self.journal, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.pendientes += 1
+            t.filas, t.bytes = 1, len(line.encode("utf-8")) + 1
+
+    def read_journal(self):
+        records = []
+        if not os.path.exists(self.journal):
+            return records
+        with open(self.journal, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Registro truncado por un corte durante la escritura
+                    break
+        return records
+
+    def clear_journal(self, marca=None, copia=None):
+        """Vacía el diario, o solo hasta `marca` si se exportó una foto anterior.
+
+        Lo que se quita se agrega al diario del respaldo `copia`, si se indica.
+        """
+        with self._lock:
+            if not os.path.exists(self.journal):
+                self.pendientes = 0
+                return
+            with open(self.journal, "rb") as f:
+                contenido = f.read()
+            marca = len(contenido) if marca is None else max(marca - self._recortado, 0)
+            self._recortado += marca
+            if copia:
+                backup_store(self.path).add_journal(copia, contenido[:marca])
+            tmp = self.journal + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(contenido[marca:])
+            commit_file(tmp, self.journal)
+            self.pendientes = contenido[marca:].count(b"\n")
+
+    @staticmethod
+    def replay(df_inv, df_mov, records):
+        """Aplica los registros del diario sobre la última exportación."""
+        if not records:
+            return df_inv, df_mov
+
+        def to_na(row):
+            return {c: (pd.NA if v is None else v) for c, v in row.items()}
+
+        productos = {product_key(r['Producto']): r for r in df_inv.to_dict('records')}
+        movimientos = []
+        ops = (item for rec in records
+               for item in (rec["ops"] if rec.get("op") == "lote" else [rec]))
+        for rec in ops:
+            op = rec.get("op")
+            if op in ("producto", "movimiento"):
+                row = to_na(rec["row"])
+                mov = to_na(rec["mov"]) if op == "movimiento" else None
+                clave = product_key(row['Producto'])
+                anterior = rec.get("anterior")
+                if anterior is not None:
+                    # Renombrado: la fila deja su clave vieja y el historial
+                    # registrado hasta acá pasa al nombre nuevo
+                    actual = productos.pop(product_key(anterior), None)
+                    df_mov = renombrar_movimientos(df_mov, anterior, row['Producto'])
+                    for previo in movimientos:
+                        if previo['Producto'] is not pd.NA and previo['Producto'] == anterior:
+                            previo['Producto'] = row['Producto']
+                else:
+                    actual = productos.get(clave)
+                if version_vieja(actual, row):
+                    row = fusionar_fila(actual, row, mov)
+                productos[clave] = row
+                if mov is not None:
+                    movimientos.append(mov)
+            elif op == "eliminar":
+                productos.pop(product_key(rec["producto"]), None)
+            elif op == "importar":
+                for row in rec["rows"]:
+                    row = to_na(row)
+                    productos[product_key(row['Producto'])] = row
+                movimientos.extend(to_na(mov) for mov in rec["movs"])
+
+        df_inv = pd.DataFrame(list(productos.values()), columns=df_inv.columns)
+        if movimientos:
+            nuevos = pd.DataFrame(movimientos, columns=df_mov.columns)
+            df_mov = pd.concat([df_mov, nuevos], ignore_index=True) if not df_mov.empty else nuevos
+        return df_inv, df_mov
+
+class SQLiteBackend(StorageBackend):
+    """Tablas de productos y movimientos en SQLite.
+
+    Las operaciones puntuales se traducen en UPDATE/INSERT de una fila dentro
+    de una transacción. Si la base no existe pero sí el libro de Excel, se
+    importa el libro la primera vez. La conexión se comparte entre hilos (la
+    API escribe desde su hilo escritor y lee desde los de cada petición):
+    todo uso pasa por un candado propio.
+    """
+
+    en_segundo_plano = False  # cada operación ya es una transacción corta
+
+    INT_COLS = {'Stock Inicial', 'Entradas', 'Salidas', 'Stock Final', 'Stock Mínimo', 'Versión',
+                'Cantidad', 'Stock Antes', 'Stock Después'}
+    REAL_COLS = {'Precio Unitario', 'Valor Total'}
+
+    def __init__(self, path=ARCHIVO_SQLITE, excel=ARCHIVO_EXCEL):
+        self.path = path
+        self.excel = excel
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _q(col):
+        return '"' + col.replace('"', '""') + '"'
+
+    def _col_defs(self, columns):
+        defs = []
+        for c in columns:
+            tipo = "INTEGER" if c in self.INT_COLS else "REAL" if c in self.REAL_COLS else "TEXT"
+            defs.append(f"{self._q(c)} {tipo}")
+        return ", ".join(defs)
+
+    @property
+    def conn(self):
+        with self._lock:
+            return self._conectar()
+
+    def _conectar(self):
+        if self._conn is None:
+            nuevo = not self.exists()
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS productos (id INTEGER PRIMARY KEY, clave TEXT UNIQUE NOT NULL, {self._col_defs(HEADERS)})")
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS movimientos (id INTEGER PRIMARY KEY, {self._col_defs(MOV_HEADERS)})")
+                # Bases creadas antes de que existiera una columna (p. ej. Versión)
+                existentes = {fila[1] for fila in self._conn.execute("PRAGMA table_info(productos)")}
+                for c in HEADERS:
+                    if c not in existentes:
+                        self._conn.execute(f"ALTER TABLE productos ADD COLUMN {self._col_defs([c])}")
+                self._conn.execute('CREATE INDEX IF NOT EXISTS idx_productos_producto ON productos ("Producto")')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS idx_movimientos_producto ON movimientos ("Producto")')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON movimientos ("Fecha")')
+            if nuevo and os.path.exists(self.excel):
+                self.save(*ExcelBackend(self.excel).load())
+        return self._conn
+
+    def exists(self):
+        return self._conn is not None or os.path.exists(self.path)
+
+    def load(self):
+        cols_inv = ", ".join(self._q(c) for c in HEADERS)
+        cols_mov = ", ".join(self._q(c) for c in MOV_HEADERS)
+        with self._lock:
+            df_inv = pd.read_sql_query(f"SELECT {cols_inv} FROM productos ORDER BY id", self.conn)
+            df_mov = pd.read_sql_query(f"SELECT {cols_mov} FROM movimientos ORDER BY id", self.conn)
+        return df_inv, df_mov
+
+    @staticmethod
+    def _rows(df, columns):
+        return [tuple(_json_value(v) for v in row)
+                for row in df.reindex(columns=columns).itertuples(index=False, name=None)]
+
+    def _insert_sql(self, table, columns, extra=()):
+        names = ", ".join([*extra, *(self._q(c) for c in columns)])
+        marks = ", ".join("?" * (len(extra) + len(columns)))
+        return f"INSERT INTO {table} ({names}) VALUES ({marks})"
+
+    def save(self, df_inv, df_mov, marca=None):
+        rows_inv = self._rows(df_inv, HEADERS)
+        rows_inv = [(product_key(r[0]), *r) for r in rows_inv]
+        rows_mov = self._rows(df_mov, MOV_HEADERS)
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM productos")
+            self.conn.execute("DELETE FROM movimientos")
+            self.conn.executemany(self._insert_sql("productos", HEADERS, ("clave",)), rows_inv)
+            self.conn.executemany(self._insert_sql("movimientos", MOV_HEADERS), rows_mov)
+
+    def _upsert_producto(self, row):
+        updates = ", ".join(f"{self._q(c)} = excluded.{self._q(c)}" for c in HEADERS)
+        sql = self._insert_sql("productos", HEADERS, ("clave",)) + f" ON CONFLICT(clave) DO UPDATE SET {updates}"
+        self.conn.execute(sql, (product_key(row['Producto']), *(row.get(c) for c in HEADERS)))
+
+    def _fila(self, producto):
+        """Fila vigente del producto en la base (dict) o None."""
+        cols = ", ".join(self._q(c) for c in HEADERS)
+        valores = self.conn.execute(f"SELECT {cols} FROM productos WHERE clave = ?",
+                                    (product_key(producto),)).fetchone()
+        return None if valores is None else dict(zip(HEADERS, valores))
+
+    def _apply_one(self, op, data):
+        if op in ("producto", "movimiento"):
+            row = data["row"]
+            mov = dict(data["mov"]) if op == "movimiento" else None
+            anterior = data.get("anterior")
+            actual = self._fila(row['Producto'] if anterior is None else anterior)
+            if anterior is not None:
+                # Renombrado: se quita la fila con la clave vieja y el
+                # historial pasa al nombre nuevo
+                self.conn.execute("DELETE FROM productos WHERE clave = ?", (product_key(anterior),))
+                self.conn.execute('UPDATE movimientos SET "Producto" = ? WHERE "Producto" = ?',
+                                  (row['Producto'], anterior))
+            if version_vieja(actual, row):
+                row = fusionar_fila(actual, row, mov)
+            self._upsert_producto(row)
+            if mov is not None:
+                self.conn.execute(self._insert_sql("movimientos", MOV_HEADERS),
+                                  tuple(mov.get(c) for c in MOV_HEADERS))
+        elif op == "eliminar":
+            self.conn.execute("DELETE FROM productos WHERE clave = ?", (product_key(data["producto"]),))
+        elif op == "importar":
+            for row in data["rows"]:
+                self._upsert_producto(row)
+            self.conn.executemany(self._insert_sql("movimientos", MOV_HEADERS),
+                                  map(itemgetter(*MOV_HEADERS), data["movs"]))
+        else:
+            raise ValueError(f"Operación desconocida: {op}")
+
+    def apply(self, op, **data):
+        with self._lock, self.conn:
+            if op == "lote":
+                for item in data["ops"]:
+                    self._apply_one(item["op"], item)
+            else:
+                self._apply_one(op, data)
+        return False
+
+    def backup(self):
+        if not self.exists():
+            return None
+        try:
+            tmp = backup_path(self.path, "tmp")
+            dest = sqlite3.connect(tmp)
+            with self._lock, dest:
+                self.conn.backup(dest)
+            dest.close()
+            try:
+                return backup_store(self.path).add(tmp, manual=True)
+            finally:
+                os.remove(tmp)
+        except Exception:
+            return None
+
+    def valid(self, path):
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+                    return False
+                conn.execute("SELECT COUNT(*) FROM productos").fetchone()
+                conn.execute("SELECT COUNT(*) FROM movimientos").fetchone()
+                return True
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+
+    def recover(self):
+        self.close(None, None)
+        return super().recover()
+
+    def close(self, df_inv, df_mov):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+BACKENDS = {
+    "excel": ExcelBackend,
+    "journal": JournalBackend,
+    "sqlite": SQLiteBackend,
+}
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[MODO_GUARDADO]()
+    return _backend
+
+def normalize_frames(df_inv, df_mov):
+    """Asegura columnas y tipos (INV_SCHEMA / MOV_SCHEMA). Las columnas que ya
+    tienen el tipo correcto (p. ej. leídas de la caché) no se vuelven a convertir."""
+    # Asegurar columnas
+    for c in HEADERS:
+        if c not in df_inv.columns:
+            df_inv[c] = pd.NA
+    for c in MOV_HEADERS:
+        if c not in df_mov.columns:
+            df_mov[c] = pd.NA
+
+    # Normalizar tipos
+    df_inv = apply_schema(df_inv, INV_SCHEMA)
+    df_mov = apply_schema(df_mov, MOV_SCHEMA)
+    for col in ['Stock Inicial', 'Entradas', 'Salidas', 'Stock Final', 'Precio Unitario', 'Valor Total', 'Versión']:
+        if df_inv[col].hasnans:
+            df_inv[col] = df_inv[col].fillna(0)
+
+    return df_inv, df_mov
+
+def _avisar_consola(nivel, titulo, mensaje):
+    print(f"{titulo}: {mensaje}", file=sys.stderr)
+
+# Cómo se avisan los problemas de carga y guardado: nivel "warning" o
+# "error", un título y el mensaje. Sin interfaz van a stderr; la ventana
+# instala aquí sus cuadros de diálogo.
+avisar = _avisar_consola
+
+@metricas.medir(filas=lambda r: len(r[0]) + len(r[1]))
+def load_data():
+    # Con el bloqueo tomado: nunca se lee una exportación a medias de otro proceso
+    with get_backend().bloqueo:
+        return _load_data()
+
+def _load_data():
+    backend = get_backend()
+    existe = backend.exists()
+    copia = None
+    try:
+        df_inv, df_mov = backend.load()
+    except Exception as e:
+        # Archivo dañado (p. ej. un corte a mitad de escritura): recuperar
+        # desde el respaldo válido más reciente
+        try:
+            copia = backend.recover()
+            df_inv, df_mov = backend.load() if copia else (None, None)
+        except Exception:
+            copia = None
+        if copia:
+            avisar("warning", "Recuperación",
+                   f"{backend.path} estaba dañado ({e}).\n"
+                   f"Se recuperó desde {copia}; el archivo dañado se conservó aparte.")
+        else:
+            avisar("error", "Error", f"Error al leer {backend.path}: {e}")
+            df_inv = pd.DataFrame(columns=HEADERS)
+            df_mov = pd.DataFrame(columns=MOV_HEADERS)
+
+    df_inv, df_mov = normalize_frames(df_inv, df_mov)
+
+    # Tras una recuperación se exporta enseguida: el diario vuelve a quedar
+    # vacío y el estado recuperado pasa a ser el archivo principal
+    if not existe or copia:
+        save_data(df_inv, df_mov)
+
+    return df_inv, df_mov
+
+def save_data(df_inv, df_mov):
+    try:
+        _save_data(df_inv, df_mov)
+        return True
+    except Exception as e:
+        avisar("error", "Error", f"Error al guardar: {e}")
+        return False
+
+def _save_data(df_inv, df_mov):
+    with get_backend().bloqueo, metricas.tramo("save_data") as t:
+        get_backend().save(df_inv, df_mov)
+        t.filas = len(df_inv) + len(df_mov)
+        t.bytes = _tamano(*get_backend().files())
+
+def persist_change(op, **data):
+    """Persiste una operación puntual (ver ALMACENAMIENTO) en el backend activo.
+
+    Devuelve True si el backend necesita además una escritura completa. Los
+    errores se propagan: el modelo los anota en save_error.
+    """
+    with get_backend().bloqueo, metricas.tramo("persist_change") as t:
+        t.filas = len(data.get("ops") or data.get("rows") or data.get("movs") or [op])
+        return get_backend().apply(op, **data)
+
+class SaveWorker:
+    """Hilo escritor: guarda el estado completo sin bloquear la interfaz.
+
+    submit() deja una foto del estado; si ya había otra esperando, se
+    reemplaza (gana la última). El hilo la escribe con el backend activo y
+    deja el resultado en `eventos`, que la interfaz lee con after(): nunca
+    se toca Tk desde este hilo. Desde submit() hasta que la foto queda
+    escrita el proceso retiene el bloqueo del backend: ningún otro proceso
+    escribe entre la foto y su escritura.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pendiente = None
+        self._escribiendo = False
+        self._cerrado = False
+        self.eventos = queue.Queue()  # ("guardando" | "guardado" | "error", detalle)
+        self._thread = threading.Thread(target=self._run, name="guardado", daemon=True)
+        self._thread.start()
+
+    def submit(self, df_inv, df_mov, marca=None):
+        with self._cond:
+            if self._cerrado:
+                raise RuntimeError("El guardado en segundo plano ya se cerró")
+            if self._pendiente is None:
+                get_backend().bloqueo.acquire()
+            self._pendiente = (df_inv, df_mov, marca)
+            self._cond.notify_all()
+
+    def pendiente(self):
+        return self._pendiente is not None
+
+    def escribiendo(self):
+        return self._escribiendo
+
+    def ocupado(self):
+        with self._cond:
+            return self._pendiente is not None or self._escribiendo
+
+    def wait(self):
+        """Espera a que no quede nada por escribir."""
+        with self._cond:
+            while self._pendiente is not None or self._escribiendo:
+                self._cond.wait()
+
+    def cerrar(self):
+        """Escribe lo pendiente y termina el hilo."""
+        with self._cond:
+            self._cerrado = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def drain(self):
+        eventos = []
+        while True:
+            try:
+                eventos.append(self.eventos.get_nowait())
+            except queue.Empty:
+                return eventos
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pendiente is None:
+                    if self._cerrado:
+                        return
+                    self._cond.wait()
+                foto, self._pendiente = self._pendiente, None
+                self._escribiendo = True
+            self.eventos.put(("guardando", None))
+            try:
+                with metricas.tramo("guardado_fondo") as t:
+                    get_backend().save(*foto)
+                    t.filas = len(foto[0]) + len(foto[1])
+                    t.bytes = _tamano(*get_backend().files())
+                evento = ("guardado", None)
+            except Exception as e:
+                evento = ("error", str(e))
+            finally:
+                get_backend().bloqueo.release()
+            with self._cond:
+                self._escribiendo = False
+                self._cond.notify_all()
+            self.eventos.put(evento)
+
+# ============== ÍNDICES ==============
+class ProductoIndex:
+    """Índice de productos por nombre normalizado (ver product_key).
+
+    Un dict nombre -> índices de df_inv da búsquedas exactas O(1) y una lista
+    ordenada de nombres permite buscar prefijos con bisect. Las subcadenas se
+    buscan sobre los nombres distintos, sin recalcular la columna completa.
+    """
+
+    def __init__(self, df_inv=None):
+        self.by_name = {}
+        self.names = []
+        if df_inv is not None:
+            for idx, name in df_inv['Producto'].items():
+                self.by_name.setdefault(product_key(name), []).append(idx)
+            self.names = sorted(self.by_name)
+
+    def add(self, idx, name):
+        key = product_key(name)
+        if key not in self.by_name:
+            self.by_name[key] = []
+            bisect.insort(self.names, key)
+        self.by_name[key].append(idx)
+
+    def remove(self, idx, name):
+        key = product_key(name)
+        indices = self.by_name.get(key, [])
+        if idx in indices:
+            indices.remove(idx)
+        if not indices and key in self.by_name:
+            del self.by_name[key]
+            del self.names[bisect.bisect_left(self.names, key)]
+
+    def exact(self, name):
+        return list(self.by_name.get(product_key(name), []))
+
+    def prefix(self, prefix):
+        prefix = product_key(prefix)
+        lo = bisect.bisect_left(self.names, prefix)
+        hi = bisect.bisect_left(self.names, prefix + chr(0x10FFFF))
+        return sorted(i for key in self.names[lo:hi] for i in self.by_name[key])
+
+    def contains(self, text):
+        text = product_key(text)
+        return sorted(i for key in self.names if text in key for i in self.by_name[key])
+
+    def find(self, name, partial=True):
+        """Mismo resultado que find_product: exactos primero, si no, parciales."""
+        if product_key(name) == "":
+            return []
+        exact = self.exact(name)
+        if exact:
+            return exact
+        if partial:
+            return self.contains(name)
+        return []
+
+class MovimientoIndex:
+    """Índice invertido de Movimientos para buscar sin recorrer el historial.
+
+    Por cada campo guarda {clave -> índices de df_mov}. Las claves son el
+    valor completo (Producto, Tipo, Usuario), las palabras (Observaciones) o
+    el día y la hora (Fecha). Un término se busca como subcadena sobre el
+    vocabulario de claves, que es mucho más chico que el historial, y las
+    frases de varias palabras se verifican solo sobre los candidatos.
+
+    Consultas: términos separados por espacios (se combinan con Y), con campo
+    opcional, p. ej. `usuario:ana tipo:salida "pedido 12"`.
+    """
+    FIELDS = {
+        "producto": "Producto",
+        "tipo": "Tipo",
+        "usuario": "Usuario",
+        "obs": "Observaciones",
+        "observaciones": "Observaciones",
+        "fecha": "Fecha",
+    }
+    COLUMNS = ["Producto", "Tipo", "Usuario", "Observaciones", "Fecha"]
+    SPLIT = {"Observaciones", "Fecha"}  # campos indexados por palabra
+    POCAS_FILAS = 64  # hasta aquí se indexa fila por fila (ver _add_rows)
+
+    def __init__(self, df_mov=None):
+        self.postings = {col: {} for col in self.COLUMNS}
+        if df_mov is not None:
+            self.add(df_mov)
+
+    @staticmethod
+    def _text(df, col):
+        if col == "Fecha":
+            fechas = pd.to_datetime(df[col], errors='coerce')
+            return fechas.dt.strftime("%Y-%m-%d %H:%M:%S").fillna('')
+        return df[col].astype(object).fillna('').astype(str).str.lower()
+
+    def _keys(self, df, col):
+        """Serie de claves (una fila por clave) indexada por el índice de df."""
+        if col == "Fecha":
+            text = self._text(df, col)
+            text = text[text != '']
+            return pd.concat([text.str[:10], text.str[11:]])
+        
+        # Calcular las claves una vez por valor distinto, no por fila
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Los códigos ya son la factorización; el -1 (vacío) no tiene claves
+            codes, uniques = serie.cat.codes.to_numpy(), serie.cat.categories.astype(str)
+        else:
+            codes, uniques = pd.factorize(serie.fillna('').astype(str))
+        if col in self.SPLIT:
+            words = [sorted(set(u.lower().split())) for u in uniques]
+        else:
+            words = [[u.lower()] if u else [] for u in uniques]
+        per_code = pd.Series(words, dtype=object).explode().dropna()
+        pairs = pd.DataFrame({"code": codes, "label": df.index.to_numpy()}).merge(
+            pd.DataFrame({"code": per_code.index.to_numpy(), "key": per_code.to_numpy()}), on="code")
+        return pd.Series(pairs["key"].to_numpy(), index=pairs["label"].to_numpy())
+
+    def _row_keys(self, col, value):
+        """Claves de un valor suelto, igual que _keys para una columna."""
+        if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+            return []
+        if col == "Fecha":
+            fecha = pd.to_datetime(value, errors='coerce')
+            if pd.isna(fecha):
+                return []
+            text = fecha.strftime("%Y-%m-%d %H:%M:%S")
+            return [text[:10], text[11:]]
+        text = str(value).lower()
+        if col in self.SPLIT:
+            return sorted(set(text.split()))
+        return [text] if text else []
+
+    def _add_rows(self, df):
+        # Un movimiento suelto (diálogo, API): armar las claves por columnas
+        # recorrería todas las categorías de Producto en cada llamada
+        for col in self.COLUMNS:
+            postings = self.postings[col]
+            for label, value in zip(df.index, df[col].astype(object)):
+                for key in self._row_keys(col, value):
+                    if key not in postings:
+                        postings[key] = array('q')
+                    postings[key].append(int(label))
+
+    def add(self, df):
+        """Indexa las filas de df (el historial completo o solo las nuevas)."""
+        if df.empty:
+            return
+        if len(df) <= self.POCAS_FILAS:
+            self._add_rows(df)
+            return
+        for col in self.COLUMNS:
+            keys = self._keys(df, col)
+            if keys.empty:
+                continue
+            codes, uniques = pd.factorize(keys.to_numpy())
+            labels = keys.index.to_numpy(dtype=np.int64)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+            postings = self.postings[col]
+            for key, rows in zip(uniques, np.split(labels[order], bounds)):
+                if key not in postings:
+                    postings[key] = array('q')
+                postings[key].frombytes(rows.tobytes())
+
+    def renombrar(self, viejo, nuevo):
+        """Pasa las filas del producto `viejo` a la clave de `nuevo`."""
+        postings = self.postings["Producto"]
+        filas = postings.pop(str(viejo).lower(), None)
+        if filas is None:
+            return
+        clave = str(nuevo).lower()
+        if clave in postings:
+            postings[clave].extend(filas)
+        else:
+            postings[clave] = filas
+
+    def _lookup(self, col, word):
+        hits = [np.frombuffer(rows, dtype=np.int64)
+                for key, rows in self.postings[col].items() if word in key]
+        if not hits:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(hits))
+
+    def _match(self, df_mov, col, term):
+        words = term.split() if col in self.SPLIT else [term]
+        if not words:
+            return np.array([], dtype=np.int64)
+        rows = self._lookup(col, words[0])
+        for word in words[1:]:
+            rows = np.intersect1d(rows, self._lookup(col, word), assume_unique=True)
+        if len(words) > 1 and len(rows):
+            # Verificar la frase completa solo sobre los candidatos
+            text = self._text(df_mov.loc[rows], col)
+            rows = rows[text.str.contains(term, regex=False).to_numpy()]
+        return rows
+
+    @classmethod
+    def parse(cls, query):
+        """Devuelve [(columna o None, término en minúsculas), ...]."""
+        try:
+            parts = shlex.split(query)
+        except ValueError:
+            parts = query.split()
+        terms = []
+        for part in parts:
+            campo, sep, valor = part.partition(":")
+            if sep and valor and campo.lower() in cls.FIELDS:
+                terms.append((cls.FIELDS[campo.lower()], valor.lower()))
+            elif part.strip():
+                terms.append((None, part.lower()))
+        return terms
+
+    def search(self, df_mov, query):
+        """Índices de df_mov (ordenados) que cumplen todos los términos, o None si no hay consulta."""
+        terms = self.parse(query)
+        if not terms:
+            return None
+        result = None
+        for col, term in terms:
+            if col is None:
+                rows = np.unique(np.concatenate([self._match(df_mov, c, term) for c in self.COLUMNS]))
+            else:
+                rows = self._match(df_mov, col, term)
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+class ResumenInventario:
+    """Agregados de df_inv para Análisis y Alertas, mantenidos producto a producto.
+
+    Por cada producto se recuerda su aporte (nombre, categoría, stock, valor,
+    mínimo). Cuando un producto cambia se descuenta el aporte anterior y se
+    suma el nuevo: el total de su categoría se ajusta por la diferencia, el
+    producto se reubica en las listas ordenadas por stock y por valor (bisect,
+    como ProductoIndex) y entra o sale del conjunto de stock bajo. Nada de
+    esto vuelve a ordenar ni agrupar el inventario completo.
+    """
+    # Con más cambios que esta fracción del inventario conviene rehacerlo todo
+    RECONSTRUIR = 0.25
+
+    def __init__(self, df_inv=None):
+        self._clear()
+        if df_inv is not None:
+            self.rebuild(df_inv)
+
+    def _clear(self):
+        self.aportes = {}           # id -> (nombre, categoría, stock, valor, mínimo)
+        self.por_categoria = {}     # categoría -> stock total
+        self.en_categoria = {}      # categoría -> cantidad de productos
+        self.por_stock = []         # [(-stock, id)] de productos con nombre
+        self.por_valor = []         # [(-valor, id)]
+        self.bajos = set()          # ids con Stock Final <= Stock Mínimo
+        self.con_minimo = 0         # productos con Stock Mínimo definido
+
+    @staticmethod
+    def _aporte(df, idx):
+        categoria, minimo = df.at[idx, 'Categoría'], df.at[idx, 'Stock Mínimo']
+        return (texto(df.at[idx, 'Producto']),
+                None if pd.isna(categoria) else categoria,
+                safe_int(df.at[idx, 'Stock Final']),
+                safe_float(df.at[idx, 'Valor Total']),
+                None if pd.isna(minimo) else safe_int(minimo))
+
+    def rebuild(self, df_inv):
+        """Recalcula todo por columnas (al cargar o con cambios masivos)."""
+        self._clear()
+        ids = df_inv.index.to_numpy(dtype=np.int64)
+        # Los nombres son casi todos distintos: strip vectorizado y no texto_col
+        nombre = df_inv['Producto'].astype(object).fillna('').astype(str).str.strip().to_numpy(dtype=object)
+        stock = pd.to_numeric(df_inv['Stock Final'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        valor = pd.to_numeric(df_inv['Valor Total'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+        minimo = pd.to_numeric(df_inv['Stock Mínimo'], errors='coerce').astype(float).to_numpy()
+        categoria = df_inv['Categoría'].astype(object)
+        con_minimo = ~np.isnan(minimo)
+        self.aportes = dict(zip(ids.tolist(), zip(
+            nombre, categoria.where(categoria.notna(), None),
+            stock.tolist(), valor.tolist(),
+            [int(m) if ok else None for m, ok in zip(minimo.tolist(), con_minimo)])))
+        
+        por_categoria = pd.Series(stock).groupby(categoria.to_numpy(), dropna=True)
+        self.por_categoria = por_categoria.sum().to_dict()
+        self.en_categoria = por_categoria.size().to_dict()
+        con_nombre = nombre != ""
+        orden = np.lexsort((ids[con_nombre], -stock[con_nombre]))
+        self.por_stock = list(zip((-stock[con_nombre])[orden].tolist(), ids[con_nombre][orden].tolist()))
+        orden = np.lexsort((ids, -valor))
+        self.por_valor = list(zip((-valor)[orden].tolist(), ids[orden].tolist()))
+        self.bajos = set(ids[con_minimo & (stock <= np.where(con_minimo, minimo, 0))].tolist())
+        self.con_minimo = int(con_minimo.sum())
+
+    def update(self, df_inv, indices):
+        """Actualiza los productos indicados (agregados, editados o eliminados)."""
+        if len(indices) > self.RECONSTRUIR * max(len(self.aportes), 1):
+            self.rebuild(df_inv)
+            return
+        for idx in indices:
+            self._remove(idx)
+        for idx in indices:
+            if idx in df_inv.index:
+                self._add(idx, self._aporte(df_inv, idx))
+
+    def _add(self, idx, aporte):
+        nombre, categoria, stock, valor, minimo = self.aportes[idx] = aporte
+        if categoria is not None:
+            self.por_categoria[categoria] = self.por_categoria.get(categoria, 0) + stock
+            self.en_categoria[categoria] = self.en_categoria.get(categoria, 0) + 1
+        if nombre:
+            bisect.insort(self.por_stock, (-stock, idx))
+        bisect.insort(self.por_valor, (-valor, idx))
+        if minimo is not None:
+            self.con_minimo += 1
+            if stock <= minimo:
+                self.bajos.add(idx)
+
+    def _remove(self, idx):
+        aporte = self.aportes.pop(idx, None)
+        if aporte is None:
+            return
+        nombre, categoria, stock, valor, minimo = aporte
+        if categoria is not None:
+            self.por_categoria[categoria] -= stock
+            self.en_categoria[categoria] -= 1
+            if not self.en_categoria[categoria]:
+                del self.por_categoria[categoria], self.en_categoria[categoria]
+        if nombre:
+            del self.por_stock[bisect.bisect_left(self.por_stock, (-stock, idx))]
+        del self.por_valor[bisect.bisect_left(self.por_valor, (-valor, idx))]
+        if minimo is not None:
+            self.con_minimo -= 1
+        self.bajos.discard(idx)
+
+    def top_stock(self, n):
+        """[(nombre, stock)] de los n productos con más stock."""
+        return [(self.aportes[idx][0], -clave) for clave, idx in self.por_stock[:n]]
+
+    def top_valor(self, n):
+        """[(nombre, valor)] de los n productos de mayor valor (solo valores > 0)."""
+        return [(self.aportes[idx][0], -clave) for clave, idx in self.por_valor[:n] if clave < 0]
+
+    def categorias(self):
+        """{categoría: stock total}, ordenado por categoría."""
+        return dict(sorted(self.por_categoria.items(), key=lambda kv: str(kv[0])))
+
+    def stock_bajo(self):
+        """[(id, nombre, stock, mínimo)] de los productos con stock bajo, por id."""
+        return [(idx, *itemgetter(0, 2, 4)(self.aportes[idx])) for idx in sorted(self.bajos)]
+
+class HistorialMovimientos:
+    """Series de tiempo del historial de movimientos para Análisis.
+
+    Cada movimiento aporta a su producto las unidades que entraron o
+    salieron y cuánto cambió su stock desde el movimiento anterior del mismo
+    producto (según Stock Antes/Stock Después). Esos aportes se suman en
+    tablas materializadas por (período, producto) para día, semana y mes.
+    El historial solo crece: cada consulta procesa únicamente los
+    movimientos nuevos y los suma a la cola de las tablas; después filtra
+    los productos pedidos y suma por período con bincount.
+    """
+    FRECUENCIAS = {"D": "Día", "W": "Semana", "M": "Mes"}
+    COLUMNAS = ("Entradas", "Salidas", "Delta")
+
+    def __init__(self, movimientos):
+        self.movimientos = movimientos
+        self._clear()
+
+    def _clear(self):
+        self.hasta = 0               # filas del historial ya procesadas
+        self.ultima_fecha = None     # fecha más reciente procesada
+        self.productos = {}          # nombre -> código
+        self.inicial = np.zeros(0)   # código -> stock antes de su primer movimiento
+        self.ultimo = np.zeros(0)    # código -> último stock conocido (NaN si ninguno)
+        self.tablas = dict.fromkeys(self.FRECUENCIAS)  # frecuencia -> {columna: arreglo}
+
+    @staticmethod
+    def _periodos(dias, frecuencia):
+        """Número de período (contado desde 1970) de cada día."""
+        if frecuencia == "W":
+            return (dias + 3) // 7  # semanas de lunes a domingo
+        if frecuencia == "M":
+            return dias.astype("M8[D]").astype("M8[M]").astype(np.int64)
+        return dias
+
+    @staticmethod
+    def _fechas(periodos, frecuencia):
+        """Fecha de inicio de cada período."""
+        if frecuencia == "M":
+            return pd.DatetimeIndex(periodos.astype("M8[M]").astype("M8[s]"))
+        if frecuencia == "W":
+            periodos = periodos * 7 - 3
+        return pd.DatetimeIndex(periodos.astype("M8[D]").astype("M8[s]"))
+
+    @classmethod
+    def _agrupar(cls, periodo, codigo, valores):
+        """Suma `valores` por (período, producto); la tabla queda ordenada por período."""
+        if not len(periodo):
+            return None
+        base, ancho = periodo.min(), codigo.max() + 1
+        claves, inversa = np.unique((periodo - base) * ancho + codigo, return_inverse=True)
+        tabla = {"Periodo": claves // ancho + base, "Producto": claves % ancho}
+        for c in cls.COLUMNAS:
+            tabla[c] = np.bincount(inversa, weights=valores[c], minlength=len(claves))
+        return tabla
+
+    def _sumar(self, frecuencia, nueva):
+        tabla = self.tablas[frecuencia]
+        if tabla is None or nueva is None:
+            self.tablas[frecuencia] = tabla or nueva
+            return
+        # Lo nuevo no es anterior a lo ya procesado: solo puede coincidir con
+        # el último período de la tabla, que se vuelve a agrupar
+        corte = np.searchsorted(tabla["Periodo"], nueva["Periodo"][0])
+        cola = {k: np.concatenate([v[corte:], nueva[k]]) for k, v in tabla.items()}
+        cola = self._agrupar(cola["Periodo"], cola["Producto"], cola)
+        self.tablas[frecuencia] = {k: np.concatenate([v[:corte], cola[k]]) for k, v in tabla.items()}
+
+    def _codigos(self, nombres):
+        for nombre in nombres:
+            self.productos.setdefault(nombre, len(self.productos))
+        faltan = len(self.productos) - len(self.ultimo)
+        if faltan:
+            self.inicial = np.concatenate([self.inicial, np.full(faltan, np.nan)])
+            self.ultimo = np.concatenate([self.ultimo, np.full(faltan, np.nan)])
+        return np.array([self.productos[n] for n in nombres] + [-1], dtype=np.int64)
+
+    def _sync(self):
+        """Procesa los movimientos agregados desde la última consulta."""
+        log, desde = self.movimientos, self.hasta
+        if len(log) == desde:
+            return
+        fecha = pd.to_datetime(log.column("Fecha", desde), errors="coerce")
+        if self.ultima_fecha is not None and fecha.min() < self.ultima_fecha:
+            # Movimientos con fecha anterior a lo procesado (una importación
+            # de historial): los cambios de stock se encadenan en otro orden
+            self._clear()
+            return self._sync()
+        n = len(log)
+        codigos, nombres = pd.factorize(log.column("Producto", desde))
+        codigo = self._codigos(list(nombres))[codigos]
+        validas = fecha.notna().to_numpy() & (codigo >= 0)
+        tipo = log.column("Tipo", desde)
+        entrada = (tipo == "Entrada").to_numpy(dtype=bool, na_value=False)
+        salida = (tipo == "Salida").to_numpy(dtype=bool, na_value=False)
+        cantidad = pd.to_numeric(log.column("Cantidad", desde), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        cantidad = np.nan_to_num(cantidad)
+        antes, despues = (pd.to_numeric(log.column(c, desde), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+                          for c in ("Stock Antes", "Stock Después"))
+        # Por producto y en orden cronológico (estable ante fechas iguales)
+        instante = fecha.to_numpy().astype("M8[us]").astype(np.int64)
+        orden = np.flatnonzero(validas)
+        orden = orden[np.lexsort((orden, instante[orden], codigo[orden]))]
+        c, s = codigo[orden], despues[orden]
+
+        # Stock de partida de los productos que aparecen por primera vez
+        base = np.where(np.isnan(antes[orden]), s, antes[orden])
+        conocida = np.flatnonzero(~np.isnan(base))
+        primeras = conocida[np.r_[True, c[conocida][1:] != c[conocida][:-1]]] if len(conocida) else conocida
+        nuevos = np.isnan(self.ultimo[c[primeras]])
+        self.inicial[c[primeras][nuevos]] = base[primeras][nuevos]
+        self.ultimo[c[primeras][nuevos]] = base[primeras][nuevos]
+
+        # Cambio de stock respecto del último Stock Después conocido del producto
+        conocido = ~np.isnan(s)
+        previo = np.maximum.accumulate(np.where(conocido, np.arange(len(s)), -1))
+        previo = np.r_[-1, previo[:-1]]
+        mismo = (previo >= 0) & (c[np.maximum(previo, 0)] == c)
+        anterior = np.where(mismo, s[np.maximum(previo, 0)], self.ultimo[c])
+        delta = np.nan_to_num(np.where(conocido, s - anterior, 0.0))
+        conocida = np.flatnonzero(conocido)
+        ultimas = conocida[np.r_[c[conocida][1:] != c[conocida][:-1], True]] if len(conocida) else conocida
+        self.ultimo[c[ultimas]] = s[ultimas]
+
+        valores = {
+            "Entradas": np.where(entrada[orden], cantidad[orden], 0.0),
+            "Salidas": np.where(salida[orden], cantidad[orden], 0.0),
+            "Delta": delta,
+        }
+        dias = instante[orden] // 86_400_000_000  # microsegundos por día
+        diaria = self._agrupar(dias, c, valores)
+        self._sumar("D", diaria)
+        for frecuencia in ("W", "M"):
+            nueva = diaria and self._agrupar(self._periodos(diaria["Periodo"], frecuencia), diaria["Producto"], diaria)
+            self._sumar(frecuencia, nueva)
+        if len(orden):
+            maxima = fecha[validas].max()
+            self.ultima_fecha = maxima if self.ultima_fecha is None else max(self.ultima_fecha, maxima)
+        self.hasta = n
+
+    def renombrar(self, viejo, nuevo):
+        """Sigue un renombrado del producto que ya se aplicó al historial."""
+        if viejo not in self.productos:
+            return
+        if nuevo in self.productos:
+            # Los dos nombres tienen aportes: se vuelve a procesar todo
+            self._clear()
+        else:
+            self.productos[nuevo] = self.productos.pop(viejo)
+
+    def seleccion(self, df_inv, filtro=""):
+        """Códigos de los productos que pide `filtro` (None = todos).
+
+        El filtro es una categoría (nombre exacto, sin distinguir mayúsculas)
+        o parte del nombre de uno o más productos del historial.
+        """
+        self._sync()
+        filtro = filtro.strip().lower()
+        if not filtro:
+            return None
+        categoria = self._categoria(df_inv, filtro)
+        if categoria.any():
+            nombres = set(texto_col(df_inv.loc[categoria, 'Producto']))
+            elegidos = [c for n, c in self.productos.items() if texto(n) in nombres]
+        else:
+            elegidos = [c for n, c in self.productos.items() if filtro in texto(n).lower()]
+        return np.array(elegidos, dtype=np.int64)
+
+    @staticmethod
+    def _categoria(df_inv, filtro):
+        """Máscara de df_inv con los productos de la categoría `filtro` (en minúsculas)."""
+        return texto_col(df_inv['Categoría'].astype(object)).str.lower() == filtro
+
+    def stock_sin_movimientos(self, df_inv, filtro=""):
+        """Stock Final de los productos que pide `filtro` sin movimientos en el historial.
+
+        Su stock no cambió nunca, así que entra en la curva de stock como
+        una constante (ver stock).
+        """
+        self._sync()
+        filtro = filtro.strip().lower()
+        nombres = texto_col(df_inv['Producto'])
+        elegidos = ~nombres.isin({texto(n) for n in self.productos})
+        if filtro:
+            categoria = self._categoria(df_inv, filtro)
+            elegidos &= categoria if categoria.any() else nombres.str.lower().str.contains(filtro, regex=False)
+        return float(pd.to_numeric(df_inv.loc[elegidos, 'Stock Final'], errors='coerce').sum())
+
+    def _sumas(self, frecuencia, codigos):
+        self._sync()
+        tabla = self.tablas[frecuencia]
+        if tabla is None:
+            return None
+        sel = slice(None) if codigos is None else np.isin(tabla["Producto"], codigos)
+        periodo = tabla["Periodo"][sel]
+        if not len(periodo):
+            return None
+        # Desde el primer período de la selección hasta el último del historial
+        inicio, fin = periodo[0], tabla["Periodo"][-1]
+        sumas = {c: np.bincount(periodo - inicio, weights=tabla[c][sel], minlength=fin - inicio + 1)
+                 for c in self.COLUMNAS}
+        return pd.DataFrame(sumas, index=self._fechas(np.arange(inicio, fin + 1), frecuencia))
+
+    def flujo(self, frecuencia="D", codigos=None):
+        """DataFrame de Entradas y Salidas por período (vacío si no hay movimientos)."""
+        sumas = self._sumas(frecuencia, codigos)
+        if sumas is None:
+            return pd.DataFrame(columns=["Entradas", "Salidas"], dtype=float)
+        return sumas[["Entradas", "Salidas"]]
+
+    def stock(self, frecuencia="D", codigos=None, sin_movimientos=0.0):
+        """Stock total de los productos al cierre de cada período, reconstruido del historial.
+
+        `sin_movimientos` es el stock de los productos que no aparecen en el
+        historial (ver stock_sin_movimientos); se suma igual en todos los
+        períodos.
+        """
+        sumas = self._sumas(frecuencia, codigos)
+        if sumas is None:
+            return pd.Series(dtype=float, name="Stock")
+        inicial = self.inicial if codigos is None else self.inicial[codigos]
+        return (np.nansum(inicial) + sin_movimientos + sumas["Delta"].cumsum()).rename("Stock")
+
+# ============== MODELO ==============
+class Cambios:
+    """Qué cambió en el modelo, para refrescar solo lo necesario.
+
+    productos: índices de df_inv agregados, editados o eliminados.
+    movimientos: índices de df_mov agregados.
+    None en cualquiera de los dos significa "todo" (recarga completa).
+    """
+
+    def __init__(self, productos=(), movimientos=()):
+        self.productos = None if productos is None else set(productos)
+        self.movimientos = None if movimientos is None else list(movimientos)
+
+class Importacion:
+    """Resultado de una importación masiva (ver InventarioModel.import_file)."""
+
+    def __init__(self, tipo):
+        self.tipo = tipo          # "productos" o "movimientos"
+        self.aceptadas = 0
+        self.rechazos = []        # DataFrames: Fila, Motivo y los valores originales
+
+    @property
+    def rechazadas(self):
+        return sum(len(df) for df in self.rechazos)
+
+    def rechazar(self, filas, motivos, valores):
+        """Anota filas rechazadas; `valores` son esas filas tal como se leyeron."""
+        if len(filas):
+            df = valores.reset_index(drop=True)
+            df.insert(0, "Motivo", list(motivos))
+            df.insert(0, "Fila", list(filas))
+            self.rechazos.append(df)
+
+    def write_rejects(self, path):
+        """Escribe las filas rechazadas (con su número de fila y el motivo) en un CSV."""
+        pd.concat(self.rechazos, ignore_index=True).to_csv(path, index=False, encoding='utf-8-sig')
+
+class InventarioModel:
+    """Estado en memoria de inventario y movimientos.
+
+    Es la fuente de verdad mientras la aplicación está abierta: los diálogos
+    lo modifican directamente, cada cambio se persiste como una operación del
+    backend y se avisa a los suscriptores con un Cambios. El disco solo se
+    vuelve a leer si otro proceso lo cambió (ver BloqueoArchivo); cada
+    escritura es una transacción que antes se pone al día (ver transaccion).
+    """
+    # Segundos que una transacción espera a otro proceso que tiene el bloqueo
+    # (None = ESPERA_BLOQUEO). La ventana usa 0 y reintenta con after(), así
+    # el hilo de Tk nunca se queda esperando.
+    espera_bloqueo = None
+
+    def __init__(self):
+        self._listeners = []
+        self.version = 0  # sube con cada cambio; sirve de clave para cachés
+        self.writer = SaveWorker()
+        self.save_error = None
+        self.fallos_guardado = 0  # guardados que fallaron (ver InventarioAPI.escribir)
+        self._avisos = []
+        self.load()
+
+    @metricas.medir("modelo.load", filas=lambda r, self: len(self.df_inv) + len(self.movimientos))
+    def load(self):
+        bloqueo = get_backend().bloqueo
+        with bloqueo:
+            self.df_inv, df_mov = load_data()
+            self._ajenos = bloqueo.ajenos
+        self.movimientos = MovimientoLog(df_mov)
+        self.index_search()
+        self.product_index = ProductoIndex(self.df_inv)
+        self.resumen = ResumenInventario(self.df_inv)
+        self.historial = HistorialMovimientos(self.movimientos)
+        self.mov_index = MovimientoIndex(df_mov)
+
+    @staticmethod
+    def _search_text(df):
+        # Producto, Categoría y Proveedor en minúsculas, separados por \x00
+        # para que una búsqueda no coincida "entre" dos campos
+        text = df['Producto'].fillna('').astype(str)
+        for col in ('Categoría', 'Proveedor'):
+            text = text + "\x00" + df[col].astype(object).fillna('').astype(str)
+        return text.str.lower()
+
+    def index_search(self, indices=None):
+        """Mantiene la columna de búsqueda precalculada (todas o solo `indices`)."""
+        if indices is None:
+            self.search_inv = self._search_text(self.df_inv)
+            return
+        vivos = [i for i in indices if i in self.df_inv.index]
+        muertos = [i for i in indices if i not in self.df_inv.index]
+        if muertos:
+            self.search_inv = self.search_inv.drop(index=muertos, errors='ignore')
+        if vivos:
+            textos = self._search_text(self.df_inv.loc[vivos])
+            nuevos = textos.index.difference(self.search_inv.index)
+            existentes = textos.index.intersection(self.search_inv.index)
+            if len(existentes):
+                self.search_inv.loc[existentes] = textos.loc[existentes]
+            if len(nuevos):
+                self.search_inv = pd.concat([self.search_inv, textos.loc[nuevos]])
+
+    @metricas.medir(filas=lambda r, *args: len(r))
+    def filter_products(self, query):
+        """Índices de los productos cuyo nombre, categoría o proveedor contienen `query`."""
+        query = query.strip().lower()
+        if not query:
+            return self.df_inv.index
+        mask = self.search_inv.str.contains(query, regex=False).to_numpy()
+        return self.search_inv.index[mask]
+
+    @metricas.medir(filas=lambda r, *args: len(r))
+    def find_product(self, name, partial=True):
+        return self.product_index.find(name, partial)
+
+    @metricas.medir(filas=lambda r, *args: len(r))
+    def search_movements(self, query):
+        """Índices de df_mov que coinciden con la consulta (ver MovimientoIndex)."""
+        rows = self.mov_index.search(self.df_mov, query)
+        return self.df_mov.index if rows is None else pd.Index(rows)
+
+    def product_matches(self, idx, query):
+        query = query.strip().lower()
+        return idx in self.search_inv.index and query in self.search_inv.loc[idx]
+
+    @property
+    def df_mov(self):
+        return self.movimientos.frame
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def notify(self, cambios):
+        self.version += 1
+        # Los agregados siguen a los productos de cada cambio (una recarga
+        # completa ya los rehízo en load)
+        if cambios.productos:
+            self.resumen.update(self.df_inv, cambios.productos)
+        for callback in self._listeners:
+            callback(cambios)
+
+    def _persist(self, op, **data):
+        try:
+            completo = persist_change(op, **data)
+        except Exception as e:
+            self._resultado("error", str(e))
+            return
+        if completo:
+            self.save()
+
+    def _resultado(self, evento, detalle=None):
+        """Anota un aviso del guardado, venga de SaveWorker o de una escritura en el
+        acto; la ventana lo muestra desde save_events() y la línea de comandos
+        con save_error."""
+        if evento == "guardado":
+            self.save_error = None
+        elif evento == "error":
+            self.save_error = detalle
+            self.fallos_guardado += 1
+        self._avisos.append((evento, detalle))
+
+    def _drain_saves(self):
+        for evento, detalle in self.writer.drain():
+            self._resultado(evento, detalle)
+
+    def save_events(self):
+        """Avisos del guardado desde la última llamada (hilo de la UI).
+
+        [(evento, detalle), ...] con evento "guardando", "guardado" o "error".
+        """
+        self._drain_saves()
+        avisos, self._avisos = self._avisos, []
+        return avisos
+
+    def save_status(self):
+        """"sin guardar", "guardando", "guardado" o "error"."""
+        self._drain_saves()
+        if self.writer.pendiente():
+            return "sin guardar"
+        if self.writer.escribiendo():
+            return "guardando"
+        return "error" if self.save_error else "guardado"
+
+    def reload_if_changed(self):
+        """Recarga si otro proceso escribió desde la última lectura.
+
+        Si otro proceso tiene el bloqueo (está escribiendo) no lo espera:
+        devuelve False y se vuelve a mirar en la próxima llamada.
+        """
+        self._drain_saves()
+        bloqueo = get_backend().bloqueo
+        try:
+            bloqueo.acquire(espera=0)
+        except BloqueoOcupado:
+            return False
+        try:
+            if bloqueo.ajenos == self._ajenos:
+                return False
+            metricas.contar("recargas")
+            self.load()
+        finally:
+            bloqueo.release()
+        self.notify(Cambios(None, None))
+        return True
+
+    @contextmanager
+    def transaccion(self):
+        """Escritura exclusiva frente a otros procesos con los mismos archivos.
+
+        Toma el bloqueo del backend y, si otro proceso escribió desde la
+        última lectura, recarga antes de aplicar nada: los cambios se
+        calculan siempre sobre el estado vigente. Se puede anidar. Tras una
+        recarga los índices de df_inv pueden cambiar (ver _vigente).
+
+        Si otro proceso tiene el bloqueo se lo espera `espera_bloqueo`
+        segundos y después BloqueoOcupado, antes de cambiar nada.
+        """
+        bloqueo = get_backend().bloqueo
+        bloqueo.acquire(self.espera_bloqueo)
+        try:
+            self.reload_if_changed()
+            yield
+        finally:
+            bloqueo.release()
+
+    def _vigente(self, idx, nombre):
+        """Índice actual del producto `nombre`, que era `idx` antes de la transacción."""
+        if idx in self.df_inv.index and self.df_inv.at[idx, 'Producto'] == nombre:
+            return idx
+        encontrados = self.find_product(nombre, partial=False)
+        if not encontrados:
+            raise Conflicto(f"El producto '{nombre}' fue eliminado por otro usuario")
+        return encontrados[0]
+
+    def product_version(self, idx):
+        """Versión del producto: sube con cada cambio (ver version_vieja)."""
+        return safe_int(self.df_inv.at[idx, 'Versión'])
+
+    def _bump_version(self, idx):
+        self.df_inv.at[idx, 'Versión'] = self.product_version(idx) + 1
+
+    def save(self):
+        """Pide una escritura completa del estado actual.
+
+        Si el backend lo permite la hace SaveWorker en segundo plano sobre una
+        copia de df_inv (el historial solo crece, no hace falta copiarlo).
+        Si no, se escribe en el acto y el aviso queda igual en save_events().
+        """
+        backend = get_backend()
+        with self.transaccion():
+            if backend.en_segundo_plano:
+                self.writer.submit(self.df_inv.copy(), self.df_mov, backend.marca())
+                return True
+            try:
+                _save_data(self.df_inv, self.df_mov)
+            except Exception as e:
+                self._resultado("error", str(e))
+                return False
+        self._resultado("guardado")
+        return True
+
+    def close(self, exportar=True):
+        """Espera las escrituras pendientes y libera el backend.
+
+        Con exportar=False no se exporta el diario al libro (la línea de
+        comandos: un comando suelto no debería reescribir el libro entero ni
+        crear un respaldo); lo hacen EXPORTAR_CADA o `exportar libro`.
+        Después de cerrar el modelo ya no guarda en segundo plano.
+        """
+        self.writer.cerrar()
+        self._drain_saves()
+        if not exportar:
+            get_backend().close(None, None)
+            return
+        # Lo que se exporte al cerrar incluye lo que escribieron otros procesos
+        with self.transaccion():
+            get_backend().close(self.df_inv, self.df_mov)
+
+    def next_id(self):
+        # Los índices de df_inv son ids estables: no se reutilizan al eliminar
+        return int(self.df_inv.index.max()) + 1 if len(self.df_inv) else 0
+
+    def add_product(self, producto, categoria=pd.NA, proveedor=pd.NA, stock_inicial=0,
+                    stock_minimo=pd.NA, precio_unitario=0.0, usuario=pd.NA, observaciones=pd.NA):
+        with self.transaccion():
+            # Otro proceso pudo darlo de alta mientras se completaba el diálogo
+            if self.find_product(producto, partial=False):
+                raise ValueError("El producto ya existe")
+            idx = self.next_id()
+            nuevo = pd.DataFrame([[
+                producto, categoria, proveedor,
+                stock_inicial, 0, 0, stock_inicial,
+                stock_minimo, precio_unitario,
+                stock_inicial * precio_unitario,
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                usuario, observaciones, 1
+            ]], columns=HEADERS, index=[idx])
+            self.df_inv = append_rows(self.df_inv, nuevo, INV_SCHEMA)
+            self.index_search([idx])
+            self.product_index.add(idx, producto)
+            self._persist("producto", row=record_row(self.df_inv.loc[idx], HEADERS))
+        self.notify(Cambios(productos=[idx]))
+        return idx
+
+    def update_product(self, idx, fields, version=None):
+        """Actualiza los campos indicados; recalcula el valor si cambia el precio.
+
+        `version` es la de product_version() cuando se leyeron los datos que
+        se editaron: si el producto cambió después, Conflicto en lugar de
+        pisar el cambio. Devuelve el índice del producto (puede cambiar si
+        hubo que recargar).
+        """
+        nombre = self.df_inv.at[idx, "Producto"]
+        with self.transaccion():
+            idx = self._vigente(idx, nombre)
+            if version is not None and version != self.product_version(idx):
+                raise Conflicto(f"'{nombre}' fue modificado por otro usuario; "
+                                "vuelva a abrirlo para ver los cambios")
+            nuevo = fields.get("Producto", nombre)
+            renombrado = nuevo != nombre
+            if renombrado:
+                if any(i != idx for i in self.find_product(nuevo, partial=False)):
+                    raise Conflicto(f"Ya existe un producto llamado '{nuevo}'")
+                self.product_index.remove(idx, nombre)
+                self.product_index.add(idx, nuevo)
+                self._renombrar_movimientos(nombre, nuevo)
+            for col, value in fields.items():
+                set_value(self.df_inv, idx, col, value)
+            if "Precio Unitario" in fields:
+                self.df_inv.at[idx, "Valor Total"] = self.df_inv.at[idx, "Stock Final"] * fields["Precio Unitario"]
+            self.df_inv.at[idx, "Fecha de Movimiento"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._bump_version(idx)
+            self.index_search([idx])
+            extra = {"anterior": nombre} if renombrado else {}
+            self._persist("producto", row=record_row(self.df_inv.loc[idx], HEADERS), **extra)
+        # Un renombrado cambia filas ya mostradas del historial
+        self.notify(Cambios(productos=[idx], movimientos=None if renombrado else ()))
+        return idx
+
+    def _renombrar_movimientos(self, viejo, nuevo):
+        """El historial sigue al producto: sus movimientos pasan al nombre nuevo."""
+        self.movimientos.renombrar("Producto", viejo, nuevo)
+        self.mov_index.renombrar(viejo, nuevo)
+        self.historial.renombrar(viejo, nuevo)
+
+    def delete_product(self, idx):
+        nombre = self.df_inv.at[idx, 'Producto']
+        with self.transaccion():
+            idx = self._vigente(idx, nombre)
+            prod_name = self.df_inv.at[idx, 'Producto']
+            self.df_inv.drop(index=idx, inplace=True)
+            self.index_search([idx])
+            self.product_index.remove(idx, prod_name)
+            self._persist("eliminar", producto=prod_name)
+        self.notify(Cambios(productos=[idx]))
+
+    def _apply_movement(self, idx, tipo, cantidad, usuario, observaciones):
+        """Aplica un movimiento ya validado en memoria; devuelve (índice, operación)."""
+        stock_antes = safe_int(self.df_inv.loc[idx, 'Stock Final'])
+        
+        if tipo == "Entrada":
+            self.df_inv.loc[idx, 'Entradas'] += cantidad
+            self.df_inv.loc[idx, 'Stock Final'] += cantidad
+        else:  # Salida
+            self.df_inv.loc[idx, 'Salidas'] += cantidad
+            self.df_inv.loc[idx, 'Stock Final'] -= cantidad
+        
+        self.df_inv.loc[idx, 'Valor Total'] = (
+            self.df_inv.loc[idx, 'Stock Final'] * 
+            safe_float(self.df_inv.loc[idx, 'Precio Unitario'])
+        )
+        self.df_inv.loc[idx, 'Fecha de Movimiento'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._bump_version(idx)
+        
+        mov_idx = log_movement(
+            self.movimientos,
+            self.df_inv.loc[idx, 'Producto'],
+            tipo, cantidad, usuario, observaciones,
+            stock_antes,
+            self.df_inv.loc[idx, 'Stock Final']
+        )
+        op = {"op": "movimiento",
+              "row": record_row(self.df_inv.loc[idx], HEADERS),
+              "mov": record_row(self.movimientos.row(mov_idx), MOV_HEADERS)}
+        return mov_idx, op
+
+    def validate_movements(self, lines):
+        """Valida [(idx, tipo, cantidad), ...] contra el Stock Final actual.
+
+        Las líneas del mismo producto se acumulan en orden. Devuelve la lista
+        de errores (vacía si todo el lote es válido); no modifica nada.
+        """
+        errores = []
+        stock = {}
+        for n, (idx, tipo, cantidad) in enumerate(lines, start=1):
+            if idx not in self.df_inv.index:
+                errores.append(f"Línea {n}: el producto no existe")
+                continue
+            nombre = self.df_inv.at[idx, 'Producto']
+            if tipo not in ("Entrada", "Salida"):
+                errores.append(f"Línea {n} ({nombre}): tipo '{tipo}' inválido")
+                continue
+            if cantidad <= 0:
+                errores.append(f"Línea {n} ({nombre}): la cantidad debe ser mayor a 0")
+                continue
+            actual = stock.get(idx, safe_int(self.df_inv.at[idx, 'Stock Final']))
+            if tipo == "Salida" and actual < cantidad:
+                errores.append(f"Línea {n} ({nombre}): stock insuficiente ({actual} < {cantidad})")
+                continue
+            stock[idx] = actual + cantidad if tipo == "Entrada" else actual - cantidad
+        return errores
+
+    def resolve_movements(self, entries):
+        """Pasa [(producto, tipo, cantidad), ...] (ver parse_lote) a índices de df_inv.
+
+        Devuelve ([(idx, tipo, cantidad), ...], [errores]); solo cuentan los
+        nombres exactos.
+        """
+        lines, errores = [], []
+        for n, (producto, tipo, cantidad) in enumerate(entries, start=1):
+            encontrados = self.find_product(producto, partial=False)
+            if not encontrados:
+                errores.append(f"Línea {n}: el producto '{producto}' no existe")
+                continue
+            lines.append((encontrados[0], tipo, cantidad))
+        return lines, errores
+
+    @metricas.medir(filas=lambda r, *args: 1)
+    def record_movement(self, idx, tipo, cantidad, usuario=pd.NA, observaciones=pd.NA, version=None):
+        """Registra una Entrada o Salida y devuelve el stock resultante.
+
+        El movimiento se suma al stock vigente aunque otro proceso lo haya
+        cambiado desde que se leyó (`version`, ver product_version): solo si
+        con ese cambio la Salida ya no alcanza se rechaza con Conflicto.
+        """
+        if cantidad <= 0:
+            raise ValueError("La cantidad debe ser mayor a 0")
+        if tipo not in ("Entrada", "Salida"):
+            raise ValueError(f"Tipo '{tipo}' inválido")
+        nombre = self.df_inv.at[idx, 'Producto']
+        with self.transaccion():
+            idx = self._vigente(idx, nombre)
+            stock = safe_int(self.df_inv.loc[idx, 'Stock Final'])
+            if tipo == "Salida" and stock < cantidad:
+                if version is not None and version != self.product_version(idx):
+                    raise Conflicto(f"Otro usuario cambió el stock de '{nombre}' "
+                                    f"mientras tanto; ahora es {stock}")
+                raise ValueError("Stock insuficiente")
+            
+            mov_idx, op = self._apply_movement(idx, tipo, cantidad, usuario, observaciones)
+            self.mov_index.add(self.movimientos.take([mov_idx]))
+            self._persist("movimiento", row=op["row"], mov=op["mov"])
+        self.notify(Cambios(productos=[idx], movimientos=[mov_idx]))
+        return self.df_inv.loc[idx, 'Stock Final']
+
+    @metricas.medir(filas=lambda r, *args: len(r))
+    def record_movements(self, lines, usuario=pd.NA, observaciones=pd.NA):
+        """Registra un lote de movimientos [(idx, tipo, cantidad), ...] de forma atómica.
+
+        Primero valida todo el lote (ValueError con todos los errores, sin
+        aplicar nada); después lo persiste como una sola operación y avisa
+        un único Cambios.
+        """
+        nombres = {idx: self.df_inv.at[idx, 'Producto'] for idx, _, _ in lines if idx in self.df_inv.index}
+        with self.transaccion():
+            lines = [(self._vigente(idx, nombres[idx]) if idx in nombres else -1, tipo, cantidad)
+                     for idx, tipo, cantidad in lines]
+            errores = self.validate_movements(lines)
+            if errores:
+                raise ValueError("\n".join(errores))
+            
+            indices, ops = [], []
+            for idx, tipo, cantidad in lines:
+                mov_idx, op = self._apply_movement(idx, tipo, cantidad, usuario, observaciones)
+                indices.append(mov_idx)
+                ops.append(op)
+            
+            self.mov_index.add(self.movimientos.take(indices))
+            self._persist("lote", ops=ops)
+        self.notify(Cambios(productos={idx for idx, _, _ in lines}, movimientos=indices))
+        return indices
+
+    @metricas.medir(filas=lambda r, *args: r.aceptadas + r.rechazadas)
+    def import_file(self, path, chunksize=IMPORTAR_BLOQUE):
+        """Importa productos o movimientos desde un CSV/xlsx leído por bloques.
+
+        El contenido se deduce de las columnas (Tipo y Cantidad -> movimientos,
+        si no, productos). Cada fila se valida con las mismas reglas que los
+        diálogos; las aceptadas se aplican juntas al final y se persisten con
+        una sola operación "importar". Devuelve una Importacion.
+        """
+        chunks = read_chunks(path, chunksize)
+        first = next(chunks, None)
+        if first is None:
+            return Importacion("productos")
+        chunks = itertools.chain([first], chunks)
+        if "Producto" not in first.columns:
+            raise ValueError("El archivo no tiene una columna 'Producto'")
+        with self.transaccion():
+            if {"Tipo", "Cantidad"} <= set(first.columns):
+                return self.import_movements(chunks)
+            return self.import_products(chunks)
+
+    def import_products(self, chunks):
+        """Da de alta los productos de cada bloque; rechaza vacíos y duplicados."""
+        res = Importacion("productos")
+        vistos = set()
+        nuevos = []
+        fila = 1  # la fila 1 es el encabezado
+        ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for chunk in chunks:
+            rechazadas, motivos = [], []
+            for i, valores in enumerate(chunk.to_dict('records')):
+                producto = texto(valores.get("Producto"))
+                minimo = texto(valores.get("Stock Mínimo"))
+                stock_minimo = safe_int(minimo, None) if minimo else pd.NA
+                if not producto:
+                    motivo = "El campo 'Producto' es obligatorio"
+                elif product_key(producto) in vistos or self.find_product(producto, partial=False):
+                    motivo = "El producto ya existe"
+                elif stock_minimo is None:
+                    motivo = f"Stock Mínimo inválido: '{minimo}'"
+                else:
+                    motivo = None
+                if motivo:
+                    rechazadas.append(i)
+                    motivos.append(motivo)
+                    continue
+                vistos.add(product_key(producto))
+                stock_inicial = safe_int(valores.get("Stock Inicial"), 0)
+                precio_unitario = safe_float(valores.get("Precio Unitario"), 0.0)
+                nuevos.append([
+                    producto,
+                    texto(valores.get("Categoría")) or pd.NA,
+                    texto(valores.get("Proveedor")) or pd.NA,
+                    stock_inicial, 0, 0, stock_inicial,
+                    stock_minimo, precio_unitario,
+                    stock_inicial * precio_unitario,
+                    ahora,
+                    texto(valores.get("Usuario Responsable")) or pd.NA,
+                    texto(valores.get("Observaciones")) or pd.NA,
+                    1
+                ])
+            res.rechazar([fila + 1 + i for i in rechazadas], motivos, chunk.iloc[rechazadas])
+            fila += len(chunk)
+        
+        res.aceptadas = len(nuevos)
+        if not nuevos:
+            return res
+        start = self.next_id()
+        indices = list(range(start, start + len(nuevos)))
+        df_new = pd.DataFrame(nuevos, columns=HEADERS, index=indices)
+        self.df_inv = append_rows(self.df_inv, df_new, INV_SCHEMA)
+        self.index_search(indices)
+        for idx, producto in zip(indices, df_new['Producto']):
+            self.product_index.add(idx, producto)
+        self._persist("importar", rows=frame_records(df_new, HEADERS), movs=[])
+        self.notify(Cambios(productos=indices))
+        return res
+
+    def import_movements(self, chunks):
+        """Valida y registra los movimientos de cada bloque en el orden del archivo.
+
+        Las validaciones por fila se hacen por columnas. El stock se acumula
+        como en validate_movements: una Salida solo se acepta si alcanza el
+        stock con lo importado hasta esa fila; solo los productos que quedarían
+        en negativo se recorren fila a fila.
+        """
+        res = Importacion("movimientos")
+        stock, entradas, salidas = {}, {}, {}
+        productos = {}
+        bloques = []
+        fila = 1  # la fila 1 es el encabezado
+        ahora = pd.Timestamp.now().to_datetime64()
+        for chunk in chunks:
+            n = len(chunk)
+            filas = np.arange(fila + 1, fila + 1 + n)
+            fila += n
+            
+            codes, nombres = pd.factorize(texto_col(chunk["Producto"]))
+            for nombre in nombres:
+                if nombre not in productos:
+                    encontrados = self.find_product(nombre, partial=False)
+                    productos[nombre] = encontrados[0] if encontrados else -1
+            idx = np.array([productos[nombre] for nombre in nombres], dtype=np.int64)[codes]
+            tipo = texto_col(chunk["Tipo"]).str.lower().map(TIPOS_MOVIMIENTO).to_numpy(dtype=object)
+            # safe_int una vez por valor distinto; el código -1 (vacío) cae en el 0 final
+            codes, valores = pd.factorize(chunk["Cantidad"])
+            cantidad = np.array([safe_int(v, 0) for v in valores] + [0], dtype=np.int64)[codes]
+            if "Fecha" in chunk:
+                vacias = (texto_col(chunk["Fecha"]) == "").to_numpy()
+                fechas = pd.to_datetime(chunk["Fecha"].where(~vacias), errors="coerce").to_numpy(copy=True)
+                invalidas = np.isnat(fechas) & ~vacias
+                fechas[vacias] = ahora
+            else:
+                fechas = np.full(n, ahora)
+                invalidas = np.zeros(n, dtype=bool)
+            
+            motivo = np.select(
+                [idx < 0, pd.isna(tipo), cantidad <= 0, invalidas],
+                ["El producto no existe", "Tipo inválido (Entrada o Salida)",
+                 "La cantidad debe ser mayor a 0", "Fecha inválida"],
+                default="").astype(object)
+            
+            # Stock corriente por producto: acumulado del bloque sobre el stock previo
+            pos = np.flatnonzero(motivo == "")
+            prod = idx[pos]
+            delta = np.where(tipo[pos] == "Entrada", cantidad[pos], -cantidad[pos])
+            for p in np.unique(prod):
+                if p not in stock:
+                    stock[p] = safe_int(self.df_inv.at[p, 'Stock Final'])
+            base = np.array([stock[p] for p in prod], dtype=np.int64)
+            despues = base + pd.Series(delta).groupby(prod).cumsum().to_numpy()
+            aceptada = np.ones(len(pos), dtype=bool)
+            negativos = np.unique(prod[despues < 0])
+            if len(negativos):
+                corriente = {p: stock[p] for p in negativos}
+                for i in np.flatnonzero(np.isin(prod, negativos)):
+                    actual = corriente[prod[i]]
+                    if actual + delta[i] < 0:
+                        aceptada[i] = False
+                        motivo[pos[i]] = f"Stock insuficiente ({actual} < {-delta[i]})"
+                    else:
+                        corriente[prod[i]] = despues[i] = actual + delta[i]
+            
+            rechazadas = np.flatnonzero(motivo != "")
+            res.rechazar(filas[rechazadas], motivo[rechazadas], chunk.iloc[rechazadas])
+            pos, prod, delta, despues = pos[aceptada], prod[aceptada], delta[aceptada], despues[aceptada]
+            if not len(pos):
+                continue
+            
+            por_producto = pd.DataFrame({"prod": prod, "entrada": np.maximum(delta, 0),
+                                         "salida": np.maximum(-delta, 0), "stock": despues})
+            por_producto = por_producto.groupby("prod").agg({"entrada": "sum", "salida": "sum", "stock": "last"})
+            for p, ent, sal, final in por_producto.itertuples(name=None):
+                entradas[p] = entradas.get(p, 0) + ent
+                salidas[p] = salidas.get(p, 0) + sal
+                stock[p] = final
+            
+            def opcional(col):
+                if col not in chunk:
+                    return pd.NA
+                values = texto_col(chunk[col].iloc[pos]).to_numpy(dtype=object, copy=True)
+                values[values == ""] = pd.NA
+                return values
+            
+            bloques.append(pd.DataFrame({
+                'Fecha': fechas[pos],
+                'Producto': self.df_inv['Producto'].reindex(prod).to_numpy(dtype=object),
+                'Tipo': tipo[pos],
+                'Cantidad': cantidad[pos],
+                'Usuario': opcional('Usuario'),
+                'Observaciones': opcional('Observaciones'),
+                'Stock Antes': despues - delta,
+                'Stock Después': despues,
+            }))
+        
+        if not bloques:
+            return res
+        df_new = pd.concat(bloques, ignore_index=True)
+        res.aceptadas = len(df_new)
+        
+        indices = list(self.movimientos.extend(df_new))
+        afectados = list(entradas)
+        for col, cambios in (('Entradas', entradas), ('Salidas', salidas)):
+            suma = pd.Series(cambios, dtype=np.int64).reindex(afectados, fill_value=0)
+            self.df_inv.loc[afectados, col] = (
+                pd.to_numeric(self.df_inv.loc[afectados, col], errors='coerce').fillna(0) + suma)
+        final = pd.Series({p: stock[p] for p in afectados}, dtype=np.int64)
+        precio = self.df_inv.loc[afectados, 'Precio Unitario'].map(safe_float)
+        self.df_inv.loc[afectados, 'Stock Final'] = final
+        self.df_inv.loc[afectados, 'Valor Total'] = final * precio
+        self.df_inv.loc[afectados, 'Fecha de Movimiento'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.df_inv.loc[afectados, 'Versión'] = self.df_inv.loc[afectados, 'Versión'] + 1
+        
+        self.mov_index.add(self.movimientos.take(indices))
+        self._persist("importar", rows=frame_records(self.df_inv.loc[afectados], HEADERS),
+                      movs=frame_records(df_new, MOV_HEADERS))
+        self.notify(Cambios(productos=afectados, movimientos=indices))
+        return res
+
+# ============== REPORTES ==============
+def reporte_inventario(model):
+    """Resumen del inventario (apto para JSON): totales, stock por categoría
+    y productos con stock bajo."""
+    df = model.df_inv
+    stock = pd.to_numeric(df['Stock Final'], errors='coerce').fillna(0)
+    valor = pd.to_numeric(df['Valor Total'], errors='coerce').fillna(0.0)
+    return {
+        "productos": len(df),
+        "unidades": int(stock.sum()),
+        "valor_total": float(valor.sum()),
+        "movimientos": len(model.movimientos),
+        "por_categoria": {str(c): int(v) for c, v in model.resumen.categorias().items()},
+        "stock_bajo": [{"producto": nombre, "stock": int(final), "minimo": int(minimo)}
+                       for _, nombre, final, minimo in model.resumen.stock_bajo()],
+    }
+
+def _tabla_stock_bajo(model):
+    return model.df_inv.loc[[idx for idx, _, _, _ in model.resumen.stock_bajo()], HEADERS]
+
+# Tablas exportables: nombre -> función que la arma desde el modelo
+EXPORTES = {
+    "inventario": lambda model: model.df_inv[HEADERS],
+    "movimientos": lambda model: model.df_mov,
+    "stock-bajo": _tabla_stock_bajo,
+}
+
+def exportar(model, que, path):
+    """Escribe la tabla `que` (ver EXPORTES) en `path`, como .xlsx o CSV según
+    la extensión; devuelve la cantidad de filas."""
+    tabla = EXPORTES[que](model)
+    if path.lower().endswith(".xlsx"):
+        tabla.to_excel(path, index=False)
+    else:
+        tabla.to_csv(path, index=False, encoding='utf-8-sig')
+    return len(tabla)
+
+# Datos de los gráficos de la pestaña Análisis, sin dibujar nada (ver
+# ResumenInventario y HistorialMovimientos): la ventana los grafica y el
+# benchmark los mide sin pantalla
+TOP_GRAFICOS = 20  # barras de los gráficos de ranking
+
+def _top(pares):
+    return pd.Series([v for _, v in pares], index=[n for n, _ in pares], dtype=float)
+
+def _datos_stock_bajo(model):
+    bajos = model.resumen.stock_bajo()
+    return pd.DataFrame([(final, minimo) for _, _, final, minimo in bajos],
+                        columns=['Stock Final', 'Stock Mínimo'],
+                        index=[nombre for _, nombre, _, _ in bajos], dtype=float)
+
+def _titulo_historial(titulo, frecuencia, filtro):
+    titulo = f"{titulo} por {HistorialMovimientos.FRECUENCIAS[frecuencia].lower()}"
+    return f"{titulo}: {filtro.strip()}" if filtro.strip() else titulo
+
+def _datos_flujo(model, frecuencia="D", filtro=""):
+    historial = model.historial
+    datos = historial.flujo(frecuencia, historial.seleccion(model.df_inv, filtro))
+    datos.attrs["titulo"] = _titulo_historial("📈 Entradas vs Salidas", frecuencia, filtro)
+    return datos
+
+def _datos_evolucion(model, frecuencia="D", filtro=""):
+    historial = model.historial
+    datos = historial.stock(frecuencia, historial.seleccion(model.df_inv, filtro),
+                            historial.stock_sin_movimientos(model.df_inv, filtro))
+    datos.attrs["titulo"] = _titulo_historial("📦 Evolución del Stock", frecuencia, filtro)
+    return datos
+
+# Gráfico -> función que arma sus datos desde el modelo (flujo y evolución
+# aceptan frecuencia y filtro)
+GRAFICOS = {
+    "stock": lambda model: _top(model.resumen.top_stock(TOP_GRAFICOS)),
+    "valor": lambda model: _top(model.resumen.top_valor(TOP_GRAFICOS)),
+    "categoria": lambda model: pd.Series(model.resumen.categorias(), dtype=float),
+    "stock_bajo": _datos_stock_bajo,
+    "flujo": _datos_flujo,
+    "evolucion": _datos_evolucion,
+}
+
+def datos_grafico(model, nombre, **opciones):
+    """Serie o DataFrame que grafica `nombre` (ver GRAFICOS)."""
+    return GRAFICOS[nombre](model, **opciones)
+
+# ============== SERVIDOR HTTP ==============
+class ErrorAPI(Exception):
+    """Petición inválida: se responde con `estado` y el mensaje como error."""
+
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+# Campos de un producto que se pueden cambiar por la API (el stock cambia
+# solo con movimientos)
+CAMPOS_EDITABLES = ("Producto", "Categoría", "Proveedor", "Stock Mínimo",
+                    "Precio Unitario", "Usuario Responsable", "Observaciones")
+
+def _entero(valor, campo):
+    if isinstance(valor, bool) or not isinstance(valor, int):
+        raise ErrorAPI(400, f"'{campo}' debe ser un número entero")
+    return valor
+
+def _numero(valor, campo):
+    # json.loads acepta NaN e Infinity: tampoco son precios
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not np.isfinite(valor):
+        raise ErrorAPI(400, f"'{campo}' debe ser un número")
+    return float(valor)
+
+def _campo(datos, campo):
+    """Valor de texto opcional del cuerpo de una petición; vacío -> NA."""
+    valor = datos.get(campo)
+    return pd.NA if valor is None or not str(valor).strip() else str(valor).strip()
+
+class InventarioAPI:
+    """Operaciones de la API HTTP sobre un InventarioModel compartido.
+
+    Las lecturas responden desde el modelo en memoria. Las escrituras pasan
+    por un único hilo escritor que las aplica de a una, en orden de llegada,
+    con la misma lógica del modelo que usan la ventana y la línea de
+    comandos. Lecturas y escrituras toman el mismo candado, así que una
+    lectura nunca ve una escritura a medias. Cada escritura es una
+    transacción del modelo (ver InventarioModel.transaccion): los ids se
+    resuelven sobre el estado vigente aunque otro proceso haya escrito. Si
+    el cuerpo trae la "Versión" leída del producto, un cambio que se cruzó
+    con otro responde 409 (ver update_product y record_movement). Si la
+    escritura no llega al disco responde 500, aunque el modelo en memoria
+    ya la tenga.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="escritor")
+
+    def leer(self, funcion, *args):
+        with self.lock:
+            self.model.reload_if_changed()
+            return funcion(*args)
+
+    def escribir(self, funcion, *args):
+        def tarea():
+            with self.lock, self.model.transaccion():
+                self.model._drain_saves()
+                fallos = self.model.fallos_guardado
+                resultado = funcion(*args)
+                self.model._drain_saves()
+                if self.model.fallos_guardado != fallos:
+                    raise ErrorAPI(500, f"Error al guardar: {self.model.save_error}")
+                return resultado
+        return self.escritor.submit(tarea).result()
+
+    def cerrar(self):
+        self.escritor.shutdown(wait=True)
+
+    def despachar(self, metodo, ruta, consulta, cuerpo):
+        """Atiende una petición; devuelve (estado HTTP, datos JSON)."""
+        partes = [p for p in ruta.split("/") if p]
+        clave = tuple("<id>" if p.isdigit() else p for p in partes)
+        ruta = self.RUTAS.get((metodo, *clave))
+        if ruta is None:
+            otro_metodo = any(k[1:] == clave for k in self.RUTAS)
+            raise ErrorAPI(405 if otro_metodo else 404, f"Ruta desconocida: {metodo} /{'/'.join(partes)}")
+        acceso, nombre, estado = ruta
+        ids = [int(p) for p in partes if p.isdigit()]
+        return estado, getattr(self, acceso)(getattr(self, nombre), *ids, consulta, cuerpo)
+
+    # --- lecturas ---
+    def _fila(self, idx):
+        return {"id": int(idx), **record_row(self.model.df_inv.loc[idx], HEADERS)}
+
+    def _idx(self, idx):
+        if idx not in self.model.df_inv.index:
+            raise ErrorAPI(404, f"No existe el producto {idx}")
+        return idx
+
+    def listar_productos(self, consulta, cuerpo):
+        indices = self.model.filter_products(consulta.get("buscar", ""))
+        df = self.model.df_inv.loc[indices]
+        return [{"id": int(idx), **fila} for idx, fila in zip(df.index, frame_records(df, HEADERS))]
+
+    def ver_producto(self, idx, consulta, cuerpo):
+        return self._fila(self._idx(idx))
+
+    def listar_movimientos(self, consulta, cuerpo):
+        buscar = consulta.get("buscar", "")
+        log = self.model.movimientos
+        indices = np.asarray(self.model.search_movements(buscar)) if buscar.strip() else np.arange(len(log))
+        ultimos = safe_int(consulta.get("ultimos"), 100)
+        if ultimos > 0:
+            indices = indices[-ultimos:]
+        return frame_records(log.take(indices), MOV_HEADERS)
+
+    def reporte(self, consulta, cuerpo):
+        return reporte_inventario(self.model)
+
+    # --- escrituras ---
+    def agregar_producto(self, consulta, cuerpo):
+        producto = _campo(cuerpo, "Producto")
+        if producto is pd.NA:
+            raise ErrorAPI(400, "El campo 'Producto' es obligatorio")
+        if self.model.find_product(producto, partial=False):
+            raise ErrorAPI(409, "El producto ya existe")
+        minimo = cuerpo.get("Stock Mínimo")
+        idx = self.model.add_product(
+            producto, _campo(cuerpo, "Categoría"), _campo(cuerpo, "Proveedor"),
+            _entero(cuerpo.get("Stock Inicial", 0), "Stock Inicial"),
+            pd.NA if minimo is None else _entero(minimo, "Stock Mínimo"),
+            _numero(cuerpo.get("Precio Unitario", 0.0), "Precio Unitario"),
+            _campo(cuerpo, "Usuario Responsable"), _campo(cuerpo, "Observaciones"))
+        return self._fila(idx)
+
+    def _version(self, cuerpo):
+        version = cuerpo.get("Versión")
+        return None if version is None else _entero(version, "Versión")
+
+    def editar_producto(self, idx, consulta, cuerpo):
+        self._idx(idx)
+        version = self._version(cuerpo)
+        cuerpo = {k: v for k, v in cuerpo.items() if k != "Versión"}
+        desconocidos = set(cuerpo) - set(CAMPOS_EDITABLES)
+        if desconocidos:
+            raise ErrorAPI(400, f"Campos no editables: {', '.join(sorted(desconocidos))}")
+        fields = {}
+        for col in cuerpo:
+            if col == "Stock Mínimo":
+                fields[col] = pd.NA if cuerpo[col] is None else _entero(cuerpo[col], col)
+            elif col == "Precio Unitario":
+                fields[col] = _numero(cuerpo[col], col)
+            else:
+                fields[col] = _campo(cuerpo, col)
+        if fields.get("Producto", "") is pd.NA:
+            raise ErrorAPI(400, "El campo 'Producto' es obligatorio")
+        if "Producto" in fields and any(i != idx for i in self.model.find_product(fields["Producto"], partial=False)):
+            raise ErrorAPI(409, "El producto ya existe")
+        if fields:
+            # Tras una recarga el producto puede tener otro id
+            idx = self.model.update_product(idx, fields, version)
+        return self._fila(idx)
+
+    def eliminar_producto(self, idx, consulta, cuerpo):
+        fila = self._fila(self._idx(idx))
+        self.model.delete_product(idx)
+        return fila
+
+    def _linea(self, mov, n=None):
+        """(idx, tipo, cantidad) de un movimiento del cuerpo: por "id" o por "Producto"."""
+        donde = "" if n is None else f"Movimiento {n}: "
+        if "id" in mov:
+            idx = _entero(mov["id"], "id")
+            if idx not in self.model.df_inv.index:
+                raise ErrorAPI(404, f"{donde}no existe el producto {idx}")
+        else:
+            encontrados = self.model.find_product(texto(mov.get("Producto")), partial=False)
+            if not encontrados:
+                raise ErrorAPI(404, f"{donde}el producto '{texto(mov.get('Producto'))}' no existe")
+            idx = encontrados[0]
+        tipo = texto(mov.get("Tipo"))
+        return idx, TIPOS_MOVIMIENTO.get(tipo.lower(), tipo), _entero(mov.get("Cantidad"), "Cantidad")
+
+    def registrar_movimiento(self, consulta, cuerpo):
+        idx, tipo, cantidad = self._linea(cuerpo)
+        self.model.record_movement(idx, tipo, cantidad, _campo(cuerpo, "Usuario"),
+                                   _campo(cuerpo, "Observaciones"), self._version(cuerpo))
+        # Con un único escritor, el último movimiento del historial es este
+        ultimo = len(self.model.movimientos) - 1
+        return {"movimiento": record_row(self.model.movimientos.row(ultimo), MOV_HEADERS),
+                "producto": self._fila(idx)}
+
+    def registrar_lote(self, consulta, cuerpo):
+        movimientos = cuerpo.get("movimientos")
+        if not isinstance(movimientos, list) or not movimientos:
+            raise ErrorAPI(400, "'movimientos' debe ser una lista no vacía")
+        lines = [self._linea(mov, n) for n, mov in enumerate(movimientos, start=1)]
+        # Todo el lote se valida antes de aplicar nada (ver record_movements)
+        indices = self.model.record_movements(lines, _campo(cuerpo, "Usuario"), _campo(cuerpo, "Observaciones"))
+        return {"movimientos": len(indices),
+                "productos": [self._fila(idx) for idx in dict.fromkeys(idx for idx, _, _ in lines)]}
+
+    def respaldo(self, consulta, cuerpo):
+        nombre = get_backend().backup()
+        if not nombre:
+            raise ErrorAPI(500, "No se pudo crear el respaldo")
+        return {"respaldo": nombre}
+
+    # (método, ruta) -> (acceso, operación, estado si sale bien)
+    RUTAS = {
+        ("GET", "productos"): ("leer", "listar_productos", 200),
+        ("GET", "productos", "<id>"): ("leer", "ver_producto", 200),
+        ("POST", "productos"): ("escribir", "agregar_producto", 201),
+        ("PATCH", "productos", "<id>"): ("escribir", "editar_producto", 200),
+        ("DELETE", "productos", "<id>"): ("escribir", "eliminar_producto", 200),
+        ("GET", "movimientos"): ("leer", "listar_movimientos", 200),
+        ("POST", "movimientos"): ("escribir", "registrar_movimiento", 201),
+        ("POST", "movimientos", "lote"): ("escribir", "registrar_lote", 201),
+        ("GET", "reporte"): ("leer", "reporte", 200),
+        ("POST", "respaldo"): ("escribir", "respaldo", 201),
+    }
+
+class ManejadorAPI(BaseHTTPRequestHandler):
+    """Traduce cada petición HTTP a InventarioAPI.despachar y responde JSON."""
+    server_version = "Inventario/1.0"
+    silencioso = False
+
+    def _atender(self):
+        url = urlsplit(self.path)
+        consulta = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            largo = int(self.headers.get("Content-Length") or 0)
+            cuerpo = json.loads(self.rfile.read(largo)) if largo else {}
+            if not isinstance(cuerpo, dict):
+                raise ErrorAPI(400, "El cuerpo debe ser un objeto JSON")
+            estado, datos = self.server.api.despachar(self.command, url.path, consulta, cuerpo)
+        except ErrorAPI as e:
+            estado, datos = e.estado, {"error": str(e)}
+        except Conflicto as e:  # otro proceso escribió o tiene el bloqueo
+            estado, datos = 409, {"error": str(e)}
+        except ValueError as e:  # JSON inválido o validación del modelo
+            estado, datos = 400, {"error": str(e)}
+        except Exception as e:
+            estado, datos = 500, {"error": f"{type(e).__name__}: {e}"}
+        respuesta = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _atender
+
+    def log_message(self, formato, *args):
+        if not self.silencioso:
+            super().log_message(formato, *args)
+
+def crear_servidor(model, host=HOST_API, puerto=PUERTO_API):
+    """ThreadingHTTPServer listo para serve_forever; su InventarioAPI queda en `.api`."""
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorAPI)
+    servidor.api = InventarioAPI(model)
+    return servidor
+
+# ============== LÍNEA DE COMANDOS ==============
+def _producto(model, nombre):
+    encontrados = model.find_product(nombre, partial=False)
+    if not encontrados:
+        raise ValueError(f"El producto '{nombre}' no existe")
+    return encontrados[0]
+
+def _opcional(valor):
+    """Texto de una opción de la línea de comandos; vacío -> NA."""
+    return valor.strip() or pd.NA
+
+def _cmd_productos(model, args):
+    indices = model.filter_products(args.buscar)
+    print(model.df_inv.loc[indices, HEADERS].to_string() if len(indices) else "Sin productos")
+
+def _cmd_agregar(model, args):
+    producto = args.producto.strip()
+    if not producto:
+        raise ValueError("El nombre del producto es obligatorio")
+    if model.find_product(producto, partial=False):
+        raise ValueError("El producto ya existe")
+    model.add_product(producto, _opcional(args.categoria), _opcional(args.proveedor), args.stock,
+                      pd.NA if args.minimo is None else args.minimo, args.precio,
+                      _opcional(args.usuario), _opcional(args.obs))
+    print(f"Producto '{producto}' agregado")
+
+def _cmd_editar(model, args):
+    idx = _producto(model, args.producto)
+    campos = {"Producto": args.nombre, "Categoría": args.categoria, "Proveedor": args.proveedor,
+              "Usuario Responsable": args.usuario, "Observaciones": args.obs}
+    fields = {col: _opcional(v) for col, v in campos.items() if v is not None}
+    if fields.get("Producto") is pd.NA:
+        raise ValueError("El nombre del producto es obligatorio")
+    if args.minimo is not None:
+        fields["Stock Mínimo"] = pd.NA if args.minimo < 0 else args.minimo
+    if args.precio is not None:
+        fields["Precio Unitario"] = args.precio
+    if not fields:
+        raise ValueError("No se indicó ningún campo para editar")
+    model.update_product(idx, fields)
+    print(f"Producto '{args.producto}' actualizado")
+
+def _cmd_eliminar(model, args):
+    model.delete_product(_producto(model, args.producto))
+    print(f"Producto '{args.producto}' eliminado")
+
+def _cmd_movimiento(model, args):
+    tipo = TIPOS_MOVIMIENTO[args.tipo]
+    stock = model.record_movement(_producto(model, args.producto), tipo, args.cantidad,
+                                  _opcional(args.usuario), _opcional(args.obs))
+    print(f"{tipo} registrada; stock de '{args.producto}': {stock}")
+
+def _cmd_lote(model, args):
+    if args.archivo == "-":
+        texto_lote = sys.stdin.read()
+    else:
+        with open(args.archivo, encoding="utf-8") as f:
+            texto_lote = f.read()
+    entries, errores = parse_lote(texto_lote, TIPOS_MOVIMIENTO[args.tipo])
+    lines, faltantes = model.resolve_movements(entries)
+    errores += faltantes
+    if not errores:
+        errores = model.validate_movements(lines)
+    if errores:
+        raise ValueError("\n".join(errores))
+    model.record_movements(lines, _opcional(args.usuario), _opcional(args.obs))
+    print(f"{len(lines)} movimientos registrados")
+
+def _cmd_importar(model, args):
+    res = model.import_file(args.archivo)
+    print(f"{res.aceptadas} {res.tipo} importados")
+    if res.rechazadas:
+        reporte = os.path.splitext(args.archivo)[0] + "_rechazos.csv"
+        res.write_rejects(reporte)
+        print(f"{res.rechazadas} filas rechazadas, detalle en {reporte}")
+
+def _cmd_movimientos(model, args):
+    # Sin consulta no hace falta armar el DataFrame del historial completo
+    if args.buscar.strip():
+        indices = np.asarray(model.search_movements(args.buscar))
+    else:
+        indices = np.arange(len(model.movimientos))
+    df = model.movimientos.take(indices[-args.ultimos:] if args.ultimos else indices)
+    print(df.to_string() if len(df) else "Sin movimientos")
+
+def _cmd_reporte(model, args):
+    reporte = reporte_inventario(model)
+    if args.json:
+        print(json.dumps(reporte, ensure_ascii=False, indent=2))
+        return
+    print(f"Productos: {reporte['productos']}")
+    print(f"Unidades en stock: {reporte['unidades']}")
+    print(f"Valor total: ${reporte['valor_total']:,.2f}")
+    print(f"Movimientos: {reporte['movimientos']}")
+    for categoria, stock in reporte["por_categoria"].items():
+        print(f"  {categoria}: {stock}")
+    print(f"Stock bajo: {len(reporte['stock_bajo'])}")
+    for bajo in reporte["stock_bajo"]:
+        print(f"  {bajo['producto']}: {bajo['stock']} (mínimo {bajo['minimo']})")
+
+def _cmd_exportar(model, args):
+    if args.tabla == "libro":
+        # Vuelca el diario al libro principal (y crea el respaldo)
+        if args.destino:
+            raise ValueError("'exportar libro' escribe el archivo principal, no lleva destino")
+        model.save()
+        model.writer.wait()
+        print(f"Datos guardados en {get_backend().files()[0]}")
+        return
+    if not args.destino:
+        raise ValueError(f"Falta el archivo de destino para '{args.tabla}'")
+    filas = exportar(model, args.tabla, args.destino)
+    print(f"{filas} filas exportadas a {args.destino}")
+
+def _cmd_respaldo(model, args):
+    if not get_backend().backup():
+        raise ValueError("No se pudo crear el respaldo")
+    print("Respaldo creado")
+
+def _cmd_servir(model, args):
+    servidor = crear_servidor(model, args.host, args.puerto)
+    print(f"API del inventario en http://{args.host}:{servidor.server_port} (Ctrl+C para terminar)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servidor.api.cerrar()
+
+def _parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="inventario_core.py",
+        description="Inventario sin interfaz gráfica. Cada comando carga los datos, "
+                    "aplica la operación y la guarda; el diario se exporta al libro "
+                    "cada EXPORTAR_CADA operaciones o con 'exportar libro'.")
+    sub = parser.add_subparsers(required=True, metavar="comando")
+
+    def comando(nombre, funcion, ayuda):
+        p = sub.add_parser(nombre, help=ayuda, description=ayuda)
+        p.set_defaults(comando=funcion)
+        return p
+
+    def autor(p):
+        p.add_argument("--usuario", default="", help="usuario responsable")
+        p.add_argument("--obs", default="", help="observaciones")
+
+    p = comando("productos", _cmd_productos, "lista los productos")
+    p.add_argument("--buscar", default="", help="texto en nombre, categoría o proveedor")
+
+    p = comando("agregar", _cmd_agregar, "agrega un producto")
+    p.add_argument("producto")
+    p.add_argument("--categoria", default="")
+    p.add_argument("--proveedor", default="")
+    p.add_argument("--stock", type=int, default=0, help="stock inicial")
+    p.add_argument("--minimo", type=int, help="stock mínimo")
+    p.add_argument("--precio", type=float, default=0.0, help="precio unitario")
+    autor(p)
+
+    p = comando("editar", _cmd_editar, "edita los campos indicados de un producto (vacío = borrar)")
+    p.add_argument("producto")
+    p.add_argument("--nombre", help="nuevo nombre")
+    p.add_argument("--categoria")
+    p.add_argument("--proveedor")
+    p.add_argument("--minimo", type=int, help="stock mínimo (negativo = sin mínimo)")
+    p.add_argument("--precio", type=float, help="precio unitario")
+    p.add_argument("--usuario")
+    p.add_argument("--obs")
+
+    p = comando("eliminar", _cmd_eliminar, "elimina un producto")
+    p.add_argument("producto")
+
+    p = comando("movimiento", _cmd_movimiento, "registra una entrada o salida")
+    p.add_argument("producto")
+    p.add_argument("tipo", choices=sorted(TIPOS_MOVIMIENTO))
+    p.add_argument("cantidad", type=int)
+    autor(p)
+
+    p = comando("lote", _cmd_lote, "registra un lote de movimientos (producto; tipo; cantidad por línea)")
+    p.add_argument("archivo", help="archivo de texto, o - para leer de la entrada estándar")
+    p.add_argument("--tipo", choices=sorted(TIPOS_MOVIMIENTO), default="entrada",
+                   help="tipo de las líneas que no lo indican")
+    autor(p)
+
+    p = comando("importar", _cmd_importar, "importa productos o movimientos desde un CSV/xlsx")
+    p.add_argument("archivo")
+
+    p = comando("movimientos", _cmd_movimientos, "lista o busca en el historial de movimientos")
+    p.add_argument("--buscar", default="", help="consulta (ver MovimientoIndex)")
+    p.add_argument("--ultimos", type=int, default=50, help="cuántos mostrar (0 = todos)")
+
+    p = comando("reporte", _cmd_reporte, "resumen del inventario y stock bajo")
+    p.add_argument("--json", action="store_true")
+
+    p = comando("exportar", _cmd_exportar, "exporta una tabla a CSV o Excel, o el diario al libro")
+    p.add_argument("tabla", choices=list(EXPORTES) + ["libro"])
+    p.add_argument("destino", nargs="?", help="archivo .csv o .xlsx (no va con 'libro')")
+
+    comando("respaldo", _cmd_respaldo, "crea un respaldo manual")
+
+    p = comando("servir", _cmd_servir, "atiende la API HTTP/JSON local hasta Ctrl+C")
+    p.add_argument("--host", default=HOST_API)
+    p.add_argument("--puerto", type=int, default=PUERTO_API)
+    return parser
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos; devuelve el código de salida."""
+    args = _parser().parse_args(argv)
+    model = InventarioModel()
+    try:
+        args.comando(model, args)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        model.close(exportar=False)
+    if model.save_error:
+        print(f"Error al guardar: {model.save_error}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inventario_core as core
+
+
+def _olvidar():
+    core._backend = None
+    core._stores.clear()
+    core._bloqueos.clear()
+
+
+@pytest.fixture
+def abrir(tmp_path, monkeypatch):
+    """abrir(modo, exportar_cada=None) -> InventarioModel sobre una carpeta vacía.
+
+    Cada llamada arranca como un proceso nuevo: sin backend, respaldos ni
+    bloqueos en memoria, así lo que se ve es lo que quedó en disco.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(core, "MODO_GUARDADO", core.MODO_GUARDADO)
+    modelos = []
+
+    def _abrir(modo, exportar_cada=None):
+        for model in modelos:
+            model.writer.wait()
+        _olvidar()
+        core.MODO_GUARDADO = modo
+        if modo == "journal" and exportar_cada is not None:
+            core._backend = core.JournalBackend(exportar_cada=exportar_cada)
+        model = core.InventarioModel()
+        modelos.append(model)
+        return model
+
+    yield _abrir
+    for model in modelos:
+        model.writer.wait()
+    _olvidar()
@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+import inventario_core as core
+
+
+def estado(model):
+    """(productos con su stock, movimientos por producto), sin depender del orden."""
+    productos = sorted(zip(model.df_inv["Producto"], model.df_inv["Stock Final"].astype(int)))
+    movimientos = model.df_mov.groupby("Producto", observed=True).size()
+    return productos, {k: int(v) for k, v in movimientos.items() if v}
+
+
+# ============== RENOMBRAR ==============
+@pytest.mark.parametrize("modo, exportar_cada", [
+    ("journal", 1000),  # todo queda en el diario: se reconstruye con replay
+    ("journal", 2),     # renombrados repartidos entre exportaciones y diario
+    ("sqlite", None),
+    ("excel", None),
+])
+def test_renombrado_persiste(abrir, modo, exportar_cada):
+    model = abrir(modo, exportar_cada)
+    tornillo = model.add_product("Tornillo", stock_inicial=10)
+    b = model.add_product("B", stock_inicial=3)
+    model.record_movement(tornillo, "Entrada", 5)
+    model.update_product(tornillo, {"Producto": "Tornillo M6"})
+    model.record_movement(tornillo, "Salida", 2)
+    # El nombre viejo queda libre para otro producto
+    nuevo = model.add_product("Tornillo", stock_inicial=1)
+    model.record_movement(nuevo, "Entrada", 1)
+    model.update_product(b, {"Producto": "b"})  # solo cambian mayúsculas
+
+    esperado = ([("Tornillo", 2), ("Tornillo M6", 13), ("b", 3)], {"Tornillo M6": 2, "Tornillo": 1})
+    assert estado(model) == esperado
+    # Sin cerrar: otro proceso lee lo que quedó en disco
+    assert estado(abrir(modo, exportar_cada)) == esperado
+
+
+@pytest.mark.parametrize("modo", ["journal", "sqlite"])
+def test_renombrar_a_un_nombre_usado(abrir, modo):
+    model = abrir(modo)
+    a = model.add_product("Tuerca", stock_inicial=5)
+    model.add_product("Tornillo", stock_inicial=3)
+    with pytest.raises(core.Conflicto):
+        model.update_product(a, {"Producto": "tornillo"})
+    assert sorted(model.df_inv["Producto"]) == ["Tornillo", "Tuerca"]
+    assert sorted(abrir(modo).df_inv["Producto"]) == ["Tornillo", "Tuerca"]
+
+
+def test_renombrado_mueve_el_historial(abrir):
+    model = abrir("journal")
+    idx = model.add_product("Tornillo", stock_inicial=10)
+    model.record_movement(idx, "Salida", 4)
+    core.datos_grafico(model, "evolucion")  # el historial ya está procesado
+    model.update_product(idx, {"Producto": "Tornillo M6"})
+
+    assert list(model.df_mov["Producto"]) == ["Tornillo M6"]
+    assert len(model.search_movements("producto:tornillo")) == 1
+    assert len(model.search_movements('producto:"tornillo m6"')) == 1
+    assert core.datos_grafico(model, "evolucion", filtro="tornillo m6").iloc[-1] == 6
+
+
+# ============== DIARIO ==============
+def test_exportaciones_superpuestas_no_pierden_operaciones(abrir):
+    abrir("journal", exportar_cada=1000)
+    backend = core.get_backend()
+    for i in range(3):
+        backend.append("eliminar", producto=f"a{i}")
+    primera = backend.marca()
+    for i in range(2):
+        backend.append("eliminar", producto=f"b{i}")
+    segunda = backend.marca()  # la segunda foto se pide antes de que termine la primera
+
+    backend.clear_journal(primera)
+    for i in range(2):
+        backend.append("eliminar", producto=f"c{i}")
+    backend.clear_journal(segunda)
+
+    assert [r["producto"] for r in backend.read_journal()] == ["c0", "c1"]
+    assert backend.pendientes == 2
+
+
+def test_replay_fusiona_operaciones_viejas():
+    df_inv = pd.DataFrame([{"Producto": "P", "Stock Inicial": 10, "Entradas": 0, "Salidas": 0,
+                            "Stock Final": 10, "Precio Unitario": 2.0, "Versión": 3}],
+                          columns=core.HEADERS)
+    df_mov = pd.DataFrame(columns=core.MOV_HEADERS)
+    # Movimiento y edición calculados por otro proceso sobre la versión 2
+    vieja = {"Producto": "P", "Stock Inicial": 10, "Entradas": 5, "Salidas": 0,
+             "Stock Final": 15, "Precio Unitario": 2.0, "Versión": 3}
+    mov = {"Producto": "P", "Tipo": "Entrada", "Cantidad": 5, "Stock Antes": 10, "Stock Después": 15}
+    edicion = dict(vieja, **{"Entradas": 0, "Stock Final": 10, "Precio Unitario": 4.0, "Versión": 3})
+    records = [{"op": "movimiento", "row": vieja, "mov": mov},
+               {"op": "producto", "row": edicion}]
+
+    df_inv, df_mov = core.JournalBackend.replay(df_inv, df_mov, records)
+    fila = df_inv.iloc[0]
+    assert fila["Entradas"] == 5 and fila["Stock Final"] == 15
+    assert fila["Precio Unitario"] == 4.0 and fila["Versión"] == 5
+    assert list(df_mov["Stock Antes"]) == [10] and list(df_mov["Stock Después"]) == [15]
+
+
+def test_linea_de_comandos_no_exporta_el_diario(abrir):
+    abrir("journal", exportar_cada=1000)
+    assert core.main(["agregar", "Tornillo", "--stock", "10"]) == 0
+    core._backend = core.JournalBackend(exportar_cada=1000)
+    libro = core.os.stat(core.ARCHIVO_EXCEL).st_mtime_ns
+    assert core.main(["movimiento", "Tornillo", "salida", "4"]) == 0
+
+    backend = core.get_backend()
+    assert core.os.stat(core.ARCHIVO_EXCEL).st_mtime_ns == libro
+    assert [r["op"] for r in backend.read_journal()][-1] == "movimiento"
+    assert estado(abrir("journal", exportar_cada=1000)) == ([("Tornillo", 6)], {"Tornillo": 1})
+
+    assert core.main(["exportar", "libro"]) == 0
+    assert core.get_backend().read_journal() == []
+    assert estado(abrir("journal", exportar_cada=1000)) == ([("Tornillo", 6)], {"Tornillo": 1})
+
+
+def test_cerrar_termina_el_hilo_de_guardado(abrir):
+    model = abrir("journal", exportar_cada=1)
+    model.add_product("Tornillo", stock_inicial=1)  # exporta en segundo plano
+    model.close()
+    assert not model.writer._thread.is_alive()
+    assert estado(abrir("journal")) == ([("Tornillo", 1)], {})
+
+
+# ============== RESPALDOS ==============
+def test_recupera_de_una_cadena_de_respaldos_podada(abrir, monkeypatch):
+    model = abrir("journal", exportar_cada=4)
+    for i in range(10):
+        idx = model.add_product(f"P{i}", stock_inicial=5)
+        model.record_movement(idx, "Salida", 1)
+        model.writer.wait()
+    esperado = estado(model)
+
+    store = core.backup_store()
+    assert len(store.list()) >= 4
+    # Respaldos de las últimas horas, uno por hora salvo los dos últimos
+    ahora = datetime.now()
+    for k, entrada in enumerate(store.entradas):
+        entrada["fecha"] = (ahora - timedelta(hours=3 * (len(store.entradas) - k))).isoformat(timespec="seconds")
+    monkeypatch.setattr(core, "RETENER_ULTIMOS", 2)
+    monkeypatch.setattr(core, "RETENER_HORAS", 12)
+    monkeypatch.setattr(core, "RETENER_DIAS", 1)
+    antes = len(store.entradas)
+    store.prune()
+    store._write_catalog()
+    assert len(store.entradas) < antes
+
+    # Libro principal y el respaldo más nuevo dañados: hay que usar el anterior
+    # con los diarios que se le unieron al podar
+    with open(core.ARCHIVO_EXCEL, "wb") as f:
+        f.write(b"no es un libro")
+    with open(store._object(store.entradas[-1]["hash"]), "wb") as f:
+        f.write(core.gzip.compress(b"tampoco"))
+    assert estado(abrir("journal", exportar_cada=4)) == esperado
+
+
+# ============== CACHÉ ==============
+def test_cache_del_libro_sin_releer_al_guardar(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend = core.ExcelBackend("libro.xlsx")
+    df_inv = pd.DataFrame([{"Producto": "P", "Stock Inicial": 1, "Stock Final": 1}], columns=core.HEADERS)
+    df_mov = pd.DataFrame(columns=core.MOV_HEADERS)
+    lecturas = []
+    monkeypatch.setattr(core, "file_hash", lambda path: lecturas.append(path) or "h")
+    backend.save(*core.normalize_frames(df_inv, df_mov))
+    assert lecturas == []  # la clave del libro recién escrito es fecha y tamaño
+
+    leer = core.ExcelBackend.read
+    monkeypatch.setattr(core.ExcelBackend, "read", staticmethod(lambda path: pytest.fail("leyó el libro")))
+    assert list(backend.load()[0]["Producto"]) == ["P"]
+
+    # Otra fecha con la caché sin hash: se vuelve a leer el libro una vez
+    st = core.os.stat("libro.xlsx")
+    core.os.utime("libro.xlsx", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    monkeypatch.setattr(core.ExcelBackend, "read", staticmethod(leer))
+    assert list(backend.load()[0]["Producto"]) == ["P"]
+    assert lecturas == ["libro.xlsx"]
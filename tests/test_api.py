@@ -0,0 +1,56 @@
+import pytest
+
+import inventario_core as core
+
+
+@pytest.fixture
+def api(abrir):
+    """abrir(modo) -> InventarioAPI sobre un modelo nuevo; se cierra al terminar."""
+    apis = []
+
+    def _api(modo):
+        api = core.InventarioAPI(abrir(modo))
+        apis.append(api)
+        return api
+
+    yield _api
+    for api in apis:
+        api.cerrar()
+
+
+def test_escrituras_con_sqlite_llegan_a_la_base(api, abrir):
+    # La conexión se abre en este hilo y las escrituras van por el hilo escritor
+    inventario = api("sqlite")
+    estado, fila = inventario.despachar("POST", "/productos", {}, {"Producto": "Tornillo", "Stock Inicial": 10,
+                                                                   "Precio Unitario": 0.5})
+    assert estado == 201
+    estado, _ = inventario.despachar("POST", "/movimientos", {}, {"id": fila["id"], "Tipo": "salida", "Cantidad": 4})
+    assert estado == 201
+    estado, _ = inventario.despachar("PATCH", f"/productos/{fila['id']}", {}, {"Precio Unitario": 2})
+    assert estado == 200
+    assert inventario.model.save_error is None
+
+    model = abrir("sqlite")
+    assert list(model.df_inv["Stock Final"]) == [6] and list(model.df_inv["Precio Unitario"]) == [2.0]
+    assert len(model.df_mov) == 1
+
+
+def test_escritura_que_no_se_guarda_responde_500(api, monkeypatch):
+    inventario = api("sqlite")
+    monkeypatch.setattr(core.SQLiteBackend, "apply", lambda self, op, **data: 1 / 0)
+    with pytest.raises(core.ErrorAPI) as error:
+        inventario.despachar("POST", "/productos", {}, {"Producto": "Tornillo"})
+    assert error.value.estado == 500
+
+
+@pytest.mark.parametrize("precio", ["abc", None, True, float("nan")])
+def test_precio_invalido_responde_400(api, precio):
+    inventario = api("journal")
+    with pytest.raises(core.ErrorAPI) as error:
+        inventario.despachar("POST", "/productos", {}, {"Producto": "Tornillo", "Precio Unitario": precio})
+    assert error.value.estado == 400
+    _, fila = inventario.despachar("POST", "/productos", {}, {"Producto": "Tuerca"})
+    with pytest.raises(core.ErrorAPI) as error:
+        inventario.despachar("PATCH", f"/productos/{fila['id']}", {}, {"Precio Unitario": precio})
+    assert error.value.estado == 400
+    assert list(inventario.model.df_inv["Producto"]) == ["Tuerca"]
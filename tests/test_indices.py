@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import inventario_core as core
+
+CONSULTAS = [
+    "producto:tor", "producto:TUERCA", 'producto:"tornillo m6"', "tipo:sal",
+    "usuario:ana tipo:entrada", "obs:dev", 'obs:"pedido 1"', '"pedido 12"',
+    "fecha:2024-03", "fecha:10:", "12", "ana", "cliente tuerca", "xyz",
+    "usuario:", "",
+]
+
+
+def movimientos(n, semilla):
+    rng = np.random.default_rng(semilla)
+    productos = np.array(["Tornillo M6", "Tornillo M8", "Tuerca", "tuerca ancha", "Arandela", None], dtype=object)
+    usuarios = np.array(["ana", "Anabel", "luis", None], dtype=object)
+    obs = np.array(["pedido 12", "Pedido 120 urgente", "devolución cliente", "sin stock", None], dtype=object)
+    fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 200 * 86_400, n), unit="s")
+    df = pd.DataFrame({
+        "Fecha": fechas,
+        "Producto": productos[rng.integers(0, len(productos), n)],
+        "Tipo": np.where(rng.random(n) < 0.5, "Entrada", "Salida"),
+        "Cantidad": rng.integers(1, 10, n),
+        "Usuario": usuarios[rng.integers(0, len(usuarios), n)],
+        "Observaciones": obs[rng.integers(0, len(obs), n)],
+        "Stock Antes": 0,
+        "Stock Después": 0,
+    }, columns=core.MOV_HEADERS)
+    df.loc[rng.random(n) < 0.05, "Fecha"] = pd.NaT
+    return core.normalize_frames(pd.DataFrame(columns=core.HEADERS), df)[1]
+
+
+def fuerza_bruta(df, consulta):
+    """Filas que cumplen la consulta recorriendo el historial completo."""
+    terminos = core.MovimientoIndex.parse(consulta)
+    if not terminos:
+        return None
+    textos = {col: core.MovimientoIndex._text(df, col) for col in core.MovimientoIndex.COLUMNS}
+    filas = np.ones(len(df), dtype=bool)
+    for col, termino in terminos:
+        columnas = core.MovimientoIndex.COLUMNS if col is None else [col]
+        filas &= np.logical_or.reduce([textos[c].str.contains(termino, regex=False).to_numpy()
+                                       for c in columnas])
+    return df.index[filas].to_numpy()
+
+
+@pytest.mark.parametrize("semilla", [0, 1, 2])
+def test_indice_de_movimientos_contra_fuerza_bruta(semilla):
+    df = movimientos(600, semilla)
+    # Parte al crearlo, parte de a una fila y parte en bloque, como en el modelo
+    indice = core.MovimientoIndex(df.iloc[:400])
+    indice.add(df.iloc[400:410])
+    indice.add(df.iloc[410:])
+    for consulta in CONSULTAS:
+        esperado = fuerza_bruta(df, consulta)
+        obtenido = indice.search(df, consulta)
+        if esperado is None:
+            assert obtenido is None, consulta
+        else:
+            assert list(obtenido) == list(esperado), consulta
+
+
+def test_indice_de_movimientos_renombrar():
+    df = movimientos(200, 3)
+    indice = core.MovimientoIndex(df)
+    indice.renombrar("Tuerca", "Tornillo M6")
+    df = core.renombrar_movimientos(df, "Tuerca", "Tornillo M6")
+    for consulta in ("producto:tuerca", 'producto:"tornillo m6"', "producto:tor"):
+        assert list(indice.search(df, consulta)) == list(fuerza_bruta(df, consulta)), consulta